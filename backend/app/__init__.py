@@ -30,4 +30,8 @@ def create_app(config_class):
     with app.app_context():
         db.create_all()
 
+    if app.config.get('SEARCH_WARMUP'):
+        from .services.search_service import search_service_instance
+        search_service_instance.warm_up(background=True)
+
     return app
@@ -2,6 +2,19 @@ from flask import jsonify, request
 from app.models import *
 from . import admin_bp
 from .decorators import admin_required
+from app.services.recommendation_service import notify_active_products_changed
+from app.services.search_service import search_service_instance
+
+
+def _sync_search_index(product):
+    """ Cập nhật FAISS index ngay sau khi commit; lỗi chỉ log, job auto_rebuild_search sẽ bù lại. """
+    try:
+        if product.is_active:
+            search_service_instance.upsert_products([product])
+        else:
+            search_service_instance.remove_products([product.id])
+    except Exception as e:
+        print(f"[WARN] Could not update search index for product {product.id}: {e}")
 
 
 # ==========================================
@@ -67,6 +80,7 @@ def create_product():
                 db.session.add(association)
 
         db.session.commit()
+        _sync_search_index(new_product)
         return jsonify({
             "message": "Product created successfully",
             "product_id": new_product.id
@@ -93,6 +107,9 @@ def update_product(product_id):
 
     data = request.get_json()
     try:
+        # Chỉ tên sản phẩm được encode vào index tìm kiếm
+        search_text_changed = "name" in data and data["name"] != product.name
+
         # 1. Update thông tin cơ bản (Nếu có gửi lên mới update)
         if "name" in data: product.name = data["name"]
         if "desc" in data: product.desc = data["desc"]
@@ -102,6 +119,7 @@ def update_product(product_id):
 
         if "price" in data: product.price = float(data["price"])
         if "stock_quantity" in data: product.stock_quantity = int(data["stock_quantity"])
+        active_changed = "is_active" in data and bool(data["is_active"]) != product.is_active
         if "is_active" in data: product.is_active = bool(data["is_active"])
 
         # Update ID
@@ -132,6 +150,11 @@ def update_product(product_id):
                     db.session.add(association)
 
         db.session.commit()
+        if active_changed:
+            # Cho các worker recommendation biết để làm mới mask sản phẩm active
+            notify_active_products_changed()
+        if active_changed or (search_text_changed and product.is_active):
+            _sync_search_index(product)
         return jsonify({"message": "Product updated successfully"}), 200
 
     except Exception as e:
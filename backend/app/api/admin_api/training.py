@@ -3,6 +3,8 @@ from flask import jsonify, Blueprint
 from . import admin_bp
 from .decorators import admin_required
 import time
+from app.services.recommendation_service import get_hybrid_source_stats
+from app.services.search_service import search_service_instance
 training_bp = Blueprint('training', __name__, url_prefix='/training')
 admin_bp.register_blueprint(training_bp)
 
@@ -68,6 +70,18 @@ def train_sentiment():
 def get_status():
     return jsonify(TRAINING_STATUS)
 
+@training_bp.route('/recommendation/latency', methods=['GET'])
+@admin_required
+def get_recommendation_latency():
+    """ Latency theo từng nguồn candidate của hybrid ranker (trong worker hiện tại). """
+    return jsonify(get_hybrid_source_stats())
+
+@training_bp.route('/search/embedding-cache', methods=['GET'])
+@admin_required
+def get_search_embedding_cache_stats():
+    """ Hit ratio (LRU / Redis) và latency encode của cache embedding truy vấn (trong worker hiện tại). """
+    return jsonify(search_service_instance.embedding_cache.stats())
+
 @training_bp.route('/recommendation', methods=['POST'])
 @admin_required
 def api_train_recommendation():
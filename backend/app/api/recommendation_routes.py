@@ -1,17 +1,26 @@
 # recommendation_routes.py
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy.orm import joinedload
 from app.services.recommendation_service import (
     get_similar_products,
-    get_collaborative_recommendations,
-    get_top_products
+    get_similar_products_batch,
+    get_hybrid_recommendations,
+    get_top_products,
+    get_bought_together,
+    get_session_recommendations
 )
+from app.services.cart_service import get_cart_product_ids
 # Import model Product mới
 from app.models.product_models import Product
 
 # Đổi tên blueprint nếu muốn, ví dụ: reco_bp
 recommendation_bp = Blueprint("recommendation", __name__, url_prefix="/recommend")
 
+# Giới hạn số sản phẩm nguồn / số gợi ý mỗi sản phẩm của API batch
+MAX_BATCH_SEEDS = 100
+MAX_BATCH_TOP_N = 20
+
 # --- CẬP NHẬT HÀM SERIALIZE ---
 def serialize_product(p):
     """Helper để chuyển Product object sang JSON"""
@@ -27,6 +36,17 @@ def serialize_product(p):
         "rating": rating_value # Dùng avg_rating
     }
 
+def _parse_int(value):
+    """ int từ JSON: không nhận bool, số thực có phần lẻ, inf / nan (int() sẽ cắt / OverflowError). """
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(f"not an integer: {value!r}")
+    return int(value)
+
+def _load_products(product_ids):
+    """ 1 query cho mọi product_id, eager load category (serialize_product không lazy load từng sản phẩm). """
+    products = Product.query.options(joinedload(Product.category)).filter(Product.id.in_(product_ids)).all()
+    return {p.id: p for p in products}
+
 # --- CÁC ROUTE KHÁC GIỮ NGUYÊN LOGIC ---
 @recommendation_bp.route("/similar-products/<int:product_id>", methods=["GET"])
 def get_recommendations(product_id):
@@ -41,8 +61,7 @@ def get_recommendations(product_id):
          return jsonify([]), 200 # Trả về rỗng nếu không tìm thấy
 
     try:
-        products = Product.query.filter(Product.id.in_(product_ids)).all()
-        products_dict = {p.id: p for p in products}
+        products_dict = _load_products(product_ids)
         # Đảm bảo giữ đúng thứ tự gợi ý từ service
         sorted_products = [products_dict[pid] for pid in product_ids if pid in products_dict]
         return jsonify([serialize_product(p) for p in sorted_products]), 200
@@ -50,25 +69,112 @@ def get_recommendations(product_id):
         print(f"Error querying/serializing products: {e}")
         return jsonify({"error": "Failed to retrieve product details"}), 500
 
-@recommendation_bp.route("/for-you", methods=["GET"])
+@recommendation_bp.route("/similar-products", methods=["POST"])
+def get_batch_recommendations():
+    """
+    Sản phẩm tương tự cho nhiều sản phẩm trong 1 request (vd. mọi thẻ sản phẩm / dòng giỏ hàng).
+    Body: {"product_ids": [1, 2, ...], "top_n": 4} -> {"<product_id>": [product, ...], ...}
+    """
+    data = request.get_json(silent=True) or {}
+    seed_ids = data.get("product_ids")
+    if not isinstance(seed_ids, list) or not seed_ids:
+        return jsonify({"error": "product_ids must be a non-empty list"}), 400
+    if len(seed_ids) > MAX_BATCH_SEEDS:
+        return jsonify({"error": f"At most {MAX_BATCH_SEEDS} product_ids per request"}), 400
+    try:
+        seed_ids = [_parse_int(pid) for pid in seed_ids]
+        top_n = _parse_int(data.get("top_n", 4))
+    except (TypeError, ValueError, OverflowError):
+        return jsonify({"error": "product_ids and top_n must be integers"}), 400
+    if top_n < 1:
+        return jsonify({"error": "top_n must be at least 1"}), 400
+    top_n = min(top_n, MAX_BATCH_TOP_N)
+
+    results, status = get_similar_products_batch(seed_ids, top_n=top_n)
+
+    if status == 503:
+         return jsonify({"error": "Recommendation model is currently unavailable. Please try again later."}), status
+    if status != 200:
+        return jsonify({"error": "Could not retrieve recommendations"}), status
+
+    try:
+        products_dict = _load_products({pid for ids in results.values() for pid in ids})
+        return jsonify({
+            str(seed): [serialize_product(products_dict[pid]) for pid in ids if pid in products_dict]
+            for seed, ids in results.items()
+        }), 200
+    except Exception as e:
+        print(f"Error querying/serializing products in batch /similar-products: {e}")
+        return jsonify({"error": "Failed to retrieve product details"}), 500
+
+@recommendation_bp.route("/bought-together/<int:product_id>", methods=["GET"])
+def get_bought_together_recommendations(product_id):
+    """ Sản phẩm thường được mua cùng (đồng xuất hiện trong đơn hàng). """
+    product_ids, status = get_bought_together([product_id], top_n=4)
+
+    if status == 503:
+         return jsonify({"error": "Recommendation model is currently unavailable. Please try again later."}), status
+    if status != 200:
+        return jsonify({"error": "Could not retrieve recommendations"}), status
+    if not product_ids:
+         return jsonify([]), 200
+
+    try:
+        products_dict = _load_products(product_ids)
+        sorted_products = [products_dict[pid] for pid in product_ids if pid in products_dict]
+        return jsonify([serialize_product(p) for p in sorted_products]), 200
+    except Exception as e:
+        print(f"Error querying/serializing products in /bought-together: {e}")
+        return jsonify({"error": "Failed to retrieve product details"}), 500
+
+@recommendation_bp.route("/bought-together/cart", methods=["GET"])
 @jwt_required()
-def get_cf_recommendations():
-    """ API Hybrid: Lấy CF recos, fallback sang Top Products. """
+def get_cart_bought_together_recommendations():
+    """ Gợi ý mua kèm cho cả giỏ hàng: gộp điểm của mọi sản phẩm trong giỏ. """
     try:
         current_user_id = int(get_jwt_identity())
     except ValueError:
         return jsonify({"error": "Invalid user identity"}), 401
 
-    product_ids, status = get_collaborative_recommendations(current_user_id, top_n=6)
+    cart_product_ids = get_cart_product_ids(current_user_id)
+    if not cart_product_ids:
+        return jsonify([]), 200
+
+    product_ids, status = get_bought_together(cart_product_ids, top_n=6)
 
     if status == 503:
          return jsonify({"error": "Recommendation model is currently unavailable. Please try again later."}), status
     if status != 200:
-        return jsonify({"error": "Could not retrieve collaborative recommendations"}), status
+        return jsonify({"error": "Could not retrieve recommendations"}), status
+    if not product_ids:
+         return jsonify([]), 200
+
+    try:
+        products_dict = _load_products(product_ids)
+        sorted_products = [products_dict[pid] for pid in product_ids if pid in products_dict]
+        return jsonify([serialize_product(p) for p in sorted_products]), 200
+    except Exception as e:
+        print(f"Error querying/serializing products in /bought-together/cart: {e}")
+        return jsonify({"error": "Failed to retrieve product details"}), 500
+
+@recommendation_bp.route("/for-you", methods=["GET"])
+@jwt_required()
+def get_cf_recommendations():
+    """ API Hybrid: trộn CF + content (sản phẩm vừa xem) + Top Products, mỗi nguồn có ngân sách thời gian riêng; fallback sang Top Products. """
+    try:
+        current_user_id = int(get_jwt_identity())
+    except ValueError:
+        return jsonify({"error": "Invalid user identity"}), 401
+
+    product_ids, status = get_hybrid_recommendations(current_user_id, top_n=6)
+
+    if status != 200:
+        return jsonify({"error": "Could not retrieve recommendations"}), status
 
-    # Logic Fallback nếu CF trả về rỗng (user mới hoặc đã xem hết)
+    # Logic Fallback nếu không nguồn nào có kết quả kịp ngân sách (user mới, worker vừa khởi động, nguồn chậm):
+    # gọi Top Products trực tiếp, không giới hạn thời gian
     if not product_ids:
-        print(f"CF returned empty for user {current_user_id}. Falling back to top products.")
+        print(f"Hybrid returned empty for user {current_user_id}. Falling back to top products.")
         product_ids, status = get_top_products(top_n=6)
         if status != 200:
             return jsonify({"error": "Could not retrieve fallback recommendations"}), status
@@ -76,18 +182,46 @@ def get_cf_recommendations():
              return jsonify([]), 200 # Trả về rỗng nếu cả fallback cũng rỗng
 
     try:
-        products = Product.query.filter(Product.id.in_(product_ids)).all()
-        products_dict = {p.id: p for p in products}
+        products_dict = _load_products(product_ids)
         sorted_products = [products_dict[pid] for pid in product_ids if pid in products_dict]
         return jsonify([serialize_product(p) for p in sorted_products]), 200
     except Exception as e:
         print(f"Error querying/serializing products in /for-you: {e}")
         return jsonify({"error": "Failed to retrieve product details"}), 500
 
+@recommendation_bp.route("/session", methods=["GET"])
+@jwt_required()
+def get_session_based_recommendations():
+    """ Gợi ý theo phiên: láng giềng của sản phẩm user vừa xem / thêm giỏ, ưu tiên sự kiện mới và mạnh. """
+    try:
+        current_user_id = int(get_jwt_identity())
+    except ValueError:
+        return jsonify({"error": "Invalid user identity"}), 401
+
+    product_ids, status = get_session_recommendations(current_user_id, top_n=6)
+
+    if status == 503:
+         return jsonify({"error": "Recommendation model is currently unavailable. Please try again later."}), status
+    if status != 200:
+        return jsonify({"error": "Could not retrieve recommendations"}), status
+    if not product_ids:
+         return jsonify([]), 200 # Phiên chưa có sự kiện nào
+
+    try:
+        products_dict = _load_products(product_ids)
+        sorted_products = [products_dict[pid] for pid in product_ids if pid in products_dict]
+        return jsonify([serialize_product(p) for p in sorted_products]), 200
+    except Exception as e:
+        print(f"Error querying/serializing products in /session: {e}")
+        return jsonify({"error": "Failed to retrieve product details"}), 500
+
 @recommendation_bp.route("/top-products", methods=["GET"])
 def get_public_recommendations():
-    """ API public: Lấy top sản phẩm bán chạy. """
-    product_ids, status = get_top_products(top_n=6)
+    """ API public: Lấy top sản phẩm bán chạy. Query param tùy chọn: days (cửa sổ N ngày gần nhất). """
+    days = request.args.get("days", type=int)
+    if days is not None and days < 1:
+        return jsonify({"error": "days must be at least 1"}), 400
+    product_ids, status = get_top_products(top_n=6, days=days)
 
     if status != 200:
         return jsonify({"error": "Could not retrieve top products"}), status
@@ -95,8 +229,7 @@ def get_public_recommendations():
          return jsonify([]), 200 # Trả về rỗng nếu không có top products
 
     try:
-        products = Product.query.filter(Product.id.in_(product_ids)).all()
-        products_dict = {p.id: p for p in products}
+        products_dict = _load_products(product_ids)
         sorted_products = [products_dict[pid] for pid in product_ids if pid in products_dict]
         return jsonify([serialize_product(p) for p in sorted_products]), 200
     except Exception as e:
@@ -2,8 +2,12 @@ def register_commands(app):
     from .generate_users import generate_users
     from .generate_products import generate_products
     from .generate_interactions import  generate_interactions
+    from .rebuild_popularity import rebuild_popularity_command
+    from .artifacts import artifacts_cli
     
     app.cli.add_command(generate_users)
     app.cli.add_command(generate_products)
+    app.cli.add_command(rebuild_popularity_command)
+    app.cli.add_command(artifacts_cli)
 
 __all__ = ["register_commands"]
\ No newline at end of file
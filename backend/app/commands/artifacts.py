@@ -0,0 +1,50 @@
+import datetime
+
+import click
+from flask.cli import AppGroup
+
+from ..services.artifact_registry import ARTIFACT_ROOTS, DEFAULT_KEEP_VERSIONS, get_registry
+
+artifacts_cli = AppGroup("artifacts", short_help="Inspect, roll back and clean up model artifact versions.")
+
+ARTIFACT_CHOICE = click.Choice(list(ARTIFACT_ROOTS))
+
+
+@artifacts_cli.command("list")
+@click.argument("name", type=ARTIFACT_CHOICE)
+def list_versions(name):
+    """ Liệt kê các version của artifact (version CURRENT được đánh dấu *). """
+    registry = get_registry(name)
+    current = registry.current_version()
+    manifests = registry.list_versions()
+    if not manifests:
+        click.echo(f"No versions found in {registry.dir}.")
+        return
+    for m in manifests:
+        marker = "*" if m["version"] == current else " "
+        created = datetime.datetime.fromtimestamp(m["created_at"]).strftime("%Y-%m-%d %H:%M:%S")
+        size_mb = sum(f["size"] for f in m["files"].values()) / 2**20
+        click.echo(f"{marker} {m['version']}  created={created}  rows={m.get('rows')}  "
+                   f"build={m.get('build_seconds')}s  size={size_mb:.1f}MB  watermark={m.get('watermark')}")
+
+
+@artifacts_cli.command("rollback")
+@click.argument("name", type=ARTIFACT_CHOICE)
+@click.option("--version", default=None, help="Version to point CURRENT at (default: the previous one).")
+def rollback(name, version):
+    """ Trỏ CURRENT về version cũ (checksum được kiểm tra trước). Worker tự load lại trong vài giây. """
+    try:
+        version = get_registry(name).rollback(version)
+    except Exception as e:
+        click.echo(f"Error rolling back artifact '{name}': {e}", err=True)
+        return
+    click.echo(f"Artifact '{name}' now serves version {version}.")
+
+
+@artifacts_cli.command("gc")
+@click.argument("name", type=ARTIFACT_CHOICE)
+@click.option("--keep", default=DEFAULT_KEEP_VERSIONS, type=int, help="Number of most recent versions to keep.")
+def gc(name, keep):
+    """ Xóa các version cũ, giữ CURRENT và `keep` version mới nhất. """
+    removed = get_registry(name).gc(keep=keep)
+    click.echo(f"Removed {len(removed)} old version(s) of artifact '{name}'.")
@@ -0,0 +1,19 @@
+import click
+from flask.cli import with_appcontext
+
+from ..services.popularity_service import rebuild_popularity, DAY_BUCKET_RETENTION_DAYS
+
+
+@click.command("rebuild-popularity", short_help="Rebuild Redis popularity counters from MySQL.")
+@click.option("--days", default=DAY_BUCKET_RETENTION_DAYS, type=int, help="Number of daily buckets to rebuild.")
+@with_appcontext
+def rebuild_popularity_command(days):
+    click.echo("Rebuilding popularity sorted sets from interaction table...")
+    try:
+        n_products, n_days = rebuild_popularity(days=days)
+    except Exception as e:
+        click.echo(f"Error rebuilding popularity counters: {e}", err=True)
+        return
+    click.echo(f"  > All-time set: {n_products} products.")
+    click.echo(f"  > Daily buckets with purchases: {n_days} (last {days} days).")
+    click.echo("Popularity counters rebuilt successfully.")
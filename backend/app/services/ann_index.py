@@ -0,0 +1,102 @@
+# ann_index.py
+"""
+Tiện ích FAISS dùng chung: tạo index ANN theo cấu hình (flat / ivf / ivfpq / hnsw)
+và đặt tham số lúc tìm kiếm (nprobe, efSearch).
+"""
+import numpy as np
+import faiss
+
+INDEX_TYPES = ('flat', 'ivf', 'ivfpq', 'hnsw')
+
+# FAISS cần khoảng 39 điểm train cho mỗi centroid IVF
+MIN_POINTS_PER_CENTROID = 39
+# PQ 8 bit: 256 centroid cho mỗi sub-quantizer
+PQ_CENTROIDS = 256
+
+
+def default_nlist(n_vectors):
+    """ Số cluster IVF hợp lý cho n_vectors (~4 * sqrt(N)), không vượt quá số điểm train cho phép. """
+    nlist = int(4 * np.sqrt(n_vectors))
+    return max(1, min(nlist, n_vectors // MIN_POINTS_PER_CENTROID))
+
+
+def default_pq_m(dim):
+    """ Số sub-quantizer PQ mặc định: ~8 chiều mỗi sub-vector (mã hóa 1 byte), phải chia hết dim. """
+    return next(m for m in range(max(1, dim // 8), 0, -1) if dim % m == 0)
+
+
+def index_factory_string(index_type, n_vectors, nlist=None, hnsw_m=32, pq_m=None, dim=None):
+    if index_type == 'flat':
+        return "Flat"
+    if index_type == 'ivf':
+        return f"IVF{nlist or default_nlist(n_vectors)},Flat"
+    if index_type == 'ivfpq':
+        return f"IVF{nlist or default_nlist(n_vectors)},PQ{pq_m or default_pq_m(dim)}"
+    if index_type == 'hnsw':
+        return f"HNSW{hnsw_m}"
+    raise ValueError(f"Unknown ANN index type '{index_type}'. Valid types are: {list(INDEX_TYPES)}")
+
+
+def resolve_index_type(index_type, n_vectors):
+    """ Loại index thực sự dùng được với n_vectors điểm train (catalog nhỏ -> lùi về loại đơn giản hơn). """
+    if index_type == 'ivfpq' and n_vectors < PQ_CENTROIDS * MIN_POINTS_PER_CENTROID:
+        index_type = 'ivf'
+    if index_type == 'ivf' and n_vectors < MIN_POINTS_PER_CENTROID:
+        # Catalog quá nhỏ để train IVF -> tìm chính xác cũng đủ nhanh
+        index_type = 'flat'
+    return index_type
+
+
+def create_ann_index(dim, n_vectors, index_type='flat', metric=faiss.METRIC_INNER_PRODUCT,
+                     nlist=None, hnsw_m=32, ef_construction=80, pq_m=None, with_ids=False):
+    """
+    Tạo index rỗng (IVF / PQ chưa train) cho khoảng n_vectors vector.
+    with_ids=True: add / xóa theo id ngoài (vd. product id) - IVF tự lưu id trong inverted list,
+    các loại khác được bọc trong IndexIDMap (IndexIDMap không xóa được trên IVF vì IVF không dồn vị trí).
+    """
+    index_type = resolve_index_type(index_type, n_vectors)
+    index = faiss.index_factory(dim, index_factory_string(index_type, n_vectors, nlist, hnsw_m, pq_m, dim), metric)
+    if index_type == 'hnsw':
+        index.hnsw.efConstruction = ef_construction
+    return faiss.IndexIDMap(index) if with_ids and index_type not in ('ivf', 'ivfpq') else index
+
+
+def build_ann_index(vectors, index_type='flat', metric=faiss.METRIC_INNER_PRODUCT,
+                    nlist=None, hnsw_m=32, ef_construction=80, pq_m=None, ids=None):
+    """
+    Tạo index và add toàn bộ vectors (float32, đã chuẩn hóa L2 nếu dùng inner product = cosine).
+    IVF / PQ được train trên chính các vector này. ids: label cho từng vector (IndexIDMap) thay vì vị trí.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n_vectors, dim = vectors.shape
+    index = create_ann_index(dim, n_vectors, index_type, metric, nlist, hnsw_m, ef_construction, pq_m,
+                             with_ids=ids is not None)
+    if not index.is_trained:
+        index.train(vectors)
+    if ids is not None:
+        index.add_with_ids(vectors, np.asarray(ids, dtype=np.int64))
+    else:
+        index.add(vectors)
+    return index
+
+
+def unwrap_index(index):
+    """ Index bên trong IndexIDMap (đã downcast), hoặc chính index. """
+    index = faiss.downcast_index(index)
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def configure_search(index, nprobe=None, ef_search=None):
+    """ Đặt tham số tìm kiếm cho index IVF (nprobe) hoặc HNSW (efSearch); bỏ qua nếu không áp dụng. """
+    if nprobe:
+        try:
+            faiss.extract_index_ivf(index).nprobe = int(nprobe)
+        except RuntimeError:
+            pass
+    if ef_search:
+        hnsw_index = unwrap_index(index)
+        if hasattr(hnsw_index, 'hnsw'):
+            hnsw_index.hnsw.efSearch = int(ef_search)
+    return index
@@ -0,0 +1,325 @@
+# artifact_registry.py
+"""
+Registry cho artifact model lưu trên đĩa (recommendation, search, sentiment, snapshot dữ liệu training).
+
+<root>/<name>/
+    CURRENT                   : pointer chứa version đang được serve (ghi atomic bằng os.replace)
+    versions/<version>/       : mỗi lần build 1 thư mục riêng, không bao giờ bị ghi đè
+        manifest.json         : checksum sha256 từng file, số dòng, thời gian build, watermark dữ liệu nguồn
+    versions/.tmp-<version>/  : thư mục đang build dở, reader không bao giờ đọc tới
+
+Reader chỉ đọc version mà CURRENT trỏ tới -> đổi model không downtime, rollback = trỏ CURRENT về version cũ.
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+INSTANCE_DIR = os.path.join(BASE_DIR, 'instance')
+# RECOMMEND_MODEL_DIR để benchmark/đánh giá offline ghi ra thư mục riêng
+RECOMMENDATION_DIR = os.environ.get('RECOMMEND_MODEL_DIR') or os.path.join(INSTANCE_DIR, 'recommendations')
+# TRAINING_SNAPSHOT_DIR để giữ snapshot training ở ổ/thư mục khác (snapshot lớn hơn model nhiều)
+SNAPSHOT_DIR = os.environ.get('TRAINING_SNAPSHOT_DIR') or os.path.join(INSTANCE_DIR, 'snapshots')
+
+# Thư mục gốc của từng artifact
+ARTIFACT_ROOTS = {
+    'similarity': RECOMMENDATION_DIR,
+    'cf': RECOMMENDATION_DIR,
+    'bought_together': RECOMMENDATION_DIR,
+    'search': os.path.join(INSTANCE_DIR, 'search'),
+    'sentiment': os.path.join(INSTANCE_DIR, 'sentiment'),
+    'snapshot': SNAPSHOT_DIR,
+}
+
+MANIFEST_FILE = 'manifest.json'
+POINTER_FILE = 'CURRENT'
+TMP_PREFIX = '.tmp-'
+
+# Số version giữ lại khi GC (ngoài version đang CURRENT)
+DEFAULT_KEEP_VERSIONS = int(os.environ.get('ARTIFACT_KEEP_VERSIONS', 3))
+# Thư mục build dở cũ hơn ngưỡng này coi như job đã chết giữa chừng
+STALE_BUILD_SECONDS = 24 * 3600
+
+# Số giây tối thiểu giữa 2 lần kiểm tra pointer (tránh stat() ở mọi request)
+MODEL_RELOAD_CHECK_INTERVAL = 5.0
+
+
+def new_version():
+    return f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+
+def _sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _fsync_file(path):
+    with open(path, 'rb') as f:
+        os.fsync(f.fileno())
+
+
+def atomic_write(path, write_func):
+    """
+    Ghi ra file tạm rồi os.replace() sang path đích.
+    Reader chỉ thấy file cũ hoặc file mới hoàn chỉnh, không bao giờ thấy file ghi dở.
+    """
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    try:
+        with open(tmp_path, 'wb') as f:
+            write_func(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class ArtifactBuild:
+    """ 1 lần build: ghi file vào thư mục tạm, commit() mới tạo version (chưa publish). """
+
+    def __init__(self, registry, started=None):
+        self.registry = registry
+        self.version = new_version()
+        self.dir = os.path.join(registry.versions_dir, f"{TMP_PREFIX}{self.version}")
+        os.makedirs(self.dir)
+        # started: time.perf_counter() lúc bắt đầu build (đọc dữ liệu, train), để build_seconds tính cả phần đó
+        self._started = started if started is not None else time.perf_counter()
+        self._committed = False
+
+    def path(self, filename):
+        return os.path.join(self.dir, filename)
+
+    def commit(self, rows=None, watermark=None, meta=None):
+        """
+        Tính checksum mọi file, ghi manifest rồi rename thư mục tạm thành versions/<version>.
+        Trả về manifest.
+        """
+        files = {}
+        for filename in sorted(os.listdir(self.dir)):
+            path = self.path(filename)
+            _fsync_file(path)
+            files[filename] = {'sha256': _sha256(path), 'size': os.path.getsize(path)}
+
+        manifest = {
+            'name': self.registry.name,
+            'version': self.version,
+            'created_at': time.time(),
+            'build_seconds': round(time.perf_counter() - self._started, 3),
+            'rows': rows,
+            'watermark': watermark.isoformat() if hasattr(watermark, 'isoformat') else watermark,
+            'files': files,
+            **(meta or {}),
+        }
+        atomic_write(self.path(MANIFEST_FILE), lambda f: f.write(json.dumps(manifest, indent=2).encode('utf-8')))
+        os.rename(self.dir, self.registry.version_dir(self.version))
+        self._committed = True
+        return manifest
+
+    def abort(self):
+        if not self._committed:
+            shutil.rmtree(self.dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        return False
+
+
+class ArtifactRegistry:
+    """ Các version của 1 artifact (vd. 'cf') và pointer CURRENT của nó. """
+
+    def __init__(self, name, root=None):
+        self.name = name
+        self.dir = os.path.join(root or ARTIFACT_ROOTS[name], name)
+        self.versions_dir = os.path.join(self.dir, 'versions')
+        self.pointer_path = os.path.join(self.dir, POINTER_FILE)
+
+    def version_dir(self, version):
+        return os.path.join(self.versions_dir, version)
+
+    def path(self, filename, version):
+        return os.path.join(self.version_dir(version), filename)
+
+    def begin(self, started=None):
+        os.makedirs(self.versions_dir, exist_ok=True)
+        return ArtifactBuild(self, started=started)
+
+    def read_manifest(self, version):
+        with open(self.path(MANIFEST_FILE, version)) as f:
+            return json.load(f)
+
+    def current_version(self):
+        try:
+            with open(self.pointer_path) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def current(self):
+        """ (version, thư mục version, manifest) đang được serve, hoặc None nếu chưa publish lần nào. """
+        version = self.current_version()
+        if version is None:
+            return None
+        return version, self.version_dir(version), self.read_manifest(version)
+
+    def list_versions(self):
+        """ Manifest của mọi version đã commit, cũ nhất trước. """
+        manifests = []
+        if os.path.isdir(self.versions_dir):
+            for version in os.listdir(self.versions_dir):
+                if version.startswith(TMP_PREFIX):
+                    continue
+                try:
+                    manifests.append(self.read_manifest(version))
+                except (OSError, ValueError):
+                    continue
+        return sorted(manifests, key=lambda m: m['created_at'])
+
+    def verify(self, version):
+        """ Danh sách file bị thiếu hoặc sai checksum (rỗng = version nguyên vẹn). """
+        manifest = self.read_manifest(version)
+        bad = []
+        for filename, info in manifest['files'].items():
+            path = self.path(filename, version)
+            if not os.path.exists(path) or _sha256(path) != info['sha256']:
+                bad.append(filename)
+        return bad
+
+    def publish(self, version, keep=None):
+        """ Trỏ CURRENT sang version (atomic), rồi GC các version cũ. """
+        if not os.path.exists(self.path(MANIFEST_FILE, version)):
+            raise ValueError(f"Version '{version}' of artifact '{self.name}' does not exist.")
+        atomic_write(self.pointer_path, lambda f: f.write(version.encode('utf-8')))
+        print(f"[INFO] Artifact '{self.name}' now points to version {version}.")
+        self.gc(keep=keep)
+
+    def rollback(self, version=None):
+        """ Trỏ CURRENT về version chỉ định, mặc định là version liền trước version hiện tại. """
+        if version is None:
+            versions = [m['version'] for m in self.list_versions()]
+            current = self.current_version()
+            older = versions[:versions.index(current)] if current in versions else versions
+            if not older:
+                raise ValueError(f"No older version of artifact '{self.name}' to roll back to.")
+            version = older[-1]
+        bad_files = self.verify(version)
+        if bad_files:
+            raise ValueError(f"Version '{version}' of artifact '{self.name}' is corrupted: {bad_files}")
+        atomic_write(self.pointer_path, lambda f: f.write(version.encode('utf-8')))
+        print(f"[INFO] Artifact '{self.name}' rolled back to version {version}.")
+        return version
+
+    def delete(self, version):
+        if version == self.current_version():
+            raise ValueError(f"Cannot delete the current version of artifact '{self.name}'.")
+        shutil.rmtree(self.version_dir(version), ignore_errors=True)
+
+    def gc(self, keep=None):
+        """
+        Giữ version CURRENT và `keep` version mới nhất (để rollback, và cho worker đang load dở version trước),
+        xóa phần còn lại cùng các thư mục build dở đã quá cũ. Trả về danh sách version đã xóa.
+        """
+        keep = DEFAULT_KEEP_VERSIONS if keep is None else keep
+        current = self.current_version()
+        versions = [m['version'] for m in self.list_versions()]
+        keep_versions = set(versions[-keep:] if keep > 0 else []) | {current}
+        removed = [v for v in versions if v not in keep_versions]
+        for version in removed:
+            shutil.rmtree(self.version_dir(version), ignore_errors=True)
+
+        if os.path.isdir(self.versions_dir):
+            for entry in os.listdir(self.versions_dir):
+                path = os.path.join(self.versions_dir, entry)
+                if entry.startswith(TMP_PREFIX) and time.time() - os.path.getmtime(path) > STALE_BUILD_SECONDS:
+                    shutil.rmtree(path, ignore_errors=True)
+        return removed
+
+
+def get_registry(name):
+    if name not in ARTIFACT_ROOTS:
+        raise ValueError(f"Unknown artifact '{name}'. Valid artifacts are: {list(ARTIFACT_ROOTS)}")
+    return ArtifactRegistry(name)
+
+
+class ModelVersionMismatch(Exception):
+    """ Pointer đổi sang version khác trong lúc đang load (job vừa publish). """
+
+
+# --- MODEL HOLDER (RESIDENT, HOT-RELOAD) ---
+class ModelHolder:
+    """
+    Giữ model trong bộ nhớ của process: load một lần, các request sau đọc thẳng từ RAM.
+    Khi job training publish version mới (mtime/size của pointer thay đổi), model mới được load đầy đủ
+    vào biến cục bộ rồi mới gán đè tham chiếu -> request không bao giờ thấy trạng thái load dở.
+    """
+
+    def __init__(self, name, paths, loader, check_interval=MODEL_RELOAD_CHECK_INTERVAL):
+        self.name = name
+        self.paths = paths
+        self._loader = loader
+        self._check_interval = check_interval
+        self._lock = threading.Lock()
+        self._state = None  # (signature, model) - luôn được thay thế nguyên khối
+        self._next_check = 0.0
+
+    def _signature(self):
+        try:
+            return tuple((os.stat(p).st_mtime_ns, os.stat(p).st_size) for p in self.paths)
+        except FileNotFoundError:
+            return None
+
+    def _current(self):
+        state = self._state
+        return state[1] if state else None
+
+    def get(self):
+        """
+        Trả về model hiện tại, hoặc None nếu chưa có artifact nào.
+        Raise exception nếu chưa từng load được và lần load này lỗi.
+        """
+        if self._state is not None and time.monotonic() < self._next_check:
+            return self._current()
+
+        with self._lock:
+            # Thread khác có thể vừa reload xong trong lúc chờ lock
+            if self._state is not None and time.monotonic() < self._next_check:
+                return self._current()
+            self._next_check = time.monotonic() + self._check_interval
+
+            signature = self._signature()
+            if signature is None:
+                # Artifact chưa được train: giữ model cũ (nếu có) thay vì bỏ trống
+                return self._current()
+            if self._state is not None and self._state[0] == signature:
+                return self._current()
+
+            try:
+                model = self._loader()
+                if self._signature() != signature:
+                    raise ModelVersionMismatch("artifact changed while loading")
+            except Exception as e:
+                print(f"[WARN] Could not (re)load {self.name} model: {e}")
+                # Thử lại sớm ở request sau, trong lúc đó vẫn phục vụ bằng model cũ
+                self._next_check = 0.0
+                if self._state is None:
+                    raise
+                return self._current()
+
+            self._state = (signature, model)
+            print(f"[INFO] {self.name} model loaded into memory.")
+            return model
+
+    def invalidate(self):
+        """ Bắt buộc kiểm tra lại artifact ở lần get() tiếp theo. """
+        self._next_check = 0.0
@@ -27,6 +27,12 @@ def get_user_cart_service(user_id):
     return cart
 
 
+def get_cart_product_ids(user_id):
+    """ Chỉ lấy product_id trong giỏ hàng của user (1 query, không load object Cart/Product). """
+    rows = db.session.query(CartItem.product_id).join(Cart, Cart.id == CartItem.cart_id).filter(Cart.user_id == user_id)
+    return [product_id for (product_id,) in rows]
+
+
 def add_to_cart_service(user_id, product_id, quantity):
     """
     Thêm sản phẩm vào giỏ hàng, hoặc cập nhật số lượng nếu đã tồn tại.
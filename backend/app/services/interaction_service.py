@@ -10,6 +10,8 @@ except ImportError:
 from app.models.ecommerce_models import Interaction, InteractionType # <-- Dùng Enum
 from app.models.user_models import User
 from app.models.product_models import Product
+from app.services.recommendation_service import invalidate_user_fold_in, record_session_event
+from app.services.popularity_service import record_purchase
 
 def log_interaction(user_id, product_id, interaction_type_str): # Nhận vào string
     """
@@ -41,6 +43,14 @@ def log_interaction(user_id, product_id, interaction_type_str): # Nhận vào st
         db.session.add(new_interaction)
         db.session.commit()
 
+        # Vector fold-in (user mới) phải tính lại với tương tác vừa ghi
+        invalidate_user_fold_in(user_id)
+        # Gợi ý theo phiên đọc sự kiện gần đây từ Redis, không cần chờ train lại
+        record_session_event(user_id, product_id, interaction_type_enum)
+
+        if interaction_type_enum == InteractionType.PURCHASE:
+            record_purchase(product_id)
+
         return {"message": "Interaction logged successfully"}, 201
 
     except Exception as e:
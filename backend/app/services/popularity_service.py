@@ -0,0 +1,118 @@
+# popularity_service.py
+"""
+Bộ đếm độ phổ biến (số lượt PURCHASE) theo thời gian thực bằng Redis sorted set.
+- popular:purchase:all            : tổng từ trước đến nay
+- popular:purchase:day:<YYYYMMDD> : theo từng ngày, dùng để gộp cửa sổ N ngày gần nhất
+"""
+import datetime
+from sqlalchemy import func
+
+from app.extensions import db, redis_client
+from app.models.ecommerce_models import Interaction, InteractionType
+
+POPULAR_ALL_TIME_KEY = 'popular:purchase:all'
+POPULAR_DAY_KEY_PREFIX = 'popular:purchase:day'
+POPULAR_WINDOW_KEY_PREFIX = 'popular:purchase:window'
+
+# Giữ bucket theo ngày bao lâu (cũng là cửa sổ dài nhất có thể truy vấn)
+DAY_BUCKET_RETENTION_DAYS = 90
+# Kết quả ZUNIONSTORE của 1 cửa sổ được cache ngắn hạn để không gộp lại ở mọi request
+WINDOW_CACHE_TTL = 60
+
+
+def _day_key(day):
+    return f"{POPULAR_DAY_KEY_PREFIX}:{day:%Y%m%d}"
+
+
+def _day_bucket_ttl():
+    return (DAY_BUCKET_RETENTION_DAYS + 1) * 24 * 3600
+
+
+def record_purchase(product_id, when=None):
+    """ Tăng bộ đếm all-time và bucket của ngày hiện tại cho product_id. Lỗi Redis không làm hỏng request. """
+    day_key = _day_key(when or datetime.date.today())
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.zincrby(POPULAR_ALL_TIME_KEY, 1, product_id)
+        pipe.zincrby(day_key, 1, product_id)
+        pipe.expire(day_key, _day_bucket_ttl())
+        pipe.execute()
+    except Exception as e:
+        print(f"[WARN] Could not update popularity counters for product {product_id}: {e}")
+
+
+def get_popular_product_ids(top_n=10, days=None):
+    """
+    Top N product_id theo số lượt mua: all-time (days=None) hoặc trong `days` ngày gần nhất.
+    Trả về None nếu Redis không dùng được, để caller fallback sang SQL.
+    """
+    if days is not None and int(days) < 1:
+        raise ValueError(f"days must be at least 1, got {days}")
+    try:
+        if days is None:
+            key = POPULAR_ALL_TIME_KEY
+        else:
+            days = min(int(days), DAY_BUCKET_RETENTION_DAYS)
+            today = datetime.date.today()
+            key = f"{POPULAR_WINDOW_KEY_PREFIX}:{days}:{today:%Y%m%d}"
+            if not redis_client.exists(key):
+                day_keys = [_day_key(today - datetime.timedelta(days=offset)) for offset in range(days)]
+                pipe = redis_client.pipeline()
+                pipe.zunionstore(key, day_keys)
+                pipe.expire(key, WINDOW_CACHE_TTL)
+                pipe.execute()
+        return [int(pid) for pid in redis_client.zrevrange(key, 0, top_n - 1)]
+    except Exception as e:
+        print(f"[WARN] Could not read popularity counters from Redis: {e}")
+        return None
+
+
+def rebuild_popularity(days=DAY_BUCKET_RETENTION_DAYS):
+    """
+    Đối soát: dựng lại toàn bộ sorted set từ bảng interaction trong MySQL.
+    Ghi vào key tạm rồi RENAME để reader không bao giờ thấy set đang dựng dở.
+    Trả về (số sản phẩm all-time, số bucket ngày).
+    """
+    purchase_filter = Interaction.type == InteractionType.PURCHASE
+
+    all_time = db.session.query(
+        Interaction.product_id, func.count(Interaction.id)
+    ).filter(purchase_filter).group_by(Interaction.product_id).all()
+
+    since = datetime.datetime.combine(datetime.date.today() - datetime.timedelta(days=days - 1), datetime.time.min)
+    day_column = func.date(Interaction.timestamp)
+    per_day = db.session.query(
+        day_column, Interaction.product_id, func.count(Interaction.id)
+    ).filter(purchase_filter, Interaction.timestamp >= since).group_by(day_column, Interaction.product_id).all()
+
+    buckets = {}
+    for day, product_id, count in per_day:
+        # MySQL trả về date, SQLite trả về chuỗi 'YYYY-MM-DD'
+        day = day if isinstance(day, datetime.date) else datetime.date.fromisoformat(str(day)[:10])
+        buckets.setdefault(_day_key(day), {})[product_id] = count
+
+    pipe = redis_client.pipeline()
+    _replace_sorted_set(pipe, POPULAR_ALL_TIME_KEY, {product_id: count for product_id, count in all_time})
+    for offset in range(days):
+        day_key = _day_key(datetime.date.today() - datetime.timedelta(days=offset))
+        _replace_sorted_set(pipe, day_key, buckets.get(day_key, {}), ttl=_day_bucket_ttl())
+    pipe.execute()
+
+    # Cache cửa sổ cũ không còn đúng sau khi đối soát
+    stale_windows = list(redis_client.scan_iter(match=f"{POPULAR_WINDOW_KEY_PREFIX}:*"))
+    if stale_windows:
+        redis_client.delete(*stale_windows)
+
+    return len(all_time), len(buckets)
+
+
+def _replace_sorted_set(pipe, key, scores, ttl=None):
+    if not scores:
+        pipe.delete(key)
+        return
+    tmp_key = f"{key}:rebuild"
+    pipe.delete(tmp_key)
+    pipe.zadd(tmp_key, scores)
+    if ttl:
+        pipe.expire(tmp_key, ttl)
+    pipe.rename(tmp_key, key)
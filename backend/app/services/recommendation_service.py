@@ -1,51 +1,225 @@
 # recommendation_service.py
+import numpy as np
 import pandas as pd
-import nltk
-from nltk.corpus import stopwords
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import faiss
+import scipy.sparse as sp
+import pyarrow.compute as pc
 import pickle
 import os
-from sqlalchemy import func, desc
+import datetime
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from flask import current_app
+from sqlalchemy import func, desc, case
 
 # Giả sử db được import từ app.extensions hoặc app.models tùy cấu trúc của bạn
 try:
-    from app.extensions import db
+    from app.extensions import db, redis_client
 except ImportError:
     from app.models import db # Hoặc cách import db phù hợp
+    from app.extensions import redis_client
 
 # Import các model mới
 from app.models.product_models import Product, Category, Brand, Ingredient, ProductIngredient
 from app.models.ecommerce_models import Interaction, InteractionType # <-- Import Enum
+from app.models.ecommerce_models import Order, OrderItem, OrderStatus
+from app.services.popularity_service import get_popular_product_ids
+from app.services.ann_index import build_ann_index, configure_search
+from app.services.artifact_registry import ArtifactRegistry, ModelHolder, RECOMMENDATION_DIR
+from app.services.training_snapshot import read_table, resolve_snapshot
 
-# Thư viện Surprise (giữ nguyên)
-from surprise import Dataset, Reader, SVD
+# Thư viện chỉ dùng lúc train (sklearn, surprise, nltk) được import trong hàm build_*:
+# web worker, CLI và job không train không phải trả vài giây import chúng
 
 # --- ĐỊNH NGHĨA ĐƯỜNG DẪN (Giữ nguyên hoặc điều chỉnh nếu cần) ---
 # Xác định thư mục gốc của project (nơi chứa thư mục app)
 # Điều chỉnh nếu cấu trúc thư mục của bạn khác
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
-MODEL_DIR = os.path.join(BASE_DIR, 'instance', 'recommendations') # Lưu vào instance để không bị ghi đè khi deploy
+# Lưu vào instance để không bị ghi đè khi deploy (mỗi artifact 1 registry có version, xem artifact_registry.py)
+MODEL_DIR = RECOMMENDATION_DIR
 
-MATRIX_PATH = os.path.join(MODEL_DIR, 'similarity_matrix.pkl')
-MAPPING_PATH = os.path.join(MODEL_DIR, 'product_id_mapping.pkl')
-CF_MODEL_PATH = os.path.join(MODEL_DIR, 'cf_model.pkl')
-# Bỏ CF_DATA_PATH vì đã lưu trainset trong CF_MODEL_PATH
+# Top-K láng giềng của mỗi sản phẩm (thay cho ma trận cosine N x N).
+# Lưu dạng .npy trong thư mục version để các worker memmap dùng chung page cache.
+SIMILARITY_ARTIFACT = 'similarity'
+CF_ARTIFACT = 'cf'
+# Model CF lưu dạng mảng .npy (factor float32, mapping id, CSR item đã xem); CF_MODEL_FILE là định dạng pickle cũ,
+# chỉ còn được đọc để rollback về các version build trước đây
+CF_MODEL_FILE = 'cf_model.pkl'
+BOUGHT_TOGETHER_ARTIFACT = 'bought_together'
+
+similarity_registry = ArtifactRegistry(SIMILARITY_ARTIFACT, MODEL_DIR)
+cf_registry = ArtifactRegistry(CF_ARTIFACT, MODEL_DIR)
+bought_together_registry = ArtifactRegistry(BOUGHT_TOGETHER_ARTIFACT, MODEL_DIR)
+
+DEFAULT_SIMILARITY_TOP_K = 50
+DEFAULT_SIMILARITY_BLOCK_SIZE = 256
+# 'faiss': ANN trên vector TF-IDF đã giảm chiều (SVD); 'exact': cosine TF-IDF tính theo block
+DEFAULT_SIMILARITY_ENGINE = 'faiss'
+DEFAULT_ANN_INDEX_TYPE = 'flat'
+DEFAULT_ANN_DIM = 128
+
+# Gợi ý "For You" tính sẵn sau khi train, lưu Redis: reco:foryou:<cf version>:<user_id> -> JSON list product_id
+FOR_YOU_KEY_PREFIX = 'reco:foryou'
+DEFAULT_PRECOMPUTE_TOP_N = 50
+DEFAULT_PRECOMPUTE_CHUNK_SIZE = 1024
+# Bộ nhớ cho ma trận điểm của 1 chunk: số user mỗi chunk = budget / (n_items * PRECOMPUTE_BYTES_PER_SCORE)
+DEFAULT_PRECOMPUTE_MEMORY_MB = 256
+# float32 điểm + int64 index của argpartition cho mỗi ô [user, item]
+PRECOMPUTE_BYTES_PER_SCORE = 4 + 8
+DEFAULT_PRECOMPUTE_TTL = 7 * 24 * 3600
+# Redis lỗi liên tiếp bấy nhiêu chunk thì dừng precompute (tránh chấm điểm toàn bộ user mà không ghi được gì)
+PRECOMPUTE_MAX_REDIS_FAILURES = 3
+
+# Fold-in user mới vào model CF (không cần train lại): reco:foldin:<user_id> -> hash {version, vector}
+FOLD_IN_KEY_PREFIX = 'reco:foldin'
+DEFAULT_FOLD_IN_MAX_INTERACTIONS = 50
+DEFAULT_FOLD_IN_REG = 0.5
+DEFAULT_FOLD_IN_TTL = 24 * 3600
+
+# Số dòng mỗi lần fetch khi stream dữ liệu training từ DB
+DEFAULT_TRAINING_FETCH_SIZE = 50000
+
+# Hybrid ranker: trọng số, ngân sách thời gian (ms) cho từng nguồn candidate
+DEFAULT_HYBRID_WEIGHTS = {'cf': 1.0, 'session': 0.8, 'content': 0.6, 'popular': 0.3}
+DEFAULT_HYBRID_BUDGETS_MS = {'cf': 150, 'session': 60, 'content': 120, 'popular': 80}
+DEFAULT_HYBRID_CANDIDATES = 50
+DEFAULT_HYBRID_RECENT_ITEMS = 5
+# Thread pool dùng chung cho các nguồn hybrid và số task tối đa đang chạy của mỗi nguồn trong pool đó
+DEFAULT_HYBRID_WORKERS = 16
+DEFAULT_HYBRID_MAX_IN_FLIGHT = 4
+
+# "Thường được mua cùng": đồng xuất hiện trong giỏ đơn hàng, chuẩn hóa 'lift' | 'jaccard', giữ top-K mỗi sản phẩm
+DEFAULT_BOUGHT_TOGETHER_TOP_K = 20
+DEFAULT_BOUGHT_TOGETHER_METRIC = 'lift'
+DEFAULT_BOUGHT_TOGETHER_MIN_SUPPORT = 2  # số đơn tối thiểu chứa cả 2 sản phẩm
+DEFAULT_BOUGHT_TOGETHER_CHUNK_SIZE = 200000  # số dòng order_item mỗi chunk
+
+# Rating ngầm định theo loại tương tác (dùng chung cho train và fold-in)
+INTERACTION_WEIGHTS = {
+    InteractionType.VIEW: 1.0,
+    InteractionType.ADD_TO_CART: 3.0,
+    InteractionType.PURCHASE: 5.0
+}
+
+# Phiên duyệt web: reco:session:<user_id> -> Redis list (mới nhất trước) các sự kiện "product_id:TYPE:unix_ts"
+SESSION_KEY_PREFIX = 'reco:session'
+DEFAULT_SESSION_MAX_EVENTS = 50
+DEFAULT_SESSION_TTL = 2 * 3600
+DEFAULT_SESSION_HALF_LIFE = 30 * 60  # trọng số sự kiện giảm 1/2 sau mỗi half-life giây
+DEFAULT_SESSION_NEIGHBORS = 20  # số láng giềng content lấy cho mỗi sản phẩm trong phiên
+DEFAULT_SESSION_BUDGET_MS = 50
+
+# Mask sản phẩm active (theo item index của model CF): làm mới sau TTL hoặc khi counter Redis đổi
+ACTIVE_PRODUCTS_VERSION_KEY = 'reco:active-products:version'
+DEFAULT_ACTIVE_MASK_TTL = 60
+ACTIVE_MASK_CHECK_INTERVAL = 1.0
 
 print(f"[DEBUG] Model directory set to: {MODEL_DIR}")
 
+
+# --- ARTIFACT DẠNG MẢNG (.npy trong thư mục version, đọc bằng memmap) ---
+def _save_array_artifact(registry, arrays, meta=None, blobs=None, rows=None, watermark=None, publish=True, started=None):
+    """
+    Ghi mỗi mảng ra 1 file .npy trong thư mục version mới của registry, commit manifest
+    (checksum, rows, watermark) rồi publish (đổi pointer CURRENT).
+    `blobs` = {key: (extension, bytes)} cho các file không phải mảng (vd. FAISS index).
+    publish=False: chỉ commit version, job tự publish sau (registry.publish).
+    """
+    with registry.begin(started=started) as build:
+        array_files = {}
+        for key, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            filename = f"{key}.npy"
+            np.save(build.path(filename), array)
+            array_files[key] = {'file': filename, 'dtype': str(array.dtype), 'shape': list(array.shape)}
+
+        blob_files = {}
+        for key, (extension, data) in (blobs or {}).items():
+            filename = f"{key}.{extension}"
+            with open(build.path(filename), 'wb') as f:
+                f.write(data)
+            blob_files[key] = filename
+
+        manifest = build.commit(rows=rows, watermark=watermark,
+                                meta={'arrays': array_files, 'blobs': blob_files, **(meta or {})})
+    if publish:
+        registry.publish(manifest['version'])
+    return manifest
+
+
+def _open_arrays(version_dir, manifest, mmap_mode='r'):
+    # view(np.ndarray): vẫn trỏ vào vùng mmap nhưng bỏ overhead của subclass np.memmap khi tính toán
+    return {
+        key: np.load(os.path.join(version_dir, info['file']), mmap_mode=mmap_mode).view(np.ndarray)
+        for key, info in manifest['arrays'].items()
+    }
+
+
+def _load_array_artifact(registry, mmap_mode='r'):
+    """
+    Đọc manifest của version CURRENT rồi mở các mảng bằng numpy memmap (mmap_mode='r').
+    Các worker cùng map 1 file sẽ dùng chung page cache của OS thay vì mỗi worker 1 bản trên heap.
+    Trả về (thư mục version, manifest, arrays).
+    """
+    current = registry.current()
+    if current is None:
+        raise FileNotFoundError(f"No published version of artifact '{registry.name}'.")
+    _, version_dir, manifest = current
+    return version_dir, manifest, _open_arrays(version_dir, manifest, mmap_mode)
+
+
+def _build_id_lookup(raw_ids):
+    """ Mảng id đã sắp xếp + vị trí gốc, để tra raw id -> index bằng binary search (không cần dict riêng mỗi worker). """
+    order = np.argsort(raw_ids, kind='stable').astype(np.int32)
+    return raw_ids[order], order
+
+
+def _lookup_index(sorted_ids, sorted_pos, raw_id):
+    """ Trả về index của raw_id trong model, hoặc None nếu không có. """
+    bounds = np.iinfo(sorted_ids.dtype)
+    if not bounds.min <= raw_id <= bounds.max:
+        # Id nằm ngoài miền giá trị của dtype -> chắc chắn không có trong model (ép kiểu sẽ OverflowError)
+        return None
+    # Ép raw_id về đúng dtype của mảng, nếu không numpy sẽ copy cả mảng để đồng nhất kiểu
+    pos = int(np.searchsorted(sorted_ids, sorted_ids.dtype.type(raw_id)))
+    if pos < len(sorted_ids) and sorted_ids[pos] == raw_id:
+        return int(sorted_pos[pos])
+    return None
+
+
+def _split_ids_in_range(raw_ids, dtype):
+    """ Tách danh sách id thành (mảng các id ép được về dtype, list các id ngoài miền giá trị của dtype). """
+    bounds = np.iinfo(dtype)
+    in_range = [raw_id for raw_id in raw_ids if bounds.min <= raw_id <= bounds.max]
+    out_of_range = [raw_id for raw_id in raw_ids if not bounds.min <= raw_id <= bounds.max]
+    return np.asarray(in_range, dtype=dtype), out_of_range
+
+
 # --- HÀM LẤY TOP SẢN PHẨM (FALLBACK - Dùng Enum) ---
-def get_top_products(top_n=10):
+def get_top_products(top_n=10, days=None):
     """
-    Lấy Top N sản phẩm được mua nhiều nhất (sử dụng Enum).
+    Lấy Top N sản phẩm được mua nhiều nhất (all-time, hoặc trong `days` ngày gần nhất).
+    Đọc từ sorted set Redis (ZREVRANGE); chỉ GROUP BY trên bảng interaction khi Redis chưa có dữ liệu.
     """
-    print(f"Fetching top {top_n} products based on purchase count...")
+    if days is not None and days < 1:
+        print(f"Invalid popularity window: days={days}")
+        return [], 400 # Bad Request
+    product_ids = get_popular_product_ids(top_n, days=days)
+    if product_ids:
+        return product_ids, 200
+
+    print(f"Fetching top {top_n} products based on purchase count (SQL fallback, run `flask rebuild-popularity` to fill Redis)...")
     try:
+        purchase_filter = [Interaction.type == InteractionType.PURCHASE] # <-- Dùng Enum
+        if days:
+            purchase_filter.append(Interaction.timestamp >= datetime.datetime.now() - datetime.timedelta(days=days))
         top_products_query = db.session.query(
             Interaction.product_id,
             func.count(Interaction.product_id).label('purchase_count')
         ).filter(
-            Interaction.type == InteractionType.PURCHASE # <-- Dùng Enum
+            *purchase_filter
         ).group_by(
             Interaction.product_id
         ).order_by(
@@ -71,11 +245,14 @@ def get_top_products(top_n=10):
         return [], 500
 
 # --- CẬP NHẬT HÀM LẤY CORPUS SẢN PHẨM (Đúng relationship) ---
-def _get_product_corpus():
+def _get_product_corpus(snapshot=None):
     """
-    Lấy dữ liệu sản phẩm từ DB và tạo 'văn bản' mô tả cho mỗi sản phẩm.
+    Lấy dữ liệu sản phẩm từ DB (hoặc từ snapshot training nếu có) và tạo 'văn bản' mô tả cho mỗi sản phẩm.
     Đã cập nhật tên relationship.
     """
+    if snapshot:
+        return _get_product_corpus_from_snapshot(snapshot)
+
     print("Fetching product data from database...")
     products = db.session.query(Product).options(
         db.joinedload(Product.category),
@@ -107,86 +284,374 @@ def _get_product_corpus():
 
     return pd.DataFrame(data)
 
-# --- HÀM BUILD MA TRẬN TƯƠNG TỰ (Không đổi logic chính) ---
-def build_similarity_matrix():
-    """ Huấn luyện TF-IDF và tính Cosine Similarity. """
+
+def _get_product_corpus_from_snapshot(snapshot):
+    """ Cùng corpus như _get_product_corpus() nhưng ghép các bảng của snapshot bằng pandas, không query DB. """
+    print(f"Reading product data from training snapshot {snapshot}...")
+    products = read_table('product', ['id', 'name', 'desc', 'category_id', 'brand_id', 'is_active'], snapshot).to_pandas()
+    products = products[products['is_active']].sort_values('id')
+    if products.empty:
+        raise Exception("No active product data found to build model.")
+
+    categories = read_table('category', version=snapshot).to_pandas().set_index('id')['name']
+    brands = read_table('brand', version=snapshot).to_pandas().set_index('id')['name']
+    ingredient_names = read_table('ingredient', version=snapshot).to_pandas().set_index('id')['name']
+    links = read_table('product_ingredient', version=snapshot).to_pandas()
+    links['name'] = links['ingredient_id'].map(ingredient_names)
+    ingredients = links.dropna(subset=['name']).groupby('product_id')['name'].agg(' '.join)
+
+    corpus = (
+        products['name'].fillna('') + ' ' + products['desc'].fillna('') + ' '
+        + products['category_id'].map(categories).fillna('') + ' '
+        + products['brand_id'].map(brands).fillna('') + ' '
+        + products['id'].map(ingredients).fillna('')
+    ).str.strip()
+    print(f"[DEBUG] Found {len(products)} active products in training snapshot.")
+    return pd.DataFrame({'id': products['id'].to_numpy(), 'name': products['name'].to_numpy(), 'corpus': corpus.to_numpy()})
+
+# --- TÍNH TOP-K LÁNG GIỀNG THEO BLOCK ---
+def _compute_top_k_neighbors(matrix, top_k, block_size):
+    """
+    Tính top-K láng giềng (cosine) cho từng sản phẩm.
+    `matrix` là TF-IDF đã chuẩn hóa L2 nên tích vô hướng = cosine.
+    Xử lý từng block dòng để bộ nhớ đỉnh chỉ cỡ block_size x N thay vì N x N.
+    Trả về (neighbors int32 [N, K], scores float32 [N, K]), đã sắp xếp giảm dần;
+    ô trống (catalog nhỏ hơn K + 1) có neighbor = -1.
+    """
+    n_items = matrix.shape[0]
+    k = min(top_k, n_items - 1)
+    neighbors = np.full((n_items, top_k), -1, dtype=np.int32)
+    scores = np.zeros((n_items, top_k), dtype=np.float32)
+    if k <= 0:
+        return neighbors, scores
+
+    matrix_t = matrix.T.tocsc()
+    for start in range(0, n_items, block_size):
+        stop = min(start + block_size, n_items)
+        # Âm hóa để argpartition lấy giá trị lớn nhất, không cần copy thêm
+        block = (matrix[start:stop] @ matrix_t).toarray().astype(np.float32, copy=False)
+        np.negative(block, out=block)
+        rows = np.arange(stop - start)
+        block[rows, rows + start] = np.inf  # loại chính sản phẩm đó
+
+        top = np.argpartition(block, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(block, top, axis=1)
+        order = np.argsort(top_scores, axis=1, kind='stable')
+        neighbors[start:stop, :k] = np.take_along_axis(top, order, axis=1)
+        scores[start:stop, :k] = -np.take_along_axis(top_scores, order, axis=1)
+
+        print(f"[DEBUG] Top-{k} neighbors computed for {stop}/{n_items} products.")
+
+    return neighbors, scores
+
+
+# --- VECTOR SẢN PHẨM + ANN (FAISS) ---
+def _reduce_tfidf(tfidf_matrix, dim):
+    """ Giảm chiều TF-IDF bằng TruncatedSVD rồi chuẩn hóa L2 để inner product = cosine. """
+    from sklearn.decomposition import TruncatedSVD
+    from sklearn.preprocessing import normalize
+
+    n_components = min(dim, tfidf_matrix.shape[0] - 1, tfidf_matrix.shape[1] - 1)
+    if n_components < 2:
+        vectors = tfidf_matrix.toarray()
+    else:
+        vectors = TruncatedSVD(n_components=n_components, random_state=42).fit_transform(tfidf_matrix)
+    return normalize(vectors).astype(np.float32)
+
+
+def _ann_index_params():
+    config = current_app.config
+    return {
+        'index_type': config.get('RECOMMEND_ANN_INDEX_TYPE', DEFAULT_ANN_INDEX_TYPE),
+        'nlist': int(config.get('RECOMMEND_ANN_NLIST', 0)) or None,
+        'hnsw_m': int(config.get('RECOMMEND_ANN_HNSW_M', 32)),
+        'ef_construction': int(config.get('RECOMMEND_ANN_EF_CONSTRUCTION', 80)),
+    }
+
+
+def _ann_search_params():
+    config = current_app.config
+    return {
+        'nprobe': int(config.get('RECOMMEND_ANN_NPROBE', 16)),
+        'ef_search': int(config.get('RECOMMEND_ANN_EF_SEARCH', 64)),
+    }
+
+
+def _ann_top_k_neighbors(index, vectors, top_k, batch_size):
+    """
+    Truy vấn index ANN theo từng batch để lấy top-K láng giềng cho mọi sản phẩm
+    (bỏ chính nó và ô trống -1). Cùng định dạng output với _compute_top_k_neighbors.
+    """
+    n_items = len(vectors)
+    k = min(top_k, n_items - 1)
+    neighbors = np.full((n_items, top_k), -1, dtype=np.int32)
+    scores = np.zeros((n_items, top_k), dtype=np.float32)
+    if k <= 0:
+        return neighbors, scores
+
+    for start in range(0, n_items, batch_size):
+        stop = min(start + batch_size, n_items)
+        distances, labels = index.search(vectors[start:stop], k + 1)
+        # Đẩy chính sản phẩm đó và ô không tìm thấy (-1) xuống cuối, giữ nguyên thứ tự còn lại
+        drop = (labels == np.arange(start, stop)[:, None]) | (labels < 0)
+        order = np.argsort(drop, axis=1, kind='stable')[:, :k]
+        keep = ~np.take_along_axis(drop, order, axis=1)
+        neighbors[start:stop, :k] = np.where(keep, np.take_along_axis(labels, order, axis=1), -1)
+        scores[start:stop, :k] = np.where(keep, np.take_along_axis(distances, order, axis=1), 0.0)
+
+    return neighbors, scores
+
+
+# --- HÀM BUILD MÔ HÌNH TƯƠNG TỰ (TOP-K) ---
+def build_similarity_matrix(publish=True, snapshot=None):
+    """
+    Huấn luyện TF-IDF và lưu top-K sản phẩm tương tự (cosine) cho mỗi sản phẩm.
+    Engine 'faiss': giảm chiều TF-IDF bằng SVD, dựng index ANN (flat/ivf/hnsw) và lưu kèm index
+    để get_similar_products truy vấn khi cần nhiều hơn K kết quả.
+    Engine 'exact': cosine chính xác trên TF-IDF, tính theo block.
+    Trả về {'artifact', 'version'} đã commit (None nếu lỗi); publish=False để job tự publish sau (publish_staged_artifact).
+    snapshot: version snapshot training ('current' = mới nhất) để đọc dữ liệu thay vì query DB.
+    """
+    started = time.perf_counter()
     try:
+        import nltk
+        from nltk.corpus import stopwords
         nltk.download('stopwords', quiet=True)
         stop_words = set(stopwords.words('english'))
     except Exception as e:
         print(f"Warning: Could not download stopwords: {e}")
         stop_words = None
 
-    df = _get_product_corpus()
+    snapshot = resolve_snapshot(snapshot) if snapshot else None
+    df = _get_product_corpus(snapshot)
     if df.empty:
       print("Cannot build similarity matrix: No product data.")
       return
 
     print(f"Building TF-IDF matrix for {len(df)} products...")
-    tfidf = TfidfVectorizer(stop_words=list(stop_words) if stop_words else None, min_df=2) # min_df=2 để bỏ từ quá hiếm
-    tfidf_matrix = tfidf.fit_transform(df['corpus'])
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    tfidf = TfidfVectorizer(stop_words=list(stop_words) if stop_words else None, min_df=2, dtype=np.float32) # min_df=2 để bỏ từ quá hiếm
+    tfidf_matrix = tfidf.fit_transform(df['corpus']).tocsr()
+
+    top_k = int(current_app.config.get('RECOMMEND_SIMILARITY_TOP_K', DEFAULT_SIMILARITY_TOP_K))
+    block_size = int(current_app.config.get('RECOMMEND_SIMILARITY_BLOCK_SIZE', DEFAULT_SIMILARITY_BLOCK_SIZE))
+    engine = current_app.config.get('RECOMMEND_SIMILARITY_ENGINE', DEFAULT_SIMILARITY_ENGINE)
+
+    arrays, blobs, meta = {}, {}, {'top_k': top_k, 'engine': engine}
+    if engine == 'faiss':
+        dim = int(current_app.config.get('RECOMMEND_ANN_DIM', DEFAULT_ANN_DIM))
+        index_params = _ann_index_params()
+        print(f"Reducing TF-IDF to {dim} dims and building '{index_params['index_type']}' ANN index...")
+        vectors = _reduce_tfidf(tfidf_matrix, dim)
+        index = build_ann_index(vectors, **index_params)
+        configure_search(index, **_ann_search_params())
 
-    print("Calculating cosine similarity matrix...")
-    cosine_sim = cosine_similarity(tfidf_matrix, tfidf_matrix)
+        print(f"Querying top-{top_k} ANN neighbors (batch size {block_size})...")
+        neighbors, scores = _ann_top_k_neighbors(index, vectors, top_k, block_size)
+        arrays['vectors'] = vectors
+        blobs['ann_index'] = ('faiss', faiss.serialize_index(index).tobytes())
+        meta.update(index_params, dim=int(vectors.shape[1]))
+    else:
+        print(f"Calculating top-{top_k} cosine neighbors (block size {block_size})...")
+        neighbors, scores = _compute_top_k_neighbors(tfidf_matrix, top_k, block_size)
 
-    id_to_index = pd.Series(df.index, index=df['id']).to_dict()
-    index_to_id = pd.Series(df['id'], index=df.index).to_dict()
+    product_ids = df['id'].to_numpy(dtype=np.int32)
+    sorted_ids, sorted_pos = _build_id_lookup(product_ids)
+    arrays.update({
+        'product_ids': product_ids,
+        'sorted_ids': sorted_ids,
+        'sorted_pos': sorted_pos,
+        'neighbors': neighbors,
+        'scores': scores,
+    })
+    meta.update(n_products=int(len(product_ids)), snapshot=snapshot)
+    if snapshot:
+        watermark = pc.max(read_table('product', ['updated_at'], snapshot).column('updated_at')).as_py()
+    else:
+        watermark = db.session.query(func.max(Product.updated_at)).scalar()
 
-    os.makedirs(MODEL_DIR, exist_ok=True)
-    print(f"Saving similarity models to {MODEL_DIR}...")
+    print(f"Saving similarity models to {similarity_registry.dir}...")
     try:
-        with open(MATRIX_PATH, 'wb') as f:
-            pickle.dump(cosine_sim, f)
-        with open(MAPPING_PATH, 'wb') as f:
-            pickle.dump({'id_to_index': id_to_index, 'index_to_id': index_to_id}, f)
+        manifest = _save_array_artifact(similarity_registry, arrays, meta=meta, blobs=blobs,
+                                        rows=len(product_ids), watermark=watermark, publish=publish, started=started)
         print("Content-based model built successfully.")
     except Exception as e:
         print(f"ERROR saving similarity models: {e}")
+        return None
+    return {'artifact': SIMILARITY_ARTIFACT, 'version': manifest['version']}
+
+
+# --- LẤY DỮ LIỆU TƯƠNG TÁC (Gom nhóm trong SQL, stream vào numpy) ---
+def _training_cutoff():
+    """ Mốc thời gian (RECOMMEND_TRAINING_CUTOFF, ISO) để chỉ train trên tương tác trước đó; None = dùng toàn bộ. """
+    cutoff = current_app.config.get('RECOMMEND_TRAINING_CUTOFF')
+    if cutoff and not isinstance(cutoff, datetime.datetime):
+        cutoff = datetime.datetime.fromisoformat(str(cutoff))
+    return cutoff or None
+
+
+def _interaction_rating_query():
+    """ SELECT user_id, product_id, MAX(CASE type ...) GROUP BY user_id, product_id """
+    rating_expr = case(
+        *[(Interaction.type == interaction_type, weight) for interaction_type, weight in INTERACTION_WEIGHTS.items()]
+    )
+    query = db.session.query(
+        Interaction.user_id,
+        Interaction.product_id,
+        func.max(rating_expr).label('rating')
+    ).filter(
+        Interaction.type.in_(list(INTERACTION_WEIGHTS))
+    )
+    cutoff = _training_cutoff()
+    if cutoff is not None:
+        query = query.filter(Interaction.timestamp < cutoff)
+    return query.group_by(
+        Interaction.user_id, Interaction.product_id
+    )
+
 
+def _interaction_watermark(snapshot=None):
+    """ Timestamp tương tác mới nhất được đưa vào training (ghi vào manifest để biết model "mới" tới đâu). """
+    if snapshot:
+        timestamps = read_table('interaction', ['timestamp'], snapshot).column('timestamp').to_numpy()
+        cutoff = _training_cutoff()
+        if cutoff is not None:
+            timestamps = timestamps[timestamps < np.datetime64(cutoff)]
+        return pd.Timestamp(timestamps.max()).to_pydatetime() if len(timestamps) else None
+
+    query = db.session.query(func.max(Interaction.timestamp))
+    cutoff = _training_cutoff()
+    if cutoff is not None:
+        query = query.filter(Interaction.timestamp < cutoff)
+    return query.scalar()
+
+
+def _get_interaction_data(snapshot=None):
+    """
+    Lấy rating (user, product) đã gom nhóm sẵn trong DB: rating = trọng số cao nhất theo Enum type.
+    Kết quả được stream bằng server-side cursor vào các mảng numpy cấp phát trước,
+    không tạo ORM object hay list dict trung gian.
+    snapshot: đọc từ snapshot training (memory map) và gom nhóm bằng pandas thay vì query DB.
+    """
+    if snapshot:
+        return _get_interaction_data_from_snapshot(snapshot)
 
-# --- CẬP NHẬT HÀM LẤY DỮ LIỆU TƯƠNG TÁC (Dùng Enum) ---
-def _get_interaction_data():
-    """ Lấy dữ liệu Interaction và gán rating dựa trên Enum type. """
     print("Fetching interaction data...")
-    interactions = Interaction.query.all()
+    query = _interaction_rating_query()
 
-    if not interactions:
-        raise Exception("No interaction data found for CF model.")
+    fetch_size = int(current_app.config.get('RECOMMEND_TRAINING_FETCH_SIZE', DEFAULT_TRAINING_FETCH_SIZE))
+    # Không COUNT trước (sẽ phải chạy lại cả GROUP BY): bắt đầu từ 1 partition rồi nới gấp đôi khi đầy
+    user_ids = np.empty(fetch_size, dtype=np.int64)
+    product_ids = np.empty(fetch_size, dtype=np.int64)
+    ratings = np.empty(fetch_size, dtype=np.float64)
 
-    interaction_weights = {
-        InteractionType.VIEW: 1.0,
-        InteractionType.ADD_TO_CART: 3.0,
-        InteractionType.PURCHASE: 5.0
-    }
+    n_filled = 0
+    # Chạy ở tầng Core (không qua ORM loading), server-side cursor, mỗi lần fetch fetch_size dòng
+    result = db.session.connection().execution_options(stream_results=True).execute(query.statement)
+    for rows in result.partitions(fetch_size):
+        batch_user_ids, batch_product_ids, batch_ratings = zip(*rows)
+        end = n_filled + len(rows)
+        if end > len(user_ids):
+            new_size = max(end, len(user_ids) * 2)
+            user_ids.resize(new_size, refcheck=False)
+            product_ids.resize(new_size, refcheck=False)
+            ratings.resize(new_size, refcheck=False)
+        user_ids[n_filled:end] = batch_user_ids
+        product_ids[n_filled:end] = batch_product_ids
+        ratings[n_filled:end] = batch_ratings
+        n_filled = end
 
-    data = []
-    for i in interactions:
-        if i.type in interaction_weights:
-            data.append({
-                'user_id': i.user_id,
-                'product_id': i.product_id,
-                'rating': interaction_weights[i.type]
-            })
-
-    df = pd.DataFrame(data)
+    if not n_filled:
+        raise Exception("No interaction data found for CF model.")
+
+    # Trả lại phần dư (tối đa ~1/2 mảng) trước khi training giữ các mảng này
+    for array in (user_ids, product_ids, ratings):
+        array.resize(n_filled, refcheck=False)
+    df = pd.DataFrame({'user_id': user_ids, 'product_id': product_ids, 'rating': ratings}, copy=False)
     if df.empty:
          raise Exception("Interaction data processed but resulted in empty DataFrame.")
 
-    # Lấy rating cao nhất nếu có nhiều tương tác trùng
-    df = df.groupby(['user_id', 'product_id'])['rating'].max().reset_index()
+    print(f"Processed {len(df)} user-item ratings.")
+    return df
+
+def _get_interaction_data_from_snapshot(snapshot):
+    print(f"Reading interaction data from training snapshot {snapshot}...")
+    table = read_table('interaction', ['user_id', 'product_id', 'type', 'timestamp'], snapshot)
+
+    # type lưu dạng tên Enum -> dictionary encode rồi tra trọng số theo index của dictionary
+    types = table.column('type').combine_chunks().dictionary_encode()
+    weight_by_name = {interaction_type.name: weight for interaction_type, weight in INTERACTION_WEIGHTS.items()}
+    weights = np.array([weight_by_name.get(name, np.nan) for name in types.dictionary.to_pylist()] + [np.nan])
+    type_codes = types.indices.fill_null(len(weights) - 1).to_numpy()
+    ratings = weights[type_codes]
+
+    mask = ~np.isnan(ratings)
+    cutoff = _training_cutoff()
+    if cutoff is not None:
+        mask &= table.column('timestamp').to_numpy() < np.datetime64(cutoff)
 
+    df = pd.DataFrame({
+        'user_id': table.column('user_id').to_numpy()[mask],
+        'product_id': table.column('product_id').to_numpy()[mask],
+        'rating': ratings[mask],
+    }, copy=False)
+    if df.empty:
+        raise Exception("No interaction data found for CF model.")
+    df = df.groupby(['user_id', 'product_id'], sort=False)['rating'].max().reset_index()
     print(f"Processed {len(df)} user-item ratings.")
     return df
 
 # --- HÀM BUILD MÔ HÌNH CF (Không đổi logic chính) ---
-def build_collaborative_model():
-    """ Huấn luyện mô hình SVD và lưu lại. """
+def _cf_arrays(algo, trainset):
+    """
+    Chỉ giữ phần serving cần từ SVD + Trainset của Surprise (không giữ dict rating ur/ir của trainset):
+    factor/bias float32, mapping raw id <-> inner id, và item đã xem của từng user dạng CSR.
+    Trả về (arrays, meta).
+    """
+    seen_counts = np.array([len(trainset.ur[u]) for u in trainset.all_users()], dtype=np.int64)
+    seen_indptr = np.zeros(trainset.n_users + 1, dtype=np.int64)
+    np.cumsum(seen_counts, out=seen_indptr[1:])
+    seen_indices = np.fromiter(
+        (i for u in trainset.all_users() for (i, _) in trainset.ur[u]), dtype=np.int32, count=int(seen_indptr[-1])
+    )
+    item_raw_ids = np.array([trainset.to_raw_iid(i) for i in trainset.all_items()], dtype=np.int64)
+    user_raw_ids = np.array([trainset.to_raw_uid(u) for u in trainset.all_users()], dtype=np.int64)
+    item_sorted_ids, item_sorted_pos = _build_id_lookup(item_raw_ids)
+    user_sorted_ids, user_sorted_pos = _build_id_lookup(user_raw_ids)
+
+    arrays = {
+        'pu': np.asarray(algo.pu, dtype=np.float32),
+        'qi': np.asarray(algo.qi, dtype=np.float32),
+        'bu': np.asarray(algo.bu, dtype=np.float32),
+        'bi': np.asarray(algo.bi, dtype=np.float32),
+        'item_raw_ids': item_raw_ids,
+        'user_raw_ids': user_raw_ids,
+        'item_sorted_ids': item_sorted_ids,
+        'item_sorted_pos': item_sorted_pos,
+        'user_sorted_ids': user_sorted_ids,
+        'user_sorted_pos': user_sorted_pos,
+        'seen_indptr': seen_indptr,
+        'seen_indices': seen_indices,
+    }
+    meta = {'global_mean': float(trainset.global_mean), 'n_users': trainset.n_users, 'n_items': trainset.n_items}
+    return arrays, meta
+
+
+def build_collaborative_model(publish=True, snapshot=None):
+    """
+    Huấn luyện mô hình SVD và lưu lại.
+    publish=False: chỉ commit version mới, model đang dùng chỉ đổi khi gọi publish_staged_artifact().
+    snapshot: version snapshot training ('current' = mới nhất) để đọc dữ liệu thay vì query DB.
+    """
+    started = time.perf_counter()
     try:
-        df = _get_interaction_data()
+        snapshot = resolve_snapshot(snapshot) if snapshot else None
+        df = _get_interaction_data(snapshot)
     except Exception as e:
         print(f"Cannot build CF model: {e}")
         return
 
+    from surprise import Dataset, Reader, SVD
     reader = Reader(rating_scale=(1, 5))
     data = Dataset.load_from_df(df[['user_id', 'product_id', 'rating']], reader)
     trainset = data.build_full_trainset()
@@ -195,97 +660,978 @@ def build_collaborative_model():
     algo = SVD(n_factors=50, n_epochs=30, lr_all=0.005, reg_all=0.04, random_state=42) # Tinh chỉnh tham số
     algo.fit(trainset)
 
-    os.makedirs(MODEL_DIR, exist_ok=True)
-    print(f"Saving CF model to {MODEL_DIR}...")
-    dump_data = {'model': algo, 'trainset': trainset}
+    print(f"Saving CF model to {cf_registry.dir}...")
     try:
-        with open(CF_MODEL_PATH, 'wb') as f:
-            pickle.dump(dump_data, f)
+        arrays, meta = _cf_arrays(algo, trainset)
+        manifest = _save_array_artifact(
+            cf_registry, arrays, meta={**meta, 'n_factors': algo.n_factors, 'snapshot': snapshot},
+            rows=len(df), watermark=_interaction_watermark(snapshot), publish=publish, started=started,
+        )
         print("Collaborative Filtering model built successfully.")
     except Exception as e:
         print(f"ERROR saving CF model: {e}")
+        return None
+    return {'artifact': CF_ARTIFACT, 'version': manifest['version']}
+
+
+# --- "THƯỜNG ĐƯỢC MUA CÙNG" (ĐỒNG XUẤT HIỆN TRONG ĐƠN HÀNG) ---
+def _complete_baskets(chunks):
+    """
+    Các chunk (order_ids, product_ids) đã sắp theo order_id: giữ lại các dòng của đơn cuối mỗi chunk
+    để ghép vào chunk sau, để 1 giỏ hàng không bị cắt đôi giữa 2 chunk.
+    """
+    carry_orders = carry_products = np.empty(0, dtype=np.int64)
+    for order_ids, product_ids in chunks:
+        order_ids = np.concatenate([carry_orders, order_ids])
+        product_ids = np.concatenate([carry_products, product_ids])
+        if not len(order_ids):
+            continue
+        split = int(np.searchsorted(order_ids, order_ids[-1]))
+        carry_orders, carry_products = order_ids[split:], product_ids[split:]
+        if split:
+            yield order_ids[:split], product_ids[:split]
+    if len(carry_orders):
+        yield carry_orders, carry_products
+
+
+def _iter_order_item_chunks(chunk_size, snapshot=None):
+    """ (order_ids, product_ids) của các đơn không bị hủy, theo từng chunk, sắp theo order_id. """
+    if snapshot:
+        # Chỉ giữ id các đơn bị hủy (ít hơn nhiều so với tổng số đơn) để lọc từng chunk
+        orders = read_table('order', ['id', 'status'], snapshot)
+        cancelled_orders = orders.filter(pc.equal(orders.column('status'), OrderStatus.CANCELLED.name)).column('id').to_numpy()
+        # order_item được export đã sắp theo order_id (SNAPSHOT_SORT_KEYS): đọc từng cửa sổ zero-copy trên memory map
+        items = read_table('order_item', ['order_id', 'product_id'], snapshot)
+        last_order_id = None
+        for start in range(0, items.num_rows, chunk_size):
+            window = items.slice(start, chunk_size)
+            order_ids = window.column('order_id').to_numpy()
+            if (last_order_id is not None and order_ids[0] < last_order_id) or np.any(np.diff(order_ids) < 0):
+                raise ValueError(f"order_item in snapshot {snapshot} is not sorted by order_id. "
+                                 "Re-export it with `python -m jobs.export_training_snapshot`.")
+            last_order_id = order_ids[-1]
+            keep = ~np.isin(order_ids, cancelled_orders)
+            yield order_ids[keep], window.column('product_id').to_numpy()[keep]
+        return
+
+    query = db.session.query(OrderItem.order_id, OrderItem.product_id).join(
+        Order, Order.id == OrderItem.order_id
+    ).filter(
+        Order.status != OrderStatus.CANCELLED
+    ).order_by(OrderItem.order_id)
+    result = db.session.connection().execution_options(stream_results=True).execute(query.statement)
+    for rows in result.partitions(chunk_size):
+        chunk = np.array(rows, dtype=np.int64)
+        yield chunk[:, 0], chunk[:, 1]
+
+
+def _count_cooccurrence(chunks, product_ids):
+    """
+    Cộng dồn ma trận đồng xuất hiện item-item (sparse) theo từng chunk giỏ hàng:
+    B (đơn x sản phẩm, nhị phân) -> B^T B. Bộ nhớ chỉ phụ thuộc chunk và số cặp khác 0, không phụ thuộc tổng số đơn.
+    Trả về (ma trận CSR, số đơn). Đường chéo = số đơn chứa từng sản phẩm.
+    """
+    n_products = len(product_ids)
+    cooccurrence = sp.csr_matrix((n_products, n_products), dtype=np.int32)
+    n_orders = 0
+    for order_ids, chunk_product_ids in _complete_baskets(chunks):
+        columns = np.searchsorted(product_ids, chunk_product_ids)
+        known = (columns < n_products) & (product_ids[np.minimum(columns, n_products - 1)] == chunk_product_ids)
+        _, rows = np.unique(order_ids[known], return_inverse=True)
+        if not len(rows):
+            continue
+        baskets = sp.csr_matrix(
+            (np.ones(len(rows), dtype=np.int32), (rows, columns[known])), shape=(int(rows.max()) + 1, n_products)
+        )
+        baskets.data[:] = 1  # cùng sản phẩm nhiều dòng trong 1 đơn chỉ tính 1 lần
+        cooccurrence = cooccurrence + (baskets.T @ baskets).tocsr()
+        n_orders += baskets.shape[0]
+    return cooccurrence, n_orders
+
+
+def _top_k_pairs(cooccurrence, n_orders, metric, min_support, top_k):
+    """ Chuẩn hóa lift/Jaccard các cặp đủ support rồi giữ top-K mỗi sản phẩm, dạng CSR (indptr, neighbors, scores, counts). """
+    n_products = cooccurrence.shape[0]
+    item_counts = cooccurrence.diagonal().astype(np.float64)
+    pairs = cooccurrence.tocoo()
+    keep = (pairs.row != pairs.col) & (pairs.data >= min_support)
+    rows, cols, counts = pairs.row[keep], pairs.col[keep], pairs.data[keep].astype(np.float64)
+
+    if metric == 'lift':
+        # P(i, j) / (P(i) P(j)): > 1 nghĩa là được mua cùng nhiều hơn ngẫu nhiên
+        scores = counts * n_orders / (item_counts[rows] * item_counts[cols])
+    elif metric == 'jaccard':
+        scores = counts / (item_counts[rows] + item_counts[cols] - counts)
+    else:
+        raise ValueError(f"Unknown bought-together metric '{metric}'. Use 'lift' or 'jaccard'.")
+
+    # Sắp theo (sản phẩm, điểm giảm dần, số đơn giảm dần) rồi giữ K phần tử đầu của mỗi sản phẩm
+    order = np.lexsort((-counts, -scores, rows))
+    rows, cols, scores, counts = rows[order], cols[order], scores[order], counts[order]
+    row_starts = np.searchsorted(rows, np.arange(n_products))
+    rank = np.arange(len(rows)) - row_starts[rows]
+    keep = rank < top_k
+    rows, cols, scores, counts = rows[keep], cols[keep], scores[keep], counts[keep]
+
+    indptr = np.zeros(n_products + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_products), out=indptr[1:])
+    return indptr, cols.astype(np.int32), scores.astype(np.float32), counts.astype(np.int32)
+
+
+def build_bought_together_model(publish=True, snapshot=None):
+    """
+    Build model "thường được mua cùng" từ các giỏ đơn hàng (OrderItem), đọc theo chunk.
+    Cùng quy ước trả về / publish=False / snapshot với build_similarity_matrix().
+    """
+    started = time.perf_counter()
+    config = current_app.config
+    top_k = int(config.get('RECOMMEND_BOUGHT_TOGETHER_TOP_K', DEFAULT_BOUGHT_TOGETHER_TOP_K))
+    metric = config.get('RECOMMEND_BOUGHT_TOGETHER_METRIC', DEFAULT_BOUGHT_TOGETHER_METRIC)
+    min_support = int(config.get('RECOMMEND_BOUGHT_TOGETHER_MIN_SUPPORT', DEFAULT_BOUGHT_TOGETHER_MIN_SUPPORT))
+    chunk_size = int(config.get('RECOMMEND_BOUGHT_TOGETHER_CHUNK_SIZE', DEFAULT_BOUGHT_TOGETHER_CHUNK_SIZE))
+
+    try:
+        snapshot = resolve_snapshot(snapshot) if snapshot else None
+        print("Counting product co-occurrence in order baskets...")
+        if snapshot:
+            product_ids = np.sort(read_table('product', ['id'], snapshot).column('id').to_numpy())
+        else:
+            product_ids = np.fromiter((pid for (pid,) in db.session.query(Product.id).order_by(Product.id)), dtype=np.int64)
+        if not len(product_ids):
+            raise Exception("No product data found to build model.")
+
+        cooccurrence, n_orders = _count_cooccurrence(_iter_order_item_chunks(chunk_size, snapshot), product_ids)
+        if not n_orders:
+            raise Exception("No order data found for bought-together model.")
+        indptr, neighbors, scores, counts = _top_k_pairs(cooccurrence, n_orders, metric, min_support, top_k)
+        print(f"Kept {len(neighbors)} product pairs from {n_orders} orders ({metric}, min support {min_support}).")
+    except Exception as e:
+        print(f"ERROR building bought-together model: {e}")
+        return None
+
+    try:
+        print(f"Saving bought-together model to {bought_together_registry.dir}...")
+        manifest = _save_array_artifact(
+            bought_together_registry,
+            {'product_ids': product_ids, 'indptr': indptr, 'neighbors': neighbors, 'scores': scores, 'counts': counts},
+            meta={'metric': metric, 'top_k': top_k, 'min_support': min_support, 'n_orders': n_orders, 'snapshot': snapshot},
+            rows=n_orders, publish=publish, started=started,
+        )
+        print("Bought-together model built successfully.")
+    except Exception as e:
+        print(f"ERROR saving bought-together model: {e}")
+        return None
+    return {'artifact': BOUGHT_TOGETHER_ARTIFACT, 'version': manifest['version']}
+
+
+_REGISTRIES = {
+    SIMILARITY_ARTIFACT: similarity_registry,
+    CF_ARTIFACT: cf_registry,
+    BOUGHT_TOGETHER_ARTIFACT: bought_together_registry,
+}
+
+
+def publish_staged_artifact(staged):
+    """ Publish kết quả của build_*(publish=False): đổi pointer CURRENT sang version vừa build. """
+    _REGISTRIES[staged['artifact']].publish(staged['version'])
+
+
+def discard_staged_artifact(staged):
+    """ Xóa version của build_*(publish=False) khi không publish (vd. 1 stage khác của job bị lỗi). """
+    _REGISTRIES[staged['artifact']].delete(staged['version'])
+
+
+# --- LOADER CHO MODEL HOLDER ---
+def _load_similarity_model():
+    version_dir, manifest, arrays = _load_array_artifact(similarity_registry)
+    ann_file = manifest.get('blobs', {}).get('ann_index')
+    return {
+        'version': manifest['version'],
+        'top_k': manifest.get('top_k'),
+        'ann_index_path': os.path.join(version_dir, ann_file) if ann_file else None,
+        **arrays,
+    }
+
+
+# FAISS index chỉ được đọc khi thật sự cần truy vấn (top_n > K đã tính sẵn)
+_ann_index_cache = {}
+_ann_index_lock = threading.Lock()
+
+
+def _get_ann_index(model):
+    index = _ann_index_cache.get(model['version'])
+    if index is not None:
+        return index
+    with _ann_index_lock:
+        index = _ann_index_cache.get(model['version'])
+        if index is None:
+            index = configure_search(faiss.read_index(model['ann_index_path']), **_ann_search_params())
+            _ann_index_cache.clear()  # chỉ giữ index của version hiện tại
+            _ann_index_cache[model['version']] = index
+    return index
+
+
+def _load_cf_model(registry=cf_registry):
+    """
+    Mở các mảng của model CF bằng memmap (vài ms, không unpickle).
+    Version cũ dạng pickle Surprise vẫn load được (chuyển sang mảng trên heap) để rollback không bị hỏng.
+    """
+    current = registry.current()
+    if current is None:
+        raise FileNotFoundError(f"No published version of artifact '{registry.name}'.")
+    version, version_dir, manifest = current
+    if 'arrays' in manifest:
+        arrays, global_mean = _open_arrays(version_dir, manifest), manifest['global_mean']
+    else:
+        with open(os.path.join(version_dir, CF_MODEL_FILE), 'rb') as f:
+            dump_data = pickle.load(f)
+        arrays, meta = _cf_arrays(dump_data['model'], dump_data['trainset'])
+        global_mean = meta['global_mean']
+    return {'version': version, 'global_mean': float(global_mean), **arrays}
+
+
+def _load_bought_together_model():
+    _, manifest, arrays = _load_array_artifact(bought_together_registry)
+    # item_raw_ids: để dùng chung ActiveProductMask (mask theo thứ tự product_ids của model)
+    return {'version': manifest['version'], 'metric': manifest.get('metric'), 'item_raw_ids': arrays['product_ids'], **arrays}
+
+
+def _top_n_indices(scores, candidate_mask, top_n):
+    """
+    Lấy index của top_n điểm cao nhất trong các vị trí candidate_mask = True.
+    argpartition O(N) rồi chỉ sort top_n phần tử, thay vì sort toàn bộ danh sách.
+    """
+    n_candidates = int(np.count_nonzero(candidate_mask))
+    k = min(top_n, n_candidates)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    masked = np.where(candidate_mask, scores, -np.inf)
+    top = np.argpartition(-masked, k - 1)[:k]
+    return top[np.argsort(-masked[top], kind='stable')]
+
+
+def _top_n_indices_batch(scores, top_n):
+    """
+    Phiên bản theo dòng của _top_n_indices cho ma trận điểm [users, items], các ô không phải candidate = -inf.
+    Làm việc tại chỗ (scores bị ghi đè) để không tạo thêm bản sao cỡ ma trận điểm.
+    Trả về (top [users, k], valid [users, k]); valid = False ở các ô không phải candidate.
+    """
+    k = min(top_n, scores.shape[1])
+    if k <= 0:
+        empty = np.empty((scores.shape[0], 0), dtype=np.int64)
+        return empty, empty.astype(bool)
+    np.negative(scores, out=scores)
+    top = np.argpartition(scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(top_scores, axis=1, kind='stable')
+    top = np.take_along_axis(top, order, axis=1)
+    valid = np.isfinite(np.take_along_axis(top_scores, order, axis=1))
+    return top, valid
+
+
+def _for_you_key(version, user_id):
+    return f"{FOR_YOU_KEY_PREFIX}:{version}:{user_id}"
+
+
+def _get_precomputed_recommendations(version, user_id):
+    """ Đọc danh sách gợi ý đã tính sẵn từ Redis; None nếu không có (hoặc Redis lỗi). """
+    try:
+        raw = redis_client.get(_for_you_key(version, user_id))
+    except Exception as e:
+        print(f"[WARN] Could not read precomputed recommendations from Redis: {e}")
+        return None
+    return json.loads(raw) if raw is not None else None
 
 
-# --- HÀM GET GỢI Ý (Không đổi logic chính) ---
+# --- FOLD-IN USER MỚI ---
+def _fold_in_key(user_id):
+    return f"{FOLD_IN_KEY_PREFIX}:{user_id}"
+
+
+def invalidate_user_fold_in(user_id):
+    """ Xóa vector fold-in đã cache để lần gợi ý sau tính lại với tương tác mới nhất. """
+    try:
+        redis_client.delete(_fold_in_key(user_id))
+    except Exception as e:
+        print(f"[WARN] Could not invalidate fold-in vector for user {user_id}: {e}")
+
+
+def _solve_fold_in_vector(qi, bi, global_mean, item_inner_ids, ratings, reg):
+    """
+    Giải least-squares có regularization cho vector [p_u, b_u] của user mới,
+    giữ cố định item factors: min ||[Q 1] x - (r - mu - b_i)||^2 + reg * ||x||^2.
+    """
+    design = np.hstack([qi[item_inner_ids], np.ones((len(item_inner_ids), 1))])
+    target = ratings - global_mean - bi[item_inner_ids]
+    gram = design.T @ design + reg * np.eye(design.shape[1])
+    return np.linalg.solve(gram, design.T @ target)
+
+
+def _get_fold_in_user(model, user_id):
+    """
+    Tính (hoặc lấy từ Redis) vector user cho user chưa có trong model CF,
+    từ các Interaction gần nhất của họ. Trả về (vector [p_u, b_u], inner ids đã tương tác)
+    hoặc (None, None) nếu user chưa tương tác với item nào model biết.
+    """
+    max_interactions = int(current_app.config.get('RECOMMEND_FOLD_IN_MAX_INTERACTIONS', DEFAULT_FOLD_IN_MAX_INTERACTIONS))
+    recent = db.session.query(Interaction.product_id, Interaction.type).filter(
+        Interaction.user_id == user_id
+    ).order_by(desc(Interaction.timestamp)).limit(max_interactions).all()
+
+    # Rating cao nhất cho mỗi item (giống lúc train), chỉ giữ item có trong model
+    ratings = {}
+    for product_id, interaction_type in recent:
+        inner_id = _lookup_index(model['item_sorted_ids'], model['item_sorted_pos'], product_id)
+        if inner_id is None:
+            continue
+        ratings[inner_id] = max(ratings.get(inner_id, 0.0), INTERACTION_WEIGHTS.get(interaction_type, 0.0))
+    if not ratings:
+        return None, None
+    item_inner_ids = np.fromiter(ratings.keys(), dtype=np.int64, count=len(ratings))
+
+    key = _fold_in_key(user_id)
+    try:
+        cached = redis_client.hgetall(key)
+    except Exception as e:
+        print(f"[WARN] Could not read fold-in vector from Redis: {e}")
+        cached = {}
+    if cached.get(b'version', b'').decode() == model['version']:
+        return np.frombuffer(cached[b'vector'], dtype=np.float32).astype(np.float64), item_inner_ids
+
+    reg = float(current_app.config.get('RECOMMEND_FOLD_IN_REG', DEFAULT_FOLD_IN_REG))
+    vector = _solve_fold_in_vector(
+        model['qi'], model['bi'], model['global_mean'],
+        item_inner_ids, np.fromiter(ratings.values(), dtype=np.float64, count=len(ratings)), reg
+    )
+
+    ttl = int(current_app.config.get('RECOMMEND_FOLD_IN_TTL', DEFAULT_FOLD_IN_TTL))
+    try:
+        pipe = redis_client.pipeline()
+        pipe.hset(key, mapping={'version': model['version'], 'vector': vector.astype(np.float32).tobytes()})
+        pipe.expire(key, ttl)
+        pipe.execute()
+    except Exception as e:
+        print(f"[WARN] Could not cache fold-in vector in Redis: {e}")
+
+    print(f"Folded in new user {user_id} from {len(item_inner_ids)} interacted items.")
+    return vector, item_inner_ids
+
+
+# --- BATCH TÍNH SẴN GỢI Ý "FOR YOU" ---
+def precompute_user_recommendations():
+    """
+    Chạy sau build_collaborative_model(): chấm điểm toàn bộ user đã biết theo từng chunk
+    (1 phép nhân ma trận cho cả chunk) và ghi top-N product_id của mỗi user vào Redis
+    dưới key gắn version của model CF.
+    Lỗi Redis chỉ làm mất chunk đó (request sẽ tính trực tiếp); Redis lỗi liên tiếp
+    PRECOMPUTE_MAX_REDIS_FAILURES chunk thì dừng sớm. Trả về số user đã ghi được.
+    """
+    if cf_registry.current_version() is None:
+        print("Cannot precompute recommendations: CF model file not found.")
+        return 0
+
+    model = _load_cf_model()
+    top_n = int(current_app.config.get('RECOMMEND_PRECOMPUTE_TOP_N', DEFAULT_PRECOMPUTE_TOP_N))
+    max_chunk_size = int(current_app.config.get('RECOMMEND_PRECOMPUTE_CHUNK_SIZE', DEFAULT_PRECOMPUTE_CHUNK_SIZE))
+    memory_mb = float(current_app.config.get('RECOMMEND_PRECOMPUTE_MEMORY_MB', DEFAULT_PRECOMPUTE_MEMORY_MB))
+    ttl = int(current_app.config.get('RECOMMEND_PRECOMPUTE_TTL', DEFAULT_PRECOMPUTE_TTL))
+
+    item_raw_ids = model['item_raw_ids']
+    user_raw_ids = model['user_raw_ids']
+    seen_indptr, seen_indices = model['seen_indptr'], model['seen_indices']
+    inactive_items = np.flatnonzero(~_query_active_mask(item_raw_ids))
+    item_base = model['global_mean'] + model['bi']
+    qi_t = np.ascontiguousarray(model['qi'].T)
+
+    # Số user mỗi chunk theo ngân sách bộ nhớ: catalog lớn -> chunk nhỏ hơn
+    n_users, n_items = len(user_raw_ids), len(item_raw_ids)
+    chunk_size = int(memory_mb * 2**20 // (max(n_items, 1) * PRECOMPUTE_BYTES_PER_SCORE))
+    chunk_size = max(1, min(chunk_size, max_chunk_size))
+    print(f"Precomputing top-{top_n} recommendations for {n_users} users (model {model['version']}, "
+          f"{chunk_size} users per chunk)...")
+    started = time.perf_counter()
+    written, consecutive_failures = 0, 0
+    for start in range(0, n_users, chunk_size):
+        stop = min(start + chunk_size, n_users)
+
+        scores = model['pu'][start:stop] @ qi_t
+        scores += item_base
+        scores += model['bu'][start:stop, None]
+
+        # Loại sản phẩm đã tắt và sản phẩm user đã tương tác ngay trên ma trận điểm (không tạo mask [users, items])
+        scores[:, inactive_items] = -np.inf
+        seen_rows = np.repeat(np.arange(stop - start), np.diff(seen_indptr[start:stop + 1]))
+        scores[seen_rows, seen_indices[seen_indptr[start]:seen_indptr[stop]]] = -np.inf
+
+        top, valid = _top_n_indices_batch(scores, top_n)
+
+        pipe = redis_client.pipeline(transaction=False)
+        for offset in range(stop - start):
+            product_ids = item_raw_ids[top[offset][valid[offset]]].tolist()
+            pipe.set(_for_you_key(model['version'], user_raw_ids[start + offset]), json.dumps(product_ids), ex=ttl)
+        try:
+            pipe.execute()
+        except Exception as e:
+            consecutive_failures += 1
+            print(f"[WARN] Could not write precomputed recommendations for users {start}-{stop} to Redis: {e}")
+            if consecutive_failures >= PRECOMPUTE_MAX_REDIS_FAILURES:
+                print(f"[WARN] Redis failed {consecutive_failures} chunks in a row, stopping precompute early.")
+                break
+            continue
+        consecutive_failures = 0
+        written += stop - start
+
+        elapsed = time.perf_counter() - started
+        print(f"[INFO] Precomputed {stop}/{n_users} users ({stop / elapsed:.0f} users/sec)")
+
+    elapsed = time.perf_counter() - started
+    print(f"Precomputed recommendations for {written}/{n_users} users in {elapsed:.2f}s "
+          f"({written / elapsed if elapsed else 0:.0f} users/sec).")
+    return written
+
+
+# Holder dùng chung cho cả process (mỗi worker load 1 lần)
+# Holder theo dõi pointer CURRENT của registry: publish/rollback -> worker tự load version mới
+similarity_model_holder = ModelHolder("content-based", [similarity_registry.pointer_path], _load_similarity_model)
+cf_model_holder = ModelHolder("collaborative-filtering", [cf_registry.pointer_path], _load_cf_model)
+bought_together_model_holder = ModelHolder(
+    "bought-together", [bought_together_registry.pointer_path], _load_bought_together_model
+)
+
+
+# --- MASK SẢN PHẨM ACTIVE (THEO ITEM INDEX CỦA MODEL CF) ---
+def _query_active_mask(item_raw_ids):
+    """ 1 query lấy id sản phẩm active, trả về mask bool cùng thứ tự với item_raw_ids. """
+    active_ids = np.fromiter(
+        (pid for (pid,) in db.session.query(Product.id).filter(Product.is_active == True)), dtype=np.int64
+    )
+    return np.isin(item_raw_ids, active_ids)
+
+
+def _read_active_products_version():
+    try:
+        return redis_client.get(ACTIVE_PRODUCTS_VERSION_KEY)
+    except Exception as e:
+        print(f"[WARN] Could not read active products version from Redis: {e}")
+        return None
+
+
+class ActiveProductMask:
+    """
+    Cache trong process: mask bool các sản phẩm còn active, thẳng hàng với item index của model CF,
+    để lọc candidate bằng phép toán vector thay vì query IN (có thể chứa cả catalog) ở mọi request.
+    Làm mới khi: model CF đổi version, quá TTL (RECOMMEND_ACTIVE_MASK_TTL), hoặc counter
+    ACTIVE_PRODUCTS_VERSION_KEY trong Redis đổi (admin bật/tắt is_active, xem notify_active_products_changed).
+    """
+
+    def __init__(self, check_interval=ACTIVE_MASK_CHECK_INTERVAL):
+        self._check_interval = check_interval
+        self._lock = threading.Lock()
+        self._state = None  # (model_version, notify_version, loaded_at, mask)
+        self._last_check = 0.0
+
+    def get(self, model):
+        ttl = float(current_app.config.get('RECOMMEND_ACTIVE_MASK_TTL', DEFAULT_ACTIVE_MASK_TTL))
+        state = self._state
+        now = time.monotonic()
+        if state is not None and state[0] == model['version'] and now - state[2] < ttl:
+            if now - self._last_check < self._check_interval:
+                return state[3]
+            # Tối đa 1 lệnh Redis GET mỗi check_interval để nhận thông báo từ worker khác
+            self._last_check = now
+            if _read_active_products_version() == state[1]:
+                return state[3]
+
+        with self._lock:
+            if self._state is not state and self._state is not None and self._state[0] == model['version']:
+                # Thread khác vừa làm mới xong
+                return self._state[3]
+            notify_version = _read_active_products_version()
+            mask = _query_active_mask(model['item_raw_ids'])
+            mask.setflags(write=False)
+            self._state = (model['version'], notify_version, time.monotonic(), mask)
+            self._last_check = time.monotonic()
+            return mask
+
+    def invalidate(self):
+        self._state = None
+
+
+active_product_mask = ActiveProductMask()
+bought_together_active_mask = ActiveProductMask()
+
+
+def notify_active_products_changed():
+    """ Gọi sau khi commit thay đổi is_active: các worker sẽ làm mới mask ở lần kiểm tra kế tiếp. """
+    active_product_mask.invalidate()
+    bought_together_active_mask.invalidate()
+    try:
+        redis_client.incr(ACTIVE_PRODUCTS_VERSION_KEY)
+    except Exception as e:
+        print(f"[WARN] Could not publish active products change to Redis: {e}")
+
+
+# --- HÀM GET GỢI Ý ---
 def get_similar_products(product_id, top_n=5):
     """ Lấy Top N sản phẩm tương tự (Content-Based). """
-    print(f"Loading similarity models for product_id: {product_id}")
-    if not os.path.exists(MATRIX_PATH) or not os.path.exists(MAPPING_PATH):
-         print("Error: Similarity model files not found. Please run the training job.")
-         # Cân nhắc build lại nếu file không tồn tại? Hoặc chỉ trả lỗi.
-         # build_similarity_matrix() # Có thể thêm dòng này nếu muốn tự build khi thiếu
-         return [], 503 # Service Unavailable
-
     try:
-        with open(MATRIX_PATH, 'rb') as f:
-            cosine_sim = pickle.load(f)
-        with open(MAPPING_PATH, 'rb') as f:
-            mapping = pickle.load(f)
-            id_to_index = mapping['id_to_index']
-            index_to_id = mapping['index_to_id']
+        model = similarity_model_holder.get()
     except Exception as e:
         print(f"Error loading similarity models: {e}")
         return [], 500
 
-    if product_id not in id_to_index:
+    if model is None:
+        print("Error: Similarity model files not found. Please run the training job.")
+        return [], 503 # Service Unavailable
+
+    idx = _lookup_index(model['sorted_ids'], model['sorted_pos'], product_id)
+    if idx is None:
         print(f"Warning: Product ID {product_id} not found in model mapping.")
         return [], 404 # Not Found hợp lý hơn
 
-    idx = id_to_index[product_id]
-    sim_scores = list(enumerate(cosine_sim[idx]))
-    sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
-    sim_scores = sim_scores[1:top_n+1]
-    product_indices = [i[0] for i in sim_scores]
-    # Lọc ra các index hợp lệ trước khi truy cập index_to_id
-    recommended_product_ids = [index_to_id[i] for i in product_indices if i in index_to_id]
+    if top_n > model['neighbors'].shape[1] and model.get('ann_index_path'):
+        # Cần nhiều hơn K láng giềng đã tính sẵn -> truy vấn trực tiếp index ANN
+        _, labels = _get_ann_index(model).search(model['vectors'][idx:idx + 1], top_n + 1)
+        row = labels[0][(labels[0] >= 0) & (labels[0] != idx)][:top_n]
+    else:
+        # Láng giềng ANN đã được sắp xếp sẵn lúc train -> chỉ cần cắt K phần tử đầu
+        row = model['neighbors'][idx, :top_n]
+        row = row[row >= 0]
+    recommended_product_ids = model['product_ids'][row].tolist()
 
     print(f"Similar product IDs found: {recommended_product_ids}")
     return recommended_product_ids, 200
 
+def get_similar_products_batch(product_ids, top_n=5):
+    """
+    Giống get_similar_products() cho nhiều sản phẩm nguồn trong 1 lần: tra index và cắt láng giềng dạng vector.
+    Trả về ({product_id nguồn: [product_id tương tự]}, status); sản phẩm nguồn không có trong model -> [].
+    """
+    try:
+        model = similarity_model_holder.get()
+    except Exception as e:
+        print(f"Error loading similarity models: {e}")
+        return {}, 500
+
+    if model is None:
+        print("Error: Similarity model files not found. Please run the training job.")
+        return {}, 503 # Service Unavailable
+
+    sorted_ids = model['sorted_ids']
+    seeds, out_of_range = _split_ids_in_range(product_ids, sorted_ids.dtype)
+    seeds = np.unique(seeds)
+    positions = np.minimum(np.searchsorted(sorted_ids, seeds), len(sorted_ids) - 1)
+    found = sorted_ids[positions] == seeds
+    idx = model['sorted_pos'][positions[found]]
+    # Id ngoài miền giá trị của dtype (ép kiểu sẽ OverflowError) chắc chắn không có trong model
+    results = {int(seed): [] for seed in [*seeds[~found].tolist(), *out_of_range]}
+    if not len(idx):
+        return results, 200
+
+    if top_n > model['neighbors'].shape[1] and model.get('ann_index_path'):
+        # Cần nhiều hơn K láng giềng đã tính sẵn -> 1 lần search ANN cho cả batch
+        _, rows = _get_ann_index(model).search(np.ascontiguousarray(model['vectors'][idx]), top_n + 1)
+    else:
+        rows = model['neighbors'][idx, :top_n]
+    valid = (rows >= 0) & (rows != idx[:, None])
+    neighbor_ids = model['product_ids'][np.where(valid, rows, 0)]
+
+    for seed, row_ids, row_valid in zip(seeds[found].tolist(), neighbor_ids, valid):
+        results[seed] = row_ids[row_valid][:top_n].tolist()
+    return results, 200
+
 def get_collaborative_recommendations(user_id, top_n=10):
     """ Lấy Top N gợi ý cá nhân hóa (Collaborative Filtering). """
-    print(f"Loading CF model for user_id: {user_id}")
-    if not os.path.exists(CF_MODEL_PATH):
+    try:
+        dump_data = cf_model_holder.get()
+    except Exception as e:
+        print(f"Error loading CF models: {e}")
+        return [], 500
+
+    if dump_data is None:
         print("Error: CF Model file not found. Please run the training job.")
-        # build_collaborative_model() # Có thể thêm dòng này nếu muốn tự build khi thiếu
         return [], 503 # Service Unavailable
 
+    # Ưu tiên kết quả đã tính sẵn sau lần train gần nhất (1 lệnh Redis GET)
+    precomputed = _get_precomputed_recommendations(dump_data['version'], user_id)
+    if precomputed:
+        # Danh sách được tính lúc train: bỏ các sản phẩm đã bị tắt sau đó (cùng mask cache với nhánh tính trực tiếp)
+        precomputed_ids = np.asarray(precomputed, dtype=np.int64)
+        positions = dump_data['item_sorted_pos'][np.searchsorted(dump_data['item_sorted_ids'], precomputed_ids)]
+        active_ids = precomputed_ids[active_product_mask.get(dump_data)[positions]]
+        if len(active_ids) >= top_n:
+            return active_ids[:top_n].tolist(), 200
+        # Không đủ top_n sau khi lọc -> tính trực tiếp bên dưới
+    elif precomputed is not None:
+        return [], 200
+
+    item_raw_ids = dump_data['item_raw_ids']
+    candidate_mask = np.ones(len(item_raw_ids), dtype=bool)
+
+    user_inner_id = _lookup_index(dump_data['user_sorted_ids'], dump_data['user_sorted_pos'], user_id)
+    if user_inner_id is not None:
+        user_factors = dump_data['pu'][user_inner_id]
+        user_bias = dump_data['bu'][user_inner_id]
+        seen_indptr = dump_data['seen_indptr']
+        candidate_mask[dump_data['seen_indices'][seen_indptr[user_inner_id]:seen_indptr[user_inner_id + 1]]] = False
+    else:
+        # User mới: fold-in từ tương tác gần đây vào item factors cố định, không cần train lại
+        vector, seen_inner_ids = _get_fold_in_user(dump_data, user_id)
+        if vector is None:
+            print(f"User ID {user_id} is a new user (cold start). Cannot provide CF recos.")
+            return [], 200 # OK, trả về rỗng để route xử lý fallback
+        user_factors, user_bias = vector[:-1], vector[-1]
+        candidate_mask[seen_inner_ids] = False
+
+    if not candidate_mask.any():
+        print(f"User {user_id} has interacted with all available items. No new recommendations.")
+        return [], 200
+
+    # Chỉ gợi ý sản phẩm còn active: mask cache sẵn theo item index, không query DB
+    candidate_mask &= active_product_mask.get(dump_data)
+
+    # Cùng công thức với SVD.predict(): mu + b_u + b_i + q_i . p_u, tính cho mọi item trong 1 phép nhân ma trận-vector.
+    # Không clip về rating_scale như predict() để giữ thứ tự giữa các item vượt ngưỡng 5.
+    scores = dump_data['global_mean'] + user_bias + dump_data['bi'] + dump_data['qi'] @ user_factors
+    top = _top_n_indices(scores, candidate_mask, top_n)
+    recommended_product_ids = item_raw_ids[top].tolist()
+
+    print(f"CF recommendations for user {user_id}: {recommended_product_ids}")
+    return recommended_product_ids, 200
+
+
+def get_bought_together(product_ids, top_n=5):
+    """
+    Top N sản phẩm thường được mua cùng 1 hoặc nhiều sản phẩm (vd. cả giỏ hàng):
+    cộng điểm top-K của từng sản phẩm nguồn, bỏ chính các sản phẩm nguồn và sản phẩm không còn active.
+    """
     try:
-        with open(CF_MODEL_PATH, 'rb') as f:
-            dump_data = pickle.load(f)
-            algo = dump_data['model']
-            trainset = dump_data['trainset']
+        model = bought_together_model_holder.get()
     except Exception as e:
-        print(f"Error loading CF models: {e}")
+        print(f"Error loading bought-together model: {e}")
         return [], 500
 
-    try:
-        user_inner_id = trainset.to_inner_uid(user_id)
-    except ValueError:
-        print(f"User ID {user_id} is a new user (cold start). Cannot provide CF recos.")
-        return [], 200 # OK, trả về rỗng để route xử lý fallback
+    if model is None:
+        print("Error: Bought-together model files not found. Please run the training job.")
+        return [], 503 # Service Unavailable
 
-    interacted_items = set([item_inner_id for (item_inner_id, rating) in trainset.ur[user_inner_id]])
-    all_items = set(trainset.all_items())
-    items_to_predict = all_items - interacted_items
+    all_ids = model['product_ids']
+    # Id ngoài miền giá trị của dtype chắc chắn không có trong model, bỏ trước khi ép kiểu
+    query_ids = np.unique(_split_ids_in_range(product_ids, all_ids.dtype)[0])
+    positions = np.searchsorted(all_ids, query_ids)
+    found = positions < len(all_ids)
+    found[found] = all_ids[positions[found]] == query_ids[found]
+    positions = positions[found]
+    if not len(positions):
+        return [], 200 # Sản phẩm mới, chưa có trong đơn hàng nào lúc train
 
-    if not items_to_predict:
-        print(f"User {user_id} has interacted with all available items. No new recommendations.")
+    indptr = model['indptr']
+    neighbor_rows = [model['neighbors'][indptr[p]:indptr[p + 1]] for p in positions]
+    score_rows = [model['scores'][indptr[p]:indptr[p + 1]] for p in positions]
+    neighbors = np.concatenate(neighbor_rows)
+    if not len(neighbors):
         return [], 200
 
-    predictions = []
-    # Lấy danh sách raw_iids (product_id gốc) để dự đoán
-    raw_iids_to_predict = [trainset.to_raw_iid(inner_id) for inner_id in items_to_predict]
+    candidates, inverse = np.unique(neighbors, return_inverse=True)
+    scores = np.bincount(inverse, weights=np.concatenate(score_rows))
+    candidate_mask = ~np.isin(candidates, positions)
+    candidate_mask &= bought_together_active_mask.get(model)[candidates]
 
-    # Kiểm tra xem sản phẩm có còn active không trước khi dự đoán
-    active_product_ids = {p.id for p in Product.query.filter(Product.id.in_(raw_iids_to_predict), Product.is_active == True).all()}
+    top = _top_n_indices(scores, candidate_mask, top_n)
+    recommended_product_ids = all_ids[candidates[top]].tolist()
+    print(f"Bought-together product IDs for {query_ids.tolist()}: {recommended_product_ids}")
+    return recommended_product_ids, 200
 
-    for item_raw_id in active_product_ids:
-         pred = algo.predict(uid=user_id, iid=item_raw_id)
-         predictions.append((item_raw_id, pred.est))
 
-    predictions.sort(key=lambda x: x[1], reverse=True)
-    recommended_product_ids = [pid for (pid, rating) in predictions[:top_n]]
+# --- GỢI Ý THEO PHIÊN (SỰ KIỆN GẦN ĐÂY TRONG REDIS, KHÔNG CẦN TRAIN LẠI) ---
+def _session_key(user_id):
+    return f"{SESSION_KEY_PREFIX}:{user_id}"
 
-    print(f"CF recommendations for user {user_id}: {recommended_product_ids}")
-    return recommended_product_ids, 200
\ No newline at end of file
+
+def record_session_event(user_id, product_id, interaction_type, when=None):
+    """ Đẩy sự kiện vào đầu list phiên của user, cắt còn RECOMMEND_SESSION_MAX_EVENTS. Lỗi Redis không làm hỏng request. """
+    config = current_app.config
+    max_events = int(config.get('RECOMMEND_SESSION_MAX_EVENTS', DEFAULT_SESSION_MAX_EVENTS))
+    ttl = int(config.get('RECOMMEND_SESSION_TTL', DEFAULT_SESSION_TTL))
+    key = _session_key(user_id)
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.lpush(key, f"{product_id}:{interaction_type.name}:{int(when or time.time())}")
+        pipe.ltrim(key, 0, max_events - 1)
+        pipe.expire(key, ttl)
+        pipe.execute()
+    except Exception as e:
+        print(f"[WARN] Could not record session event for user {user_id}: {e}")
+
+
+def get_session_events(user_id):
+    """ [(product_id, InteractionType, unix_ts)] của phiên hiện tại, mới nhất trước. """
+    try:
+        raw_events = redis_client.lrange(_session_key(user_id), 0, -1)
+    except Exception as e:
+        print(f"[WARN] Could not read session events for user {user_id}: {e}")
+        return []
+    events = []
+    for raw in raw_events:
+        try:
+            product_id, type_name, timestamp = raw.decode().split(':')
+            events.append((int(product_id), InteractionType[type_name], int(timestamp)))
+        except (ValueError, KeyError):
+            continue
+    return events
+
+
+def _session_seed_weights(events, half_life, now):
+    """ Trọng số mỗi sản phẩm trong phiên = tổng (trọng số loại sự kiện * 0.5 ^ (tuổi / half_life)). """
+    weights = {}
+    for product_id, interaction_type, timestamp in events:
+        decay = 0.5 ** (max(0.0, now - timestamp) / half_life)
+        weights[product_id] = weights.get(product_id, 0.0) + INTERACTION_WEIGHTS.get(interaction_type, 0.0) * decay
+    return weights
+
+
+def get_session_recommendations(user_id, top_n=10, budget_ms=None):
+    """
+    Gợi ý trong phiên: gộp láng giềng content-based của các sản phẩm vừa xem/thêm giỏ/mua,
+    điểm = trọng số seed (loại sự kiện, độ mới) * độ tương tự. Seed nặng nhất được xử lý trước;
+    hết ngân sách thời gian (RECOMMEND_SESSION_BUDGET_MS) thì trả về kết quả đã gộp được.
+    """
+    config = current_app.config
+    started = time.perf_counter()
+    if budget_ms is None:
+        budget_ms = float(config.get('RECOMMEND_SESSION_BUDGET_MS', DEFAULT_SESSION_BUDGET_MS))
+    deadline = started + budget_ms / 1000
+    half_life = float(config.get('RECOMMEND_SESSION_HALF_LIFE', DEFAULT_SESSION_HALF_LIFE))
+    n_neighbors = int(config.get('RECOMMEND_SESSION_NEIGHBORS', DEFAULT_SESSION_NEIGHBORS))
+
+    events = get_session_events(user_id)
+    if not events:
+        return [], 200 # Chưa có sự kiện nào trong phiên
+
+    try:
+        model = similarity_model_holder.get()
+    except Exception as e:
+        print(f"Error loading similarity models: {e}")
+        return [], 500
+    if model is None:
+        print("Error: Similarity model files not found. Please run the training job.")
+        return [], 503 # Service Unavailable
+
+    seed_weights = _session_seed_weights(events, half_life, time.time())
+    scores = {}
+    n_seeds = 0
+    for seed_id in sorted(seed_weights, key=seed_weights.get, reverse=True):
+        if time.perf_counter() >= deadline:
+            break
+        idx = _lookup_index(model['sorted_ids'], model['sorted_pos'], seed_id)
+        if idx is None:
+            continue
+        row = model['neighbors'][idx, :n_neighbors]
+        valid = row >= 0
+        for product_id, similarity in zip(model['product_ids'][row[valid]].tolist(),
+                                          model['scores'][idx, :n_neighbors][valid].tolist()):
+            scores[product_id] = scores.get(product_id, 0.0) + seed_weights[seed_id] * similarity
+        n_seeds += 1
+    for seed_id in seed_weights:
+        scores.pop(seed_id, None)
+
+    recommended_product_ids = sorted(scores, key=scores.get, reverse=True)[:top_n]
+    print(f"Session recommendations for user {user_id} from {n_seeds}/{len(seed_weights)} seeds "
+          f"in {(time.perf_counter() - started) * 1000:.1f}ms: {recommended_product_ids}")
+    return recommended_product_ids, 200
+
+
+# --- HYBRID RANKER (CF + CONTENT + POPULAR, CÓ NGÂN SÁCH THỜI GIAN) ---
+# Tạo lazy ở request đầu tiên để lấy kích thước từ Config (RECOMMEND_HYBRID_WORKERS)
+_hybrid_executor = None
+_hybrid_executor_lock = threading.Lock()
+
+# Số task đang chạy (hoặc chờ thread) của từng nguồn, tính cả task đã bị bỏ do quá ngân sách:
+# cancel() không dừng được task đang chạy, nên nguồn chậm bị giới hạn ở RECOMMEND_HYBRID_MAX_IN_FLIGHT
+# task thay vì chiếm hết pool và làm các nguồn khác cũng timeout theo
+_hybrid_in_flight = {}
+_hybrid_in_flight_lock = threading.Lock()
+
+# Thống kê latency theo nguồn (trong process), đọc qua get_hybrid_source_stats()
+_hybrid_stats = {}
+_hybrid_stats_lock = threading.Lock()
+
+
+def _get_hybrid_executor():
+    global _hybrid_executor
+    if _hybrid_executor is None:
+        with _hybrid_executor_lock:
+            if _hybrid_executor is None:
+                max_workers = int(current_app.config.get('RECOMMEND_HYBRID_WORKERS', DEFAULT_HYBRID_WORKERS))
+                _hybrid_executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='reco-source')
+    return _hybrid_executor
+
+
+def _acquire_source_slot(source, max_in_flight):
+    """ Giữ 1 slot cho nguồn; False nếu nguồn đã có max_in_flight task chưa xong (bỏ qua nguồn ở request này). """
+    with _hybrid_in_flight_lock:
+        if _hybrid_in_flight.get(source, 0) >= max_in_flight:
+            return False
+        _hybrid_in_flight[source] = _hybrid_in_flight.get(source, 0) + 1
+        return True
+
+
+def _release_source_slot(source):
+    with _hybrid_in_flight_lock:
+        _hybrid_in_flight[source] -= 1
+
+
+def _record_source_latency(source, latency_ms, outcome='ok'):
+    """ outcome: 'ok' | 'error' | 'timeout' | 'skipped' (nguồn đang đủ task, không được chạy). """
+    with _hybrid_stats_lock:
+        stats = _hybrid_stats.setdefault(source, {
+            'calls': 0, 'timeouts': 0, 'errors': 0, 'skipped': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'last_ms': None
+        })
+        stats['calls'] += 1
+        if outcome == 'timeout':
+            stats['timeouts'] += 1
+        elif outcome == 'error':
+            stats['errors'] += 1
+        elif outcome == 'skipped':
+            stats['skipped'] += 1
+        if outcome != 'ok':
+            return
+        stats['total_ms'] += latency_ms
+        stats['max_ms'] = max(stats['max_ms'], latency_ms)
+        stats['last_ms'] = round(latency_ms, 2)
+
+
+def get_hybrid_source_stats():
+    """
+    Latency trung bình/lớn nhất (trên các lần thành công) và số lần timeout / lỗi / bị bỏ qua do đủ task
+    của từng nguồn candidate, kèm số task đang chạy hiện tại.
+    """
+    with _hybrid_in_flight_lock:
+        in_flight = dict(_hybrid_in_flight)
+    with _hybrid_stats_lock:
+        result = {}
+        for source, stats in _hybrid_stats.items():
+            completed = stats['calls'] - stats['timeouts'] - stats['errors'] - stats['skipped']
+            result[source] = {
+                **stats,
+                'in_flight': in_flight.get(source, 0),
+                'avg_ms': round(stats['total_ms'] / completed, 2) if completed else None,
+                'max_ms': round(stats['max_ms'], 2),
+                'total_ms': round(stats['total_ms'], 2),
+            }
+        return result
+
+
+def _cf_candidates(user_id, n_candidates):
+    product_ids, status = get_collaborative_recommendations(user_id, top_n=n_candidates)
+    return product_ids if status == 200 else []
+
+
+def _content_candidates(user_id, n_candidates):
+    """ Láng giềng content-based của các sản phẩm user vừa xem/thêm giỏ, seed gần đây được ưu tiên. """
+    n_recent = int(current_app.config.get('RECOMMEND_HYBRID_RECENT_ITEMS', DEFAULT_HYBRID_RECENT_ITEMS))
+    recent = db.session.query(Interaction.product_id).filter(
+        Interaction.user_id == user_id,
+        Interaction.type.in_([InteractionType.VIEW, InteractionType.ADD_TO_CART])
+    ).order_by(desc(Interaction.timestamp)).limit(n_recent * 4).all()
+    seeds = list(dict.fromkeys(pid for (pid,) in recent))[:n_recent]
+    return content_candidates_from_seeds(seeds, n_candidates)
+
+
+def content_candidates_from_seeds(seeds, n_candidates):
+    """ Gộp láng giềng của danh sách seed (mới nhất trước), trọng số 1 / (thứ hạng seed * thứ hạng láng giềng). """
+    scores = {}
+    for seed_rank, seed_id in enumerate(seeds):
+        neighbors, status = get_similar_products(seed_id, top_n=n_candidates)
+        if status != 200:
+            continue
+        for rank, product_id in enumerate(neighbors):
+            scores[product_id] = scores.get(product_id, 0.0) + 1.0 / ((seed_rank + 1) * (rank + 1))
+    for seed_id in seeds:
+        scores.pop(seed_id, None)
+    return sorted(scores, key=scores.get, reverse=True)[:n_candidates]
+
+
+def _session_candidates(user_id, n_candidates):
+    product_ids, status = get_session_recommendations(user_id, top_n=n_candidates)
+    return product_ids if status == 200 else []
+
+
+def _popular_candidates(user_id, n_candidates):
+    product_ids, status = get_top_products(top_n=n_candidates)
+    return product_ids if status == 200 else []
+
+
+HYBRID_SOURCES = {
+    'cf': _cf_candidates,
+    'session': _session_candidates,
+    'content': _content_candidates,
+    'popular': _popular_candidates,
+}
+
+
+def get_hybrid_recommendations(user_id, top_n=10):
+    """
+    Lấy candidate song song từ CF, session (sự kiện trong phiên), content (láng giềng của sản phẩm vừa xem) và popular,
+    chấm điểm theo thứ hạng * trọng số của nguồn, gộp trùng rồi lấy top N.
+    Mỗi nguồn có ngân sách thời gian riêng: nguồn nào chưa xong khi hết hạn thì bị bỏ qua
+    thay vì làm chậm response; nguồn đang có đủ RECOMMEND_HYBRID_MAX_IN_FLIGHT task chưa xong
+    (vd. DB chậm) bị bỏ qua luôn, không xếp thêm task vào pool. Latency / timeout / lỗi từng nguồn được ghi nhận.
+    """
+    config = current_app.config
+    weights = config.get('RECOMMEND_HYBRID_WEIGHTS', DEFAULT_HYBRID_WEIGHTS)
+    budgets_ms = config.get('RECOMMEND_HYBRID_BUDGETS_MS', DEFAULT_HYBRID_BUDGETS_MS)
+    n_candidates = int(config.get('RECOMMEND_HYBRID_CANDIDATES', DEFAULT_HYBRID_CANDIDATES))
+    max_in_flight = int(config.get('RECOMMEND_HYBRID_MAX_IN_FLIGHT', DEFAULT_HYBRID_MAX_IN_FLIGHT))
+    executor = _get_hybrid_executor()
+    app = current_app._get_current_object()
+
+    def run_source(source, source_func):
+        try:
+            started = time.perf_counter()
+            with app.app_context():
+                product_ids = source_func(user_id, n_candidates)
+            return product_ids, (time.perf_counter() - started) * 1000
+        finally:
+            # Nhả slot khi task thực sự kết thúc (kể cả task đã bị request bỏ do timeout)
+            _release_source_slot(source)
+
+    started = time.perf_counter()
+    scores = {}
+    latencies = {}
+    futures = {}
+    for source, source_func in HYBRID_SOURCES.items():
+        if weights.get(source, 0) <= 0:
+            continue
+        if not _acquire_source_slot(source, max_in_flight):
+            latencies[source] = 'saturated'
+            _record_source_latency(source, None, outcome='skipped')
+            continue
+        futures[source] = executor.submit(run_source, source, source_func)
+
+    # Chờ theo thứ tự deadline; mỗi nguồn chỉ được chờ tới started + budget của nó
+    for source in sorted(futures, key=lambda name: budgets_ms.get(name, 100)):
+        deadline = started + budgets_ms.get(source, 100) / 1000
+        try:
+            product_ids, latency_ms = futures[source].result(timeout=max(0.0, deadline - time.perf_counter()))
+        except FutureTimeoutError:
+            if futures[source].cancel():
+                # Task chưa kịp chạy -> run_source không chạy nên phải tự nhả slot
+                _release_source_slot(source)
+            latencies[source] = 'timeout'
+            _record_source_latency(source, None, outcome='timeout')
+            continue
+        except Exception as e:
+            print(f"[WARN] Hybrid source '{source}' failed: {e}")
+            latencies[source] = 'error'
+            _record_source_latency(source, None, outcome='error')
+            continue
+
+        latencies[source] = round(latency_ms, 1)
+        _record_source_latency(source, latency_ms)
+        for rank, product_id in enumerate(product_ids):
+            scores[product_id] = scores.get(product_id, 0.0) + weights[source] / (rank + 1)
+
+    recommended_product_ids = sorted(scores, key=scores.get, reverse=True)[:top_n]
+    print(f"Hybrid recommendations for user {user_id}: {recommended_product_ids} (source latency ms: {latencies})")
+    return recommended_product_ids, 200
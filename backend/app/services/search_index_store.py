@@ -0,0 +1,346 @@
+# search_index_store.py
+"""
+Lưu trữ FAISS index tìm kiếm: snapshot trong registry ('search') + change log append-only.
+
+- Snapshot: index FAISS theo SEARCH_INDEX_TYPE (flat | ivf | ivfpq | hnsw) với label = product id, là 1 version trong registry.
+  HNSW không hỗ trợ xóa vector: bản cũ được đánh dấu label -1 (tombstone) và search lấy dư để bù, compaction dọn sạch.
+- <registry dir>/changes.log: header (version snapshot gốc) + các bản ghi upsert/remove theo thứ tự ghi.
+  Admin thêm/sửa/tắt sản phẩm -> append 1 bản ghi (vector đã encode sẵn), worker tail log và áp dụng vào
+  index trong RAM; worker khởi động lại = load snapshot + replay log, không encode lại catalog.
+- Compaction (compact_search_index): ghi snapshot mới = snapshot + log, publish rồi bắt đầu log mới
+  (các bản ghi được append trong lúc compaction được chuyển sang log mới).
+
+Publish snapshot và append log dùng chung 1 file lock (fcntl.flock), nên log luôn thuộc đúng snapshot đang CURRENT.
+"""
+import os
+import time
+import fcntl
+import pickle
+import struct
+import threading
+from contextlib import contextmanager
+
+import faiss
+import numpy as np
+
+from app.services.ann_index import (
+    MIN_POINTS_PER_CENTROID, PQ_CENTROIDS, build_ann_index, create_ann_index, default_nlist, resolve_index_type,
+    unwrap_index
+)
+from app.services.artifact_registry import get_registry
+
+SEARCH_ARTIFACT = "search"
+INDEX_FILE = "search_index.faiss"
+# Định dạng cũ: IndexFlatL2 theo vị trí + mapping vị trí -> product id (chỉ còn đọc để chuyển đổi)
+MAP_FILE = "product_id_map.pkl"
+
+CHANGE_LOG_FILE = "changes.log"
+CHANGE_LOG_LOCK_FILE = "changes.lock"
+# Header: magic + version snapshot gốc; bản ghi: op (b'U' upsert / b'D' remove), product id, dim, rồi dim float32
+CHANGE_LOG_MAGIC = b"SCL1"
+LOG_HEADER = struct.Struct("<4s64s")
+LOG_RECORD = struct.Struct("<cqi")
+OP_UPSERT = b"U"
+OP_REMOVE = b"D"
+
+# Embedding của SentenceTransformer không chuẩn hóa -> khoảng cách L2 (giữ nguyên thứ hạng đã có với IndexFlatL2)
+SEARCH_METRIC = faiss.METRIC_L2
+
+search_registry = get_registry(SEARCH_ARTIFACT)
+
+
+def search_index_params(config):
+    """ Tham số build index (ghi vào manifest để compaction build lại đúng loại index) từ Config. """
+    return {
+        "index_type": config.get("SEARCH_INDEX_TYPE", "flat"),
+        "nlist": int(config.get("SEARCH_INDEX_NLIST", 0)) or None,
+        "pq_m": int(config.get("SEARCH_INDEX_PQ_M", 0)) or None,
+        "hnsw_m": int(config.get("SEARCH_INDEX_HNSW_M", 32)),
+        "ef_construction": int(config.get("SEARCH_INDEX_EF_CONSTRUCTION", 80)),
+    }
+
+
+def build_search_index_from_vectors(vectors, product_ids, params):
+    """ IndexIDMap theo product id, loại index theo params (IVF / PQ được train trên chính các vector này). """
+    index = build_ann_index(vectors, metric=SEARCH_METRIC, ids=product_ids, **params)
+    return index, {**params, "index_type": resolve_index_type(params["index_type"], len(vectors))}
+
+
+class StreamingIndexBuilder:
+    """
+    Build index từ các chunk (product ids, vectors) theo thứ tự, không giữ toàn bộ embedding trong RAM.
+    IVF / PQ: giữ tạm train_size vector đầu tiên để train quantizer, sau đó add thẳng từng chunk.
+    n_total: số sản phẩm dự kiến (chọn loại index / nlist như build_search_index_from_vectors).
+    """
+
+    def __init__(self, n_total, params, train_size):
+        self.n_total = n_total
+        self.params = {**params, "index_type": resolve_index_type(params["index_type"], n_total)}
+        if self.params["index_type"] in ("ivf", "ivfpq"):
+            # Không train trên ít điểm hơn mức FAISS khuyến nghị cho số centroid đã chọn
+            nlist = self.params.get("nlist") or default_nlist(n_total)
+            min_points = nlist * MIN_POINTS_PER_CENTROID
+            if self.params["index_type"] == "ivfpq":
+                min_points = max(min_points, PQ_CENTROIDS * MIN_POINTS_PER_CENTROID)
+            train_size = min(max(train_size, min_points), n_total)
+        self.train_size = train_size
+        self.index = None
+        self._pending = []
+        self._pending_rows = 0
+
+    def add(self, product_ids, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        if self.index is None:
+            self.index = create_ann_index(vectors.shape[1], self.n_total, metric=SEARCH_METRIC, with_ids=True,
+                                          **self.params)
+        if self.index.is_trained:
+            self.index.add_with_ids(vectors, product_ids)
+            return
+        self._pending.append((product_ids, vectors))
+        self._pending_rows += len(product_ids)
+        if self._pending_rows >= self.train_size:
+            self._train()
+
+    def _train(self):
+        self.index.train(np.concatenate([vectors for _, vectors in self._pending]))
+        pending, self._pending, self._pending_rows = self._pending, [], 0
+        for product_ids, vectors in pending:
+            self.index.add_with_ids(vectors, product_ids)
+
+    def finish(self):
+        """ (index, params) sau chunk cuối; index = None nếu không có sản phẩm nào. """
+        if self._pending:
+            self._train()
+        return self.index, self.params
+
+
+def _log_path():
+    return os.path.join(search_registry.dir, CHANGE_LOG_FILE)
+
+
+@contextmanager
+def change_log_lock():
+    """ Lock độc quyền giữa các process (worker, job) cho append log / publish snapshot. """
+    os.makedirs(search_registry.dir, exist_ok=True)
+    with open(os.path.join(search_registry.dir, CHANGE_LOG_LOCK_FILE), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _encode_header(version):
+    return LOG_HEADER.pack(CHANGE_LOG_MAGIC, version.encode("ascii"))
+
+
+def _encode_record(op, product_id, vector=None):
+    vector = np.empty(0, dtype=np.float32) if vector is None else np.asarray(vector, dtype=np.float32).ravel()
+    return LOG_RECORD.pack(op, int(product_id), len(vector)) + vector.tobytes()
+
+
+def read_change_log(offset=0):
+    """
+    Đọc log từ offset (0 = từ đầu, bỏ qua header).
+    Trả về (version snapshot gốc, [(op, product_id, vector)], offset mới), hoặc (None, [], 0) nếu chưa có log.
+    Bản ghi cuối ghi dở (crash giữa chừng) bị bỏ qua, lần đọc sau sẽ đọc lại từ offset đó.
+    """
+    try:
+        with open(_log_path(), "rb") as f:
+            header = f.read(LOG_HEADER.size)
+            if len(header) < LOG_HEADER.size:
+                return None, [], 0
+            magic, version = LOG_HEADER.unpack(header)
+            if magic != CHANGE_LOG_MAGIC:
+                raise ValueError(f"{CHANGE_LOG_FILE} is not a search change log.")
+            offset = max(offset, LOG_HEADER.size)
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return None, [], 0
+
+    records, pos = [], 0
+    while pos + LOG_RECORD.size <= len(data):
+        op, product_id, dim = LOG_RECORD.unpack_from(data, pos)
+        end = pos + LOG_RECORD.size + dim * 4
+        if end > len(data):
+            break
+        vector = np.frombuffer(data, dtype=np.float32, count=dim, offset=pos + LOG_RECORD.size) if dim else None
+        records.append((op, product_id, vector))
+        pos = end
+    return version.rstrip(b"\0").decode("ascii"), records, offset + pos
+
+
+def append_changes(records):
+    """
+    Append các bản ghi (op, product_id, vector) vào log của snapshot đang CURRENT.
+    Trả về False nếu chưa có snapshot nào (thay đổi sẽ có trong lần build đầy đủ đầu tiên).
+    """
+    with change_log_lock():
+        version = search_registry.current_version()
+        if version is None:
+            return False
+        log_version, _, _ = read_change_log()
+        if log_version != version:
+            # Log chưa có hoặc còn của snapshot cũ (publish bởi phiên bản trước, không qua lock)
+            _reset_change_log(version)
+        with open(_log_path(), "ab") as f:
+            f.write(b"".join(_encode_record(op, product_id, vector) for op, product_id, vector in records))
+            f.flush()
+            os.fsync(f.fileno())
+    return True
+
+
+def _reset_change_log(version, carry_records=()):
+    """ Thay log bằng log mới thuộc snapshot `version`, giữ lại carry_records (gọi khi đang giữ lock). """
+    tmp_path = f"{_log_path()}.tmp-{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(_encode_header(version))
+        f.write(b"".join(_encode_record(op, product_id, vector) for op, product_id, vector in carry_records))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, _log_path())
+
+
+def change_log_position():
+    """ (version gốc, offset cuối) của log hiện tại: build đầy đủ ghi nhận trước khi đọc DB. """
+    version, _, offset = read_change_log()
+    return version, offset
+
+
+def publish_search_index(version, since=None):
+    """
+    Publish snapshot `version` và bắt đầu log mới cho nó, trong cùng lock với append.
+    since = (version gốc, offset) lúc bắt đầu build: các bản ghi append sau thời điểm đó được giữ lại
+    để replay trên snapshot mới (upsert/remove idempotent nên replay thừa bản ghi cũ vẫn đúng).
+    """
+    with change_log_lock():
+        log_version, _, _ = read_change_log()
+        carry = []
+        if since is not None and log_version is not None:
+            since_version, since_offset = since
+            _, carry, _ = read_change_log(since_offset if log_version == since_version else 0)
+        search_registry.publish(version)
+        _reset_change_log(version, carry)
+    if carry:
+        print(f"[INFO] Carried {len(carry)} search index changes over to version {version}.")
+
+
+def _remove_ids(index, ids):
+    try:
+        index.remove_ids(ids)
+    except RuntimeError:
+        # HNSW không xóa được: đổi label của vector cũ thành -1 (search bỏ qua), vector mới được add phía sau
+        id_map = faiss.vector_to_array(index.id_map)
+        id_map[np.isin(id_map, ids)] = -1
+        faiss.copy_array_to_vector(id_map, index.id_map)
+
+
+def count_tombstones(index):
+    """ Số vector đã bị xóa nhưng còn nằm trong index (chỉ HNSW). """
+    if not hasattr(index, "id_map"):
+        return 0
+    return int(np.count_nonzero(faiss.vector_to_array(index.id_map) == -1))
+
+
+def apply_changes(index, records):
+    """ Áp dụng bản ghi lên IndexIDMap: trạng thái cuối của mỗi product id = bản ghi cuối cùng của nó. """
+    if not records:
+        return
+    latest = {}
+    for op, product_id, vector in records:
+        latest[product_id] = (op, vector)
+    _remove_ids(index, np.fromiter(latest.keys(), dtype=np.int64, count=len(latest)))
+    upserts = [(product_id, vector) for product_id, (op, vector) in latest.items() if op == OP_UPSERT]
+    if upserts:
+        index.add_with_ids(
+            np.stack([vector for _, vector in upserts]).astype(np.float32),
+            np.array([product_id for product_id, _ in upserts], dtype=np.int64),
+        )
+
+
+def _read_snapshot(version_dir, manifest):
+    index = faiss.read_index(os.path.join(version_dir, INDEX_FILE))
+    if MAP_FILE in manifest.get("files", {}):
+        # Version cũ: label là vị trí -> dựng lại IndexIDMap theo product id (chỉ hỗ trợ index flat)
+        with open(os.path.join(version_dir, MAP_FILE), "rb") as f:
+            product_id_map = pickle.load(f)
+        vectors = index.reconstruct_n(0, index.ntotal)
+        ids = np.array([product_id_map[i] for i in range(len(vectors))], dtype=np.int64)
+        index, _ = build_search_index_from_vectors(vectors, ids, {"index_type": "flat"})
+    return index
+
+
+def load_search_index():
+    """
+    Đọc snapshot đang CURRENT + replay change log của nó.
+    'log_offset' = None nếu log chưa thuộc snapshot này (đang publish dở), sync_changes() sẽ đọc lại sau.
+    """
+    current = search_registry.current()
+    if current is None:
+        raise FileNotFoundError(f"No published search index in {search_registry.dir}. Please run FAISS indexing job first.")
+    version, version_dir, manifest = current
+    index = _read_snapshot(version_dir, manifest)
+    search_index = {"version": version, "index": index, "lock": threading.Lock(), "log_offset": None,
+                    "last_check": 0.0, "tombstones": count_tombstones(index)}
+    sync_changes(search_index, force=True)
+    return search_index
+
+
+def sync_changes(search_index, force=False, check_interval=1.0):
+    """
+    Áp dụng các bản ghi mới trong log (của worker khác / admin) vào index trong RAM.
+    Tối đa 1 lần đọc log mỗi check_interval giây, trừ khi force.
+    """
+    now = time.monotonic()
+    if not force and now - search_index["last_check"] < check_interval:
+        return
+    search_index["last_check"] = now
+    with search_index["lock"]:
+        offset = search_index["log_offset"] or 0
+        log_version, records, new_offset = read_change_log(offset)
+        if log_version != search_index["version"]:
+            return
+        apply_changes(search_index["index"], records)
+        search_index["log_offset"] = new_offset
+        if records:
+            search_index["tombstones"] = count_tombstones(search_index["index"])
+            live = search_index["index"].ntotal - search_index["tombstones"]
+            print(f"[INFO] Applied {len(records)} search index changes ({live} products indexed).")
+
+
+def compact_search_index():
+    """
+    Snapshot mới = snapshot hiện tại + toàn bộ log (không encode lại sản phẩm nào), publish rồi thu gọn log.
+    Trả về manifest mới, hoặc None nếu log rỗng.
+    """
+    current = search_registry.current()
+    if current is None:
+        raise FileNotFoundError("No published search index to compact.")
+    version, version_dir, manifest = current
+    log_version, records, offset = read_change_log()
+    if log_version != version or not records:
+        print("[INFO] Search change log is empty, nothing to compact.")
+        return None
+
+    started = time.perf_counter()
+    index = _read_snapshot(version_dir, manifest)
+    apply_changes(index, records)
+    params = manifest.get("index") or {"index_type": "flat"}
+    if count_tombstones(index):
+        # HNSW: build lại đồ thị từ các vector còn sống (không encode lại), bỏ hẳn tombstone
+        ids = faiss.vector_to_array(index.id_map)
+        alive = ids != -1
+        vectors = unwrap_index(index).reconstruct_n(0, index.ntotal)[alive]
+        index, params = build_search_index_from_vectors(vectors, ids[alive], params)
+    with search_registry.begin(started=started) as build:
+        faiss.write_index(index, build.path(INDEX_FILE))
+        meta = {k: manifest[k] for k in ("model_name", "dim") if k in manifest}
+        meta["index"] = params
+        new_manifest = build.commit(rows=int(index.ntotal), watermark=manifest.get("watermark"),
+                                    meta={**meta, "compacted_from": version, "changes": len(records)})
+    publish_search_index(new_manifest["version"], since=(version, offset))
+    print(f"[INFO] Compacted {len(records)} changes into search index {new_manifest['version']} "
+          f"({index.ntotal} products) in {time.perf_counter() - started:.2f}s")
+    return new_manifest
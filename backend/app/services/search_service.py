@@ -1,57 +1,285 @@
-import os
-import pickle
-import faiss
+import time
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict, deque
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from flask import current_app, has_app_context
+
+from app.extensions import redis_client
+from app.services.ann_index import configure_search
+from app.services.artifact_registry import ModelHolder
+from app.services.search_index_store import (
+    INDEX_FILE, OP_REMOVE, OP_UPSERT, search_registry, load_search_index, append_changes, sync_changes
+)
 
 MODEL_NAME = "paraphrase-multilingual-MiniLM-L12-v2"
-BASE_PATH = "instance/search"
-INDEX_FILE = os.path.join(BASE_PATH, "search_index.faiss")
-MAP_FILE = os.path.join(BASE_PATH, "product_id_map.pkl")
+
+# Load model lỗi thì chờ bấy nhiêu giây mới thử lại (không load lại ở mọi request tìm kiếm)
+MODEL_RETRY_SECONDS = 60
+
+# Cache embedding của câu truy vấn: LRU trong process -> Redis (float32 bytes) -> encode.
+# search:qemb:<namespace>:<sha1 query> ; namespace đổi theo MODEL_NAME + SEARCH_MODEL_VERSION nên đổi model = cache mới
+EMBEDDING_CACHE_KEY_PREFIX = "search:qemb"
+DEFAULT_EMBEDDING_LRU_SIZE = 4096
+DEFAULT_EMBEDDING_CACHE_TTL = 7 * 24 * 3600
+DEFAULT_MODEL_VERSION = "1"
+# Số lần encode gần nhất giữ lại để tính percentile latency
+ENCODE_LATENCY_WINDOW = 1000
+
+
+
+def _load_encoder():
+    # Import ở đây: sentence_transformers kéo theo torch, mất vài giây chỉ riêng bước import
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(MODEL_NAME)
+
+
+def _load_search_index():
+    """ Index đang CURRENT (+ change log) với tham số tìm kiếm IVF / HNSW lấy từ Config. """
+    search_index = load_search_index()
+    configure_search(search_index["index"], nprobe=_config('SEARCH_INDEX_NPROBE', 16),
+                     ef_search=_config('SEARCH_INDEX_EF_SEARCH', 64))
+    return search_index
+
+
+def product_search_text(name):
+    """ Văn bản được encode cho 1 sản phẩm (job build index và cập nhật incremental phải dùng chung). """
+    return f"{name or ''} "
+
+
+def normalize_query(query_text):
+    """ Chuẩn hóa câu truy vấn làm key cache: Unicode NFC, chữ thường, gộp khoảng trắng. """
+    return " ".join(unicodedata.normalize("NFC", query_text).lower().split())
+
+
+def _config(key, default):
+    return current_app.config.get(key, default) if has_app_context() else default
+
+
+class QueryEmbeddingCache:
+    """
+    Cache 2 tầng cho embedding của câu truy vấn (phân bố truy vấn rất lệch: "whey", "creatine", ...):
+    LRU trong process, rồi Redis dùng chung giữa các worker, cuối cùng mới chạy encoder.
+    Lỗi Redis chỉ làm mất tầng 2, không làm hỏng tìm kiếm.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lru = OrderedDict()
+        self._namespace = None
+        self._stats = {'requests': 0, 'lru_hits': 0, 'redis_hits': 0, 'misses': 0, 'redis_errors': 0}
+        self._encode_ms = deque(maxlen=ENCODE_LATENCY_WINDOW)
+
+    @staticmethod
+    def namespace():
+        version = _config('SEARCH_MODEL_VERSION', DEFAULT_MODEL_VERSION)
+        return hashlib.sha1(f"{MODEL_NAME}@{version}".encode("utf-8")).hexdigest()[:12]
+
+    def _redis_key(self, namespace, query):
+        return f"{EMBEDDING_CACHE_KEY_PREFIX}:{namespace}:{hashlib.sha1(query.encode('utf-8')).hexdigest()}"
+
+    def _count(self, stat):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def get(self, query, encode):
+        """
+        Embedding float32 (1 chiều) của câu truy vấn đã chuẩn hóa.
+        encode(list[str]) -> mảng [n, dim]: chỉ được gọi khi cả 2 tầng cache đều miss.
+        """
+        namespace = self.namespace()
+        with self._lock:
+            self._stats['requests'] += 1
+            if namespace != self._namespace:
+                # MODEL_NAME / SEARCH_MODEL_VERSION đổi: embedding cũ không còn dùng được
+                self._lru.clear()
+                self._namespace = namespace
+            vector = self._lru.get(query)
+            if vector is not None:
+                self._lru.move_to_end(query)
+                self._stats['lru_hits'] += 1
+                return vector
+
+        key = self._redis_key(namespace, query)
+        try:
+            cached = redis_client.get(key)
+        except Exception as e:
+            print(f"[WARN] Could not read query embedding from Redis: {e}")
+            self._count('redis_errors')
+            cached = None
+
+        if cached is not None:
+            vector = np.frombuffer(cached, dtype=np.float32)
+            self._count('redis_hits')
+        else:
+            started = time.perf_counter()
+            vector = np.asarray(encode([query]), dtype=np.float32)[0]
+            latency_ms = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self._stats['misses'] += 1
+                self._encode_ms.append(latency_ms)
+            try:
+                redis_client.set(key, vector.tobytes(), ex=int(_config('SEARCH_EMBEDDING_CACHE_TTL', DEFAULT_EMBEDDING_CACHE_TTL)))
+            except Exception as e:
+                print(f"[WARN] Could not cache query embedding in Redis: {e}")
+                self._count('redis_errors')
+
+        vector.setflags(write=False)
+        max_size = int(_config('SEARCH_EMBEDDING_LRU_SIZE', DEFAULT_EMBEDDING_LRU_SIZE))
+        with self._lock:
+            if namespace == self._namespace and max_size > 0:
+                self._lru[query] = vector
+                self._lru.move_to_end(query)
+                while len(self._lru) > max_size:
+                    self._lru.popitem(last=False)
+        return vector
+
+    def stats(self):
+        """ Tỉ lệ hit từng tầng và latency encode (trên ENCODE_LATENCY_WINDOW lần encode gần nhất) trong worker hiện tại. """
+        with self._lock:
+            stats = dict(self._stats)
+            encode_ms = np.array(self._encode_ms)
+            lru_size = len(self._lru)
+        requests = stats['requests']
+        return {
+            **stats,
+            'hit_ratio': round((stats['lru_hits'] + stats['redis_hits']) / requests, 4) if requests else None,
+            'lru_hit_ratio': round(stats['lru_hits'] / requests, 4) if requests else None,
+            'lru_size': lru_size,
+            'encode_ms': {
+                'count': int(len(encode_ms)),
+                'avg': round(float(encode_ms.mean()), 2) if len(encode_ms) else None,
+                'p50': round(float(np.percentile(encode_ms, 50)), 2) if len(encode_ms) else None,
+                'p99': round(float(np.percentile(encode_ms, 99)), 2) if len(encode_ms) else None,
+                'max': round(float(encode_ms.max()), 2) if len(encode_ms) else None,
+            },
+        }
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
 
 
 class SearchService:
     """
     Service chịu trách nhiệm load model và FAISS index.
     Không rebuild tại đây để tránh circular import — việc rebuild được tách riêng ra job auto_rebuild_search.py
+    Index được giữ trong ModelHolder: khi job publish version mới, worker tự load lại không cần restart;
+    thay đổi sản phẩm giữa 2 version đi qua change log (search_index_store), worker tail log và áp dụng tại chỗ.
+
+    Khởi tạo lazy: import module / create_app không load gì cả (job, CLI không tốn vài giây load torch);
+    model được load 1 lần ở lần tìm kiếm đầu tiên, hoặc sớm hơn qua warm_up() (SEARCH_WARMUP cho web worker).
     """
     def __init__(self):
         self.model = None
-        self.index = None
-        self.product_id_map = None
-        try:
-            print("[INFO] Loading SearchService...")
-            self.model = SentenceTransformer(MODEL_NAME)
+        self.index_holder = ModelHolder("search", [search_registry.pointer_path], _load_search_index)
+        self.embedding_cache = QueryEmbeddingCache()
+        self._model_lock = threading.Lock()
+        self._next_model_attempt = 0.0
 
-            if not os.path.exists(INDEX_FILE) or not os.path.exists(MAP_FILE):
-                raise FileNotFoundError(f"{INDEX_FILE} not found. Please run FAISS indexing job first.")
+    def _get_model(self):
+        """ Load SentenceTransformer 1 lần, thread-safe (các request đồng thời chờ cùng 1 lần load). """
+        if self.model is not None:
+            return self.model
+        with self._model_lock:
+            if self.model is None and time.monotonic() >= self._next_model_attempt:
+                try:
+                    print("[INFO] Loading SearchService...")
+                    started = time.perf_counter()
+                    self.model = _load_encoder()
+                    print(f"[INFO] Search model loaded in {time.perf_counter() - started:.2f}s.")
+                except Exception as e:
+                    self._next_model_attempt = time.monotonic() + MODEL_RETRY_SECONDS
+                    print(f"[WARN] SearchService initialization failed: {e}")
+        return self.model
 
-            self.index = faiss.read_index(INDEX_FILE)
-            with open(MAP_FILE, "rb") as f:
-                self.product_id_map = pickle.load(f)
-
-            print(f"[INFO] SearchService loaded successfully with {len(self.product_id_map)} products.")
+    def warm_up(self, background=False):
+        """
+        Load trước model và FAISS index để request tìm kiếm đầu tiên không phải chờ.
+        background=True: chạy trong thread riêng, không chặn việc khởi động worker.
+        """
+        if background:
+            threading.Thread(target=self.warm_up, name="search-warm-up", daemon=True).start()
+            return
+        model = self._get_model()
+        try:
+            search_index = self.index_holder.get()
+        except Exception as e:
+            print(f"[WARN] Search index unavailable: {e}")
+            search_index = None
+        if search_index is None:
+            print(f"[WARN] {INDEX_FILE} not found. Please run FAISS indexing job first.")
+        elif model is not None:
+            n_products = search_index["index"].ntotal - search_index["tombstones"]
+            print(f"[INFO] SearchService loaded successfully with {n_products} products.")
 
+    def _get_index(self):
+        """ Index đang CURRENT, đã áp dụng các thay đổi mới nhất trong change log; None nếu chưa có. """
+        try:
+            search_index = self.index_holder.get()
+            if search_index is not None:
+                sync_changes(search_index, check_interval=_config('SEARCH_CHANGELOG_SYNC_SECONDS', 1.0))
+            return search_index
         except Exception as e:
-            print(f"[WARN] SearchService initialization failed: {e}")
-            self.model = self.index = self.product_id_map = None
+            print(f"[WARN] Search index unavailable: {e}")
+            return None
 
     def search_products(self, query_text, k=20):
         """
         Tìm kiếm sản phẩm tương tự bằng FAISS + SentenceTransformer.
         """
-        if not all([self.model, self.index, self.product_id_map]):
+        search_index = self._get_index()
+        model = self._get_model() if search_index is not None else None
+        if model is None or search_index is None:
             print("[WARN] SearchService not initialized properly.")
             return []
 
         try:
-            qv = self.model.encode([query_text], convert_to_tensor=False)
-            D, I = self.index.search(np.array(qv, dtype="float32"), k)
-            return [self.product_id_map.get(i) for i in I[0] if i != -1]
+            qv = self.embedding_cache.get(
+                normalize_query(query_text), lambda texts: model.encode(texts, convert_to_tensor=False)
+            )
+            with search_index["lock"]:
+                # Lấy dư bằng số tombstone (HNSW) để sau khi bỏ label -1 vẫn đủ k kết quả
+                D, I = search_index["index"].search(qv[None, :], k + search_index["tombstones"])
+            # IndexIDMap: label chính là product id
+            return [int(i) for i in I[0] if i != -1][:k]
         except Exception as e:
             print(f"[ERROR] Search failed: {e}")
             return []
 
+    def upsert_products(self, products):
+        """
+        Encode lại các sản phẩm (đã commit) và ghi vào change log: mọi worker thấy thay đổi trong ~1s,
+        không cần build lại toàn bộ index. Trả về False nếu không encode / ghi được (job build đầy đủ sẽ bù lại).
+        """
+        if not products:
+            return True
+        model = self._get_model()
+        if model is None:
+            print("[WARN] Search model unavailable, product changes will be indexed on next full rebuild.")
+            return False
+        vectors = np.asarray(
+            model.encode([product_search_text(p.name) for p in products], convert_to_tensor=False), dtype=np.float32
+        )
+        return self._append([(OP_UPSERT, p.id, vector) for p, vector in zip(products, vectors)])
+
+    def remove_products(self, product_ids):
+        """ Gỡ sản phẩm (bị tắt) khỏi index qua change log. """
+        if not product_ids:
+            return True
+        return self._append([(OP_REMOVE, product_id, None) for product_id in product_ids])
+
+    def _append(self, records):
+        if not append_changes(records):
+            print("[WARN] No published search index yet, skipping incremental update.")
+            return False
+        # Worker hiện tại thấy thay đổi ngay (worker khác sau tối đa SEARCH_CHANGELOG_SYNC_SECONDS)
+        search_index = self._get_index()
+        if search_index is not None:
+            sync_changes(search_index, force=True)
+        return True
+
 
-# Singleton instance (global)
+# Singleton instance (global) - khởi tạo không tốn chi phí, model load ở lần dùng đầu tiên
 search_service_instance = SearchService()
@@ -3,29 +3,36 @@ import pickle
 import numpy as np
 from app.extensions import db
 from app.models.ecommerce_models import Feedback
+from app.services.artifact_registry import ModelHolder, get_registry
 
-# --- Định nghĩa đường dẫn ---
-BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
-MODEL_DIR = os.path.join(BASE_DIR, 'instance', 'sentiment')
-MODEL_PATH = os.path.join(MODEL_DIR, 'sentiment_model.pkl')
+# --- Registry chứa các version của mô hình (instance/sentiment/sentiment/versions/...) ---
+SENTIMENT_ARTIFACT = 'sentiment'
+MODEL_FILE = 'sentiment_model.pkl'
+sentiment_registry = get_registry(SENTIMENT_ARTIFACT)
 
 # --- Tải mô hình (load on startup) ---
 def load_sentiment_model():
-    """ Tải mô hình sentiment từ file .pkl """
-    if not os.path.exists(MODEL_PATH):
-        print(f"[WARN] Sentiment model file not found at {MODEL_PATH}. Feature will be disabled.")
-        return None
+    """ Tải mô hình sentiment từ file .pkl của version đang CURRENT """
+    current = sentiment_registry.current()
+    if current is None:
+        raise FileNotFoundError(f"No published sentiment model in {sentiment_registry.dir}.")
+    _, version_dir, _ = current
+    with open(os.path.join(version_dir, MODEL_FILE), 'rb') as f:
+        return pickle.load(f)
+
+# Holder toàn cục: tự load lại khi job training publish version mới
+sentiment_model_holder = ModelHolder("sentiment", [sentiment_registry.pointer_path], load_sentiment_model)
+
+
+def _get_sentiment_model():
     try:
-        with open(MODEL_PATH, 'rb') as f:
-            model = pickle.load(f)
-        print(f"[INFO] Sentiment model loaded successfully from {MODEL_PATH}.")
-        return model
+        model = sentiment_model_holder.get()
     except Exception as e:
         print(f"[ERROR] Failed to load sentiment model: {e}")
         return None
-
-# Biến toàn cục chứa mô hình
-SENTIMENT_MODEL = load_sentiment_model()
+    if model is None:
+        print(f"[WARN] Sentiment model not found in {sentiment_registry.dir}. Feature will be disabled.")
+    return model
 
 # --- Hàm service chính ---
 def analyze_product_sentiment(product_id):
@@ -33,7 +40,8 @@ def analyze_product_sentiment(product_id):
     Phân tích cảm xúc của tất cả feedback cho một sản phẩm
     và trả về tỷ lệ % Positive, Neutral, Negative.
     """
-    if SENTIMENT_MODEL is None:
+    sentiment_model = _get_sentiment_model()
+    if sentiment_model is None:
         return {"error": "Sentiment analysis service is not available."}, 503
 
     try:
@@ -50,7 +58,7 @@ def analyze_product_sentiment(product_id):
         total_reviews = len(comments)
 
         # 2. Dùng mô hình để dự đoán
-        predictions = SENTIMENT_MODEL.predict(comments)
+        predictions = sentiment_model.predict(comments)
 
         # 3. Tổng hợp kết quả
         (unique, counts) = np.unique(predictions, return_counts=True)
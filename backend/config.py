@@ -1,4 +1,5 @@
 import os
+import json
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY')
@@ -29,6 +30,62 @@ class Config:
     # redis
     REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
 
+    # search: load trước model tìm kiếm khi create_app (thread nền) cho web worker; job / CLI để mặc định False
+    SEARCH_WARMUP = os.environ.get('SEARCH_WARMUP', 'false').lower() in ('1', 'true', 'yes')
+    SEARCH_MODEL_VERSION = os.environ.get('SEARCH_MODEL_VERSION', '1')  # tăng khi đổi trọng số/tiền xử lý encoder để bỏ cache embedding cũ
+    SEARCH_EMBEDDING_LRU_SIZE = int(os.environ.get('SEARCH_EMBEDDING_LRU_SIZE', 4096))
+    SEARCH_EMBEDDING_CACHE_TTL = int(os.environ.get('SEARCH_EMBEDDING_CACHE_TTL', 7 * 24 * 3600))  # 7d
+    SEARCH_CHANGELOG_SYNC_SECONDS = float(os.environ.get('SEARCH_CHANGELOG_SYNC_SECONDS', 1.0))  # worker đọc change log của index tối đa 1 lần / khoảng này
+    SEARCH_INDEX_TYPE = os.environ.get('SEARCH_INDEX_TYPE', 'flat')  # flat | ivf | ivfpq | hnsw (xem jobs.benchmark_search_index)
+    SEARCH_INDEX_NLIST = int(os.environ.get('SEARCH_INDEX_NLIST', 0))  # 0 = tự chọn theo số sản phẩm
+    SEARCH_INDEX_NPROBE = int(os.environ.get('SEARCH_INDEX_NPROBE', 16))
+    SEARCH_INDEX_PQ_M = int(os.environ.get('SEARCH_INDEX_PQ_M', 0))  # số sub-quantizer PQ, 0 = dim / 8
+    SEARCH_INDEX_HNSW_M = int(os.environ.get('SEARCH_INDEX_HNSW_M', 32))
+    SEARCH_INDEX_EF_CONSTRUCTION = int(os.environ.get('SEARCH_INDEX_EF_CONSTRUCTION', 80))
+    SEARCH_INDEX_EF_SEARCH = int(os.environ.get('SEARCH_INDEX_EF_SEARCH', 64))
+    SEARCH_INDEX_CHUNK_SIZE = int(os.environ.get('SEARCH_INDEX_CHUNK_SIZE', 5000))  # số sản phẩm mỗi chunk stream / checkpoint khi build index
+    SEARCH_ENCODE_BATCH_SIZE = int(os.environ.get('SEARCH_ENCODE_BATCH_SIZE', 64))
+    SEARCH_ENCODE_WORKERS = int(os.environ.get('SEARCH_ENCODE_WORKERS', 1))  # > 1: encode song song trên nhiều process CPU khi build index
+    SEARCH_INDEX_TRAIN_SIZE = int(os.environ.get('SEARCH_INDEX_TRAIN_SIZE', 100000))  # số vector giữ tạm để train IVF / PQ
+    SEARCH_CHANGELOG_COMPACT_RECORDS = int(os.environ.get('SEARCH_CHANGELOG_COMPACT_RECORDS', 1000))  # auto_rebuild_search compaction khi log dài hơn
+
+    # recommendation
+    RECOMMEND_SIMILARITY_TOP_K = int(os.environ.get('RECOMMEND_SIMILARITY_TOP_K', 50))
+    RECOMMEND_SIMILARITY_BLOCK_SIZE = int(os.environ.get('RECOMMEND_SIMILARITY_BLOCK_SIZE', 256))
+    RECOMMEND_SIMILARITY_ENGINE = os.environ.get('RECOMMEND_SIMILARITY_ENGINE', 'faiss')  # faiss | exact
+    RECOMMEND_ANN_INDEX_TYPE = os.environ.get('RECOMMEND_ANN_INDEX_TYPE', 'flat')  # flat | ivf | ivfpq | hnsw
+    RECOMMEND_ANN_DIM = int(os.environ.get('RECOMMEND_ANN_DIM', 128))
+    RECOMMEND_ANN_NLIST = int(os.environ.get('RECOMMEND_ANN_NLIST', 0))  # 0 = tự chọn theo số sản phẩm
+    RECOMMEND_ANN_NPROBE = int(os.environ.get('RECOMMEND_ANN_NPROBE', 16))
+    RECOMMEND_ANN_HNSW_M = int(os.environ.get('RECOMMEND_ANN_HNSW_M', 32))
+    RECOMMEND_ANN_EF_CONSTRUCTION = int(os.environ.get('RECOMMEND_ANN_EF_CONSTRUCTION', 80))
+    RECOMMEND_ANN_EF_SEARCH = int(os.environ.get('RECOMMEND_ANN_EF_SEARCH', 64))
+    RECOMMEND_TRAINING_FETCH_SIZE = int(os.environ.get('RECOMMEND_TRAINING_FETCH_SIZE', 50000))
+    RECOMMEND_TRAINING_CUTOFF = os.environ.get('RECOMMEND_TRAINING_CUTOFF')  # ISO datetime, chỉ train trên tương tác trước mốc này (đánh giá offline)
+    RECOMMEND_PRECOMPUTE_TOP_N = int(os.environ.get('RECOMMEND_PRECOMPUTE_TOP_N', 50))
+    RECOMMEND_PRECOMPUTE_CHUNK_SIZE = int(os.environ.get('RECOMMEND_PRECOMPUTE_CHUNK_SIZE', 1024))  # tối đa, giảm theo MEMORY_MB
+    RECOMMEND_PRECOMPUTE_MEMORY_MB = float(os.environ.get('RECOMMEND_PRECOMPUTE_MEMORY_MB', 256))  # ma trận điểm của 1 chunk
+    RECOMMEND_PRECOMPUTE_TTL = int(os.environ.get('RECOMMEND_PRECOMPUTE_TTL', 7 * 24 * 3600))  # 7d
+    RECOMMEND_FOLD_IN_MAX_INTERACTIONS = int(os.environ.get('RECOMMEND_FOLD_IN_MAX_INTERACTIONS', 50))
+    RECOMMEND_FOLD_IN_REG = float(os.environ.get('RECOMMEND_FOLD_IN_REG', 0.5))
+    RECOMMEND_FOLD_IN_TTL = int(os.environ.get('RECOMMEND_FOLD_IN_TTL', 24 * 3600))  # 1d
+    RECOMMEND_ACTIVE_MASK_TTL = int(os.environ.get('RECOMMEND_ACTIVE_MASK_TTL', 60))  # giây
+    RECOMMEND_HYBRID_WEIGHTS = json.loads(os.environ.get('RECOMMEND_HYBRID_WEIGHTS', '{"cf": 1.0, "session": 0.8, "content": 0.6, "popular": 0.3}'))
+    RECOMMEND_HYBRID_BUDGETS_MS = json.loads(os.environ.get('RECOMMEND_HYBRID_BUDGETS_MS', '{"cf": 150, "session": 60, "content": 120, "popular": 80}'))
+    RECOMMEND_HYBRID_CANDIDATES = int(os.environ.get('RECOMMEND_HYBRID_CANDIDATES', 50))
+    RECOMMEND_HYBRID_RECENT_ITEMS = int(os.environ.get('RECOMMEND_HYBRID_RECENT_ITEMS', 5))
+    RECOMMEND_HYBRID_WORKERS = int(os.environ.get('RECOMMEND_HYBRID_WORKERS', 16))  # thread dùng chung cho các nguồn hybrid
+    RECOMMEND_HYBRID_MAX_IN_FLIGHT = int(os.environ.get('RECOMMEND_HYBRID_MAX_IN_FLIGHT', 4))  # task chưa xong tối đa / nguồn
+    RECOMMEND_SESSION_MAX_EVENTS = int(os.environ.get('RECOMMEND_SESSION_MAX_EVENTS', 50))
+    RECOMMEND_SESSION_TTL = int(os.environ.get('RECOMMEND_SESSION_TTL', 2 * 3600))  # 2h
+    RECOMMEND_SESSION_HALF_LIFE = int(os.environ.get('RECOMMEND_SESSION_HALF_LIFE', 30 * 60))  # giây
+    RECOMMEND_SESSION_NEIGHBORS = int(os.environ.get('RECOMMEND_SESSION_NEIGHBORS', 20))
+    RECOMMEND_SESSION_BUDGET_MS = int(os.environ.get('RECOMMEND_SESSION_BUDGET_MS', 50))
+    RECOMMEND_BOUGHT_TOGETHER_TOP_K = int(os.environ.get('RECOMMEND_BOUGHT_TOGETHER_TOP_K', 20))
+    RECOMMEND_BOUGHT_TOGETHER_METRIC = os.environ.get('RECOMMEND_BOUGHT_TOGETHER_METRIC', 'lift')  # lift | jaccard
+    RECOMMEND_BOUGHT_TOGETHER_MIN_SUPPORT = int(os.environ.get('RECOMMEND_BOUGHT_TOGETHER_MIN_SUPPORT', 2))
+    RECOMMEND_BOUGHT_TOGETHER_CHUNK_SIZE = int(os.environ.get('RECOMMEND_BOUGHT_TOGETHER_CHUNK_SIZE', 200000))
+
 class DevelopmentConfig(Config):
     DEBUG = True
     # Các cài đặt khác cho môi trường dev nếu cần
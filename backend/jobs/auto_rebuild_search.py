@@ -2,6 +2,11 @@ import os, sys
 from sqlalchemy import func
 from app import create_app, db
 from app.models.product_models import Product
+from app.services.ann_index import resolve_index_type
+from app.services.search_index_store import (
+    search_registry, search_index_params, read_change_log, load_search_index, compact_search_index
+)
+from app.services.search_service import MODEL_NAME
 from jobs.run_search_indexing import build_search_index
 from config import DevelopmentConfig
 
@@ -10,11 +15,14 @@ if BASE_DIR not in sys.path:
     sys.path.insert(0, BASE_DIR)
 print("[DEBUG] Added to sys.path:", BASE_DIR)
 
-INDEX_FILE = "instance/search/search_index.faiss"
-MAP_FILE = "instance/search/product_id_map.pkl"
-
 def auto_rebuild_search_index():
-    """Tự động rebuild FAISS index nếu chưa tồn tại hoặc DB có sản phẩm mới."""
+    """
+    Bảo trì FAISS index tìm kiếm:
+    - Chưa có index / đổi model / đổi SEARCH_INDEX_TYPE -> build lại toàn bộ.
+    - Số sản phẩm active trong DB khác index (snapshot + change log) -> build lại (có thay đổi không qua admin API).
+    - Change log đủ dài -> compaction thành snapshot mới (không encode lại sản phẩm nào).
+    Sửa tên sản phẩm không làm đổi số lượng nên được cập nhật qua change log, không cần rebuild.
+    """
     print("[AUTO] Checking FAISS search index...")
 
     # Tạo Flask app context
@@ -22,36 +30,42 @@ def auto_rebuild_search_index():
     app = create_app(DevelopmentConfig)
 
     with app.app_context():
-        # Đếm số sản phẩm hiện có
-        product_count = db.session.query(func.count(Product.id)).scalar() or 0
-        print(f"[AUTO] Product count in DB: {product_count}")
-
-        # Nếu không có index, rebuild
-        if not os.path.exists(INDEX_FILE) or not os.path.exists(MAP_FILE):
+        # Nếu chưa có version nào được publish, rebuild
+        current = search_registry.current()
+        if current is None:
             print("[AUTO] Search index not found, building new one...")
             build_search_index()
             return
 
-        # Nếu index tồn tại, kiểm tra xem có thay đổi DB (số lượng sản phẩm)
-        meta_file = "instance/search/meta.txt"
-        previous_count = 0
-        if os.path.exists(meta_file):
-            with open(meta_file, "r") as f:
-                try:
-                    previous_count = int(f.read().strip())
-                except ValueError:
-                    previous_count = 0
-
-        if product_count != previous_count:
-            print("[AUTO] Product count changed, rebuilding FAISS index...")
+        version, _, manifest = current
+        if manifest.get("model_name") != MODEL_NAME:
+            print(f"[AUTO] Search index was built with {manifest.get('model_name')}, rebuilding with {MODEL_NAME}...")
             build_search_index()
-        else:
-            print("[AUTO] Search index already up-to-date.")
+            return
 
-        # Cập nhật meta.txt
-        os.makedirs(os.path.dirname(meta_file), exist_ok=True)
-        with open(meta_file, "w") as f:
-            f.write(str(product_count))
+        index_type = search_index_params(app.config)["index_type"]
+        built_type = (manifest.get("index") or {}).get("index_type", "flat")
+        if resolve_index_type(index_type, manifest.get("rows") or 0) != built_type:
+            print(f"[AUTO] Search index type changed ({built_type} -> {index_type}), rebuilding FAISS index...")
+            build_search_index()
+            return
+
+        product_count = db.session.query(func.count(Product.id)).filter(Product.is_active == True).scalar() or 0
+        search_index = load_search_index()
+        indexed_count = search_index["index"].ntotal - search_index["tombstones"]
+        print(f"[AUTO] Active product count in DB: {product_count}, in search index: {indexed_count}")
+        if product_count != indexed_count:
+            print("[AUTO] Search index out of sync with DB, rebuilding FAISS index...")
+            build_search_index()
+            return
+
+        log_version, records, _ = read_change_log()
+        pending = len(records) if log_version == version else 0
+        if pending >= app.config.get("SEARCH_CHANGELOG_COMPACT_RECORDS", 1000):
+            print(f"[AUTO] {pending} pending changes in search change log, compacting...")
+            compact_search_index()
+        else:
+            print(f"[AUTO] Search index already up-to-date ({pending} pending changes in change log).")
 
 if __name__ == "__main__":
-    auto_rebuild_search_index()
\ No newline at end of file
+    auto_rebuild_search_index()
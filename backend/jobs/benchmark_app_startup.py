@@ -0,0 +1,88 @@
+"""
+Benchmark thời gian khởi động create_app(): search lazy (mặc định) vs load sẵn stack ML tìm kiếm
+(SentenceTransformer + FAISS index, như hành vi cũ khi import search_service).
+
+Mỗi lần đo chạy trong 1 process mới (spawn) như 1 worker / 1 job vừa khởi động:
+thời gian import package app, create_app(), warm-up search, RSS sau khởi động và torch đã bị import hay chưa.
+
+Có thể gọi trực tiếp: python -m jobs.benchmark_app_startup --runs 5
+DATABASE_URL không được set thì dùng 1 file SQLite tạm.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import multiprocessing as mp
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+MODES = ('lazy', 'warm-up')
+
+
+def _rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def _worker(mode, results):
+    # Chỉ import app trong process con để đo đúng chi phí import
+    t0 = time.perf_counter()
+    from config import DevelopmentConfig
+    from app import create_app
+    import_seconds = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    create_app(DevelopmentConfig)
+    create_seconds = time.perf_counter() - t0
+
+    warm_up_seconds = 0.0
+    if mode == 'warm-up':
+        from app.services.search_service import search_service_instance
+        t0 = time.perf_counter()
+        search_service_instance.warm_up()
+        warm_up_seconds = time.perf_counter() - t0
+
+    results.put({
+        'import_s': import_seconds,
+        'create_s': create_seconds,
+        'warm_up_s': warm_up_seconds,
+        'rss_mb': _rss_mb(),
+        'torch': 'torch' in sys.modules,
+    })
+
+
+def _run_once(mode):
+    ctx = mp.get_context('spawn')
+    results = ctx.Queue()
+    proc = ctx.Process(target=_worker, args=(mode, results))
+    proc.start()
+    row = results.get()
+    proc.join()
+    return row
+
+
+def run_benchmark(n_runs):
+    print(f"{'mode':>8} {'import s':>9} {'create_app s':>13} {'warm-up s':>10} {'total s':>8} {'RSS MB':>7} {'torch':>6}")
+    for mode in MODES:
+        rows = [_run_once(mode) for _ in range(n_runs)]
+        median = {k: float(np.median([r[k] for r in rows])) for k in ('import_s', 'create_s', 'warm_up_s', 'rss_mb')}
+        total = median['import_s'] + median['create_s'] + median['warm_up_s']
+        print(f"{mode:>8} {median['import_s']:>9.2f} {median['create_s']:>13.2f} {median['warm_up_s']:>10.2f} "
+              f"{total:>8.2f} {median['rss_mb']:>7.0f} {str(rows[-1]['torch']):>6}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='Số lần đo mỗi chế độ (lấy median)')
+    args = parser.parse_args()
+
+    if not os.environ.get('DATABASE_URL'):
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'startup.db')}"
+    os.environ.setdefault('SEARCH_WARMUP', 'false')  # chế độ warm-up gọi warm_up() trực tiếp để đo riêng
+    run_benchmark(args.runs)
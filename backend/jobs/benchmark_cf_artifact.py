@@ -0,0 +1,109 @@
+"""
+Benchmark định dạng artifact của model CF: pickle {SVD, Trainset của Surprise} (định dạng cũ)
+vs mảng .npy float32 + CSR item đã xem (memmap). Rating được sinh ngẫu nhiên, không cần database.
+
+Mỗi lần load chạy trong 1 process mới (spawn) giống 1 worker vừa khởi động:
+đo kích thước artifact, thời gian load (cold start) và latency của request gợi ý đầu tiên.
+
+Có thể gọi trực tiếp: python -m jobs.benchmark_cf_artifact --ratings 100000,1000000
+"""
+import os
+import sys
+import time
+import pickle
+import argparse
+import tempfile
+import multiprocessing as mp
+
+import numpy as np
+import pandas as pd
+from surprise import Dataset, Reader, SVD
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.artifact_registry import ArtifactRegistry
+from app.services.recommendation_service import (
+    CF_ARTIFACT, CF_MODEL_FILE, _cf_arrays, _save_array_artifact, _load_cf_model, _lookup_index
+)
+
+
+def _generate_ratings(n_ratings, n_users, n_items, seed=42):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'user_id': rng.integers(1, n_users + 1, n_ratings),
+        'product_id': rng.zipf(1.2, n_ratings) % n_items + 1,
+        'rating': rng.choice([1.0, 3.0, 5.0], n_ratings, p=[0.7, 0.2, 0.1]),
+    })
+    return df.groupby(['user_id', 'product_id'], sort=False)['rating'].max().reset_index()
+
+
+def _write_artifacts(out_dir, df, n_factors, n_epochs):
+    trainset = Dataset.load_from_df(df, Reader(rating_scale=(1, 5))).build_full_trainset()
+    algo = SVD(n_factors=n_factors, n_epochs=n_epochs, random_state=42)
+    algo.fit(trainset)
+
+    legacy_registry = ArtifactRegistry(CF_ARTIFACT, os.path.join(out_dir, 'pickle'))
+    with legacy_registry.begin() as build:
+        with open(build.path(CF_MODEL_FILE), 'wb') as f:
+            pickle.dump({'model': algo, 'trainset': trainset, 'version': build.version}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        legacy_manifest = build.commit(rows=len(df))
+    legacy_registry.publish(legacy_manifest['version'])
+
+    arrays, meta = _cf_arrays(algo, trainset)
+    manifest = _save_array_artifact(ArtifactRegistry(CF_ARTIFACT, os.path.join(out_dir, 'memmap')), arrays,
+                                    meta=meta, rows=len(df))
+    sample_users = np.random.default_rng(0).choice(arrays['user_raw_ids'], 200)
+    return {'pickle': legacy_manifest, 'memmap': manifest}, sample_users
+
+
+def _worker(root, sample_users, results):
+    t0 = time.perf_counter()
+    model = _load_cf_model(ArtifactRegistry(CF_ARTIFACT, root))
+    load_seconds = time.perf_counter() - t0
+
+    # Request đầu tiên: tra user, chấm điểm mọi item, bỏ item đã xem (chạm các page của memmap)
+    latencies = []
+    for user_id in sample_users:
+        t0 = time.perf_counter()
+        u = _lookup_index(model['user_sorted_ids'], model['user_sorted_pos'], user_id)
+        scores = model['global_mean'] + model['bu'][u] + model['bi'] + model['qi'] @ model['pu'][u]
+        scores[model['seen_indices'][model['seen_indptr'][u]:model['seen_indptr'][u + 1]]] = -np.inf
+        np.argpartition(-scores, 10)[:10]
+        latencies.append((time.perf_counter() - t0) * 1000)
+    results.put({'load_ms': load_seconds * 1000, 'first_ms': latencies[0], 'p50_ms': float(np.percentile(latencies, 50))})
+
+
+def _run_worker(root, sample_users):
+    ctx = mp.get_context('spawn')
+    results = ctx.Queue()
+    proc = ctx.Process(target=_worker, args=(root, sample_users, results))
+    proc.start()
+    row = results.get()
+    proc.join()
+    return row
+
+
+def run_benchmark(sizes, n_users, n_items, n_factors, n_epochs):
+    print(f"{'ratings':>9} {'format':>7} {'file MB':>8} {'load ms':>9} {'1st req ms':>11} {'p50 ms':>7}")
+    for n_ratings in sizes:
+        df = _generate_ratings(n_ratings, n_users, n_items)
+        with tempfile.TemporaryDirectory() as out_dir:
+            manifests, sample_users = _write_artifacts(out_dir, df, n_factors, n_epochs)
+            for fmt in ('pickle', 'memmap'):
+                size_mb = sum(f['size'] for f in manifests[fmt]['files'].values()) / 2**20
+                row = _run_worker(os.path.join(out_dir, fmt), sample_users)
+                print(f"{len(df):>9} {fmt:>7} {size_mb:>8.1f} {row['load_ms']:>9.1f} "
+                      f"{row['first_ms']:>11.2f} {row['p50_ms']:>7.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ratings', default='100000,1000000', help='Danh sách số rating, cách nhau bởi dấu phẩy')
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--items', type=int, default=20000)
+    parser.add_argument('--factors', type=int, default=50)
+    parser.add_argument('--epochs', type=int, default=2, help='Số epoch SVD (không ảnh hưởng kích thước artifact)')
+    args = parser.parse_args()
+
+    run_benchmark([int(x) for x in args.ratings.split(',')], args.users, args.items, args.factors, args.epochs)
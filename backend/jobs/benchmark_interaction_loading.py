@@ -0,0 +1,130 @@
+"""
+Benchmark lấy dữ liệu training cho CF: cách cũ (Interaction.query.all() + pandas groupby)
+so với _get_interaction_data() hiện tại (GROUP BY trong SQL, stream vào mảng numpy).
+
+Dữ liệu Interaction được sinh ngẫu nhiên vào 1 database SQLite tạm.
+Mỗi lần đo chạy trong 1 process riêng; peak memory = VmHWM (reset qua /proc/self/clear_refs) trừ RSS trước khi load.
+
+Có thể gọi trực tiếp: python -m jobs.benchmark_interaction_loading --rows 1000000,10000000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import datetime
+import resource
+import tempfile
+import multiprocessing as mp
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config import Config
+
+
+def _make_config(db_path):
+    class BenchmarkConfig(Config):
+        SECRET_KEY = 'benchmark'
+        JWT_SECRET_KEY = 'benchmark'
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{db_path}"
+    return BenchmarkConfig
+
+
+def _generate(db_path, n_rows, n_users, n_products, batch_size=200000, seed=42):
+    from app import create_app, db
+    app = create_app(_make_config(db_path))
+    rng = random.Random(seed)
+    types = ['VIEW'] * 6 + ['ADD_TO_CART'] * 3 + ['PURCHASE']
+    start = datetime.datetime(2025, 1, 1)
+    with app.app_context():
+        conn = db.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            for offset in range(0, n_rows, batch_size):
+                rows = [
+                    (rng.randint(1, n_users), rng.randint(1, n_products), rng.choice(types),
+                     (start + datetime.timedelta(seconds=offset + i)).isoformat(' '))
+                    for i in range(min(batch_size, n_rows - offset))
+                ]
+                cursor.executemany(
+                    "INSERT INTO interaction (user_id, product_id, type, timestamp) VALUES (?, ?, ?, ?)", rows
+                )
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def _reset_peak_rss_kb():
+    """ Reset VmHWM về RSS hiện tại (Linux >= 4.0) và trả về RSS hiện tại. """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+    return _read_status_kb('VmRSS')
+
+
+def _read_status_kb(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(f'{field}:'):
+                return int(line.split()[1])
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _legacy_get_interaction_data():
+    """ Bản sao cách làm cũ: materialize toàn bộ ORM object rồi groupby bằng pandas. """
+    import pandas as pd
+    from app.models.ecommerce_models import Interaction
+    from app.services.recommendation_service import INTERACTION_WEIGHTS
+
+    interactions = Interaction.query.all()
+    data = []
+    for i in interactions:
+        if i.type in INTERACTION_WEIGHTS:
+            data.append({'user_id': i.user_id, 'product_id': i.product_id, 'rating': INTERACTION_WEIGHTS[i.type]})
+    df = pd.DataFrame(data)
+    return df.groupby(['user_id', 'product_id'])['rating'].max().reset_index()
+
+
+def _measure(method, db_path, results):
+    from app import create_app
+    from app.services.recommendation_service import _get_interaction_data
+
+    app = create_app(_make_config(db_path))
+    with app.app_context():
+        baseline_kb = _reset_peak_rss_kb()
+        loader = _legacy_get_interaction_data if method == 'legacy' else _get_interaction_data
+        started = time.perf_counter()
+        df = loader()
+        elapsed = time.perf_counter() - started
+        peak_kb = _read_status_kb('VmHWM')
+    results.put({'seconds': elapsed, 'peak_mb': (peak_kb - baseline_kb) / 1024, 'ratings': len(df)})
+
+
+def run_benchmark(sizes, n_users, n_products, methods):
+    ctx = mp.get_context('spawn')
+    print(f"{'rows':>10} {'method':>8} {'ratings':>10} {'seconds':>9} {'peak MB':>9}")
+    for n_rows in sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'benchmark.db')
+            print(f"[INFO] Generating {n_rows} interactions...")
+            _generate(db_path, n_rows, n_users, n_products)
+            for method in methods:
+                results = ctx.Queue()
+                proc = ctx.Process(target=_measure, args=(method, db_path, results))
+                proc.start()
+                row = results.get()
+                proc.join()
+                print(f"{n_rows:>10} {method:>8} {row['ratings']:>10} {row['seconds']:>9.2f} {row['peak_mb']:>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', default='1000000,10000000', help='Số dòng Interaction, cách nhau bởi dấu phẩy')
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--methods', default='legacy,sql', help='legacy và/hoặc sql')
+    args = parser.parse_args()
+
+    run_benchmark([int(x) for x in args.rows.split(',')], args.users, args.products, args.methods.split(','))
@@ -0,0 +1,156 @@
+"""
+Benchmark định dạng artifact của recommendation: pickle (load lên heap) vs .npy + manifest (memmap).
+Dữ liệu top-K được sinh ngẫu nhiên, không cần database.
+
+Mỗi worker là 1 process mới (spawn) giống 1 Gunicorn worker vừa khởi động:
+đo thời gian load (cold start), thời gian tra cứu toàn bộ sản phẩm,
+và bộ nhớ tăng thêm sau khi load (RSS, PSS, Private) khi N worker cùng chạy.
+
+Có thể gọi trực tiếp: python -m jobs.benchmark_recommendation_artifacts --products 20000,100000 --workers 4
+"""
+import os
+import sys
+import time
+import pickle
+import argparse
+import tempfile
+import multiprocessing as mp
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.artifact_registry import ArtifactRegistry
+from app.services.recommendation_service import (
+    _save_array_artifact, _load_array_artifact, _build_id_lookup, _lookup_index
+)
+
+ARTIFACT_NAME = 'similarity'
+
+
+def _memory_kb():
+    """ RSS từ /proc/self/status, PSS và Private từ /proc/self/smaps_rollup (Linux). """
+    stats = {'rss': 0, 'pss': 0, 'private': 0}
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                stats['rss'] = int(line.split()[1])
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key == 'Pss':
+                    stats['pss'] = int(value.split()[0])
+                elif key in ('Private_Clean', 'Private_Dirty'):
+                    stats['private'] += int(value.split()[0])
+    except FileNotFoundError:
+        pass
+    return stats
+
+
+def _generate(n_products, top_k, seed=42):
+    rng = np.random.default_rng(seed)
+    product_ids = rng.permutation(np.arange(1, n_products * 2, 2, dtype=np.int32))
+    neighbors = rng.integers(0, n_products, size=(n_products, top_k), dtype=np.int32)
+    scores = -np.sort(-rng.random((n_products, top_k), dtype=np.float32), axis=1)
+    return product_ids, neighbors, scores
+
+
+def _write_artifacts(out_dir, product_ids, neighbors, scores):
+    sorted_ids, sorted_pos = _build_id_lookup(product_ids)
+    manifest = _save_array_artifact(ArtifactRegistry(ARTIFACT_NAME, out_dir), {
+        'product_ids': product_ids,
+        'sorted_ids': sorted_ids,
+        'sorted_pos': sorted_pos,
+        'neighbors': neighbors,
+        'scores': scores,
+    })
+    # Định dạng cũ: 1 file pickle, mapping là dict Python
+    pickle_path = os.path.join(out_dir, 'similarity.pkl')
+    with open(pickle_path, 'wb') as f:
+        pickle.dump({
+            'neighbors': neighbors,
+            'scores': scores,
+            'index_to_id': product_ids,
+            'id_to_index': {int(pid): idx for idx, pid in enumerate(product_ids)},
+        }, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return pickle_path, manifest
+
+
+def _worker(fmt, out_dir, pickle_path, barrier, results):
+    before = _memory_kb()
+
+    t0 = time.perf_counter()
+    if fmt == 'pickle':
+        with open(pickle_path, 'rb') as f:
+            model = pickle.load(f)
+        id_to_index = model['id_to_index']
+        lookup = id_to_index.get
+    else:
+        _, _, model = _load_array_artifact(ArtifactRegistry(ARTIFACT_NAME, out_dir))
+        sorted_ids, sorted_pos = model['sorted_ids'], model['sorted_pos']
+        lookup = lambda pid: _lookup_index(sorted_ids, sorted_pos, pid)
+    load_seconds = time.perf_counter() - t0
+
+    # Tra cứu mọi sản phẩm để chạm hết các page như một worker đã "nóng"
+    neighbors, product_ids = model['neighbors'], model['index_to_id' if fmt == 'pickle' else 'product_ids']
+    t0 = time.perf_counter()
+    checksum = 0
+    for pid in product_ids[::max(1, len(product_ids) // 20000)]:
+        checksum += int(product_ids[neighbors[lookup(int(pid)), :5]].sum())
+    lookup_seconds = time.perf_counter() - t0
+
+    # Đợi mọi worker load xong để PSS phản ánh phần dùng chung
+    barrier.wait()
+    after = _memory_kb()
+    results.put({
+        'load_ms': load_seconds * 1000,
+        'lookup_ms': lookup_seconds * 1000,
+        'rss_mb': (after['rss'] - before['rss']) / 1024,
+        'pss_mb': (after['pss'] - before['pss']) / 1024,
+        'private_mb': (after['private'] - before['private']) / 1024,
+        'checksum': checksum,
+    })
+    barrier.wait()
+
+
+def _run_workers(fmt, out_dir, pickle_path, n_workers):
+    ctx = mp.get_context('spawn')
+    barrier = ctx.Barrier(n_workers)
+    results = ctx.Queue()
+    procs = [ctx.Process(target=_worker, args=(fmt, out_dir, pickle_path, barrier, results)) for _ in range(n_workers)]
+    for p in procs:
+        p.start()
+    rows = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+    return rows
+
+
+def run_benchmark(sizes, top_k, n_workers):
+    print(f"{'products':>9} {'format':>7} {'file MB':>8} {'load ms':>8} {'lookup ms':>10} "
+          f"{'RSS MB/w':>9} {'PSS MB/w':>9} {'priv MB/w':>10} {'PSS total':>10}")
+    for n_products in sizes:
+        product_ids, neighbors, scores = _generate(n_products, top_k)
+        with tempfile.TemporaryDirectory() as out_dir:
+            pickle_path, manifest = _write_artifacts(out_dir, product_ids, neighbors, scores)
+            sizes_mb = {
+                'pickle': os.path.getsize(pickle_path) / 2**20,
+                'memmap': sum(f['size'] for f in manifest['files'].values()) / 2**20,
+            }
+            for fmt in ('pickle', 'memmap'):
+                rows = _run_workers(fmt, out_dir, pickle_path, n_workers)
+                avg = {k: float(np.mean([r[k] for r in rows])) for k in rows[0] if k != 'checksum'}
+                print(f"{n_products:>9} {fmt:>7} {sizes_mb[fmt]:>8.1f} {avg['load_ms']:>8.1f} {avg['lookup_ms']:>10.1f} "
+                      f"{avg['rss_mb']:>9.1f} {avg['pss_mb']:>9.1f} {avg['private_mb']:>10.1f} "
+                      f"{avg['pss_mb'] * n_workers:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', default='20000,100000', help='Danh sách kích thước catalog, cách nhau bởi dấu phẩy')
+    parser.add_argument('--top-k', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    run_benchmark([int(x) for x in args.products.split(',')], args.top_k, args.workers)
@@ -0,0 +1,267 @@
+"""
+Benchmark + đánh giá offline cho recommendation, chạy trên SQLite với dữ liệu sinh ngẫu nhiên (không cần MySQL).
+
+Với mỗi kích thước catalog:
+- Sinh sản phẩm theo category (mỗi category có bộ từ khóa riêng) và user có 1-2 category yêu thích.
+- Chia train/test theo thời gian: tương tác trước mốc cutoff dùng để train (RECOMMEND_TRAINING_CUTOFF),
+  tương tác sau cutoff là ground truth.
+- Báo cáo precision@K, recall@K, coverage cho CF, content-based (láng giềng của sản phẩm vừa xem)
+  và popularity; thời gian train, dung lượng artifact; latency p50/p99 mỗi request của
+  get_similar_products và get_collaborative_recommendations.
+
+Mỗi catalog chạy trong 1 process riêng với RECOMMEND_MODEL_DIR trỏ vào thư mục tạm,
+nên không đụng tới model đang dùng trong instance/.
+Redis không bắt buộc: nếu không có, CF luôn tính trực tiếp (không có kết quả precompute).
+
+Có thể gọi trực tiếp: python -m jobs.benchmark_recommendation_quality --products 1000,10000 --k 10
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import datetime
+import tempfile
+import contextlib
+import multiprocessing as mp
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config import Config
+
+N_DAYS = 120
+CATEGORY_WORDS = [
+    "whey protein isolate concentrate",
+    "creatine monohydrate strength power",
+    "pre workout caffeine energy pump",
+    "bcaa amino acid recovery eaa",
+    "mass gainer carbohydrate bulk calories",
+    "vitamin multivitamin mineral daily",
+    "fish oil omega epa dha",
+    "fat burner carnitine cla lean",
+    "protein bar snack cookie",
+    "shaker bottle gym accessory",
+]
+FLAVORS = "chocolate vanilla strawberry cookies banana coffee mango unflavored".split()
+
+
+def _make_config(db_path, cutoff):
+    class BenchmarkConfig(Config):
+        SECRET_KEY = 'benchmark'
+        JWT_SECRET_KEY = 'benchmark'
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{db_path}"
+        RECOMMEND_TRAINING_CUTOFF = cutoff.isoformat(' ')
+    return BenchmarkConfig
+
+
+def _generate(db_path, cutoff, n_products, n_users, interactions_per_user, seed=42):
+    """ Sinh dữ liệu có cấu trúc: user chủ yếu tương tác với sản phẩm thuộc category yêu thích. """
+    from app import create_app, db
+    app = create_app(_make_config(db_path, cutoff))
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    n_categories = len(CATEGORY_WORDS)
+    start = cutoff - datetime.timedelta(days=N_DAYS * 3 // 4)
+
+    with app.app_context():
+        conn = db.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("INSERT INTO role (id, name) VALUES (1, 'user')")
+            cursor.executemany("INSERT INTO category (id, name) VALUES (?, ?)",
+                               [(i + 1, f"category {i}") for i in range(n_categories)])
+            cursor.executemany("INSERT INTO brand (id, name) VALUES (?, ?)",
+                               [(i + 1, f"brand{i}") for i in range(20)])
+
+            product_categories = np_rng.integers(0, n_categories, n_products)
+            cursor.executemany(
+                "INSERT INTO product (id, name, \"desc\", package_quantity, package_unit, serving_quantity, serving_unit, "
+                "price, category_id, brand_id, is_active) VALUES (?, ?, ?, 1, 'kg', 30, 'g', 100000, ?, ?, 1)",
+                [(pid + 1,
+                  f"{' '.join(rng.sample(CATEGORY_WORDS[c].split(), 2))} {rng.choice(FLAVORS)} {pid}",
+                  f"{CATEGORY_WORDS[c]} {rng.choice(FLAVORS)}",
+                  int(c) + 1, rng.randint(1, 20))
+                 for pid, c in enumerate(product_categories)]
+            )
+            cursor.executemany("INSERT INTO user (id, role_id, email, password_hash) VALUES (?, 1, ?, 'x')",
+                               [(uid, f"user{uid}@benchmark.local") for uid in range(1, n_users + 1)])
+
+            # Độ phổ biến trong từng category theo phân phối Zipf
+            by_category = [np.flatnonzero(product_categories == c) + 1 for c in range(n_categories)]
+            weights = [1.0 / np.arange(1, len(ids) + 1) ** 0.8 for ids in by_category]
+            weights = [w / w.sum() if len(w) else w for w in weights]
+            types = ['VIEW'] * 6 + ['ADD_TO_CART'] * 3 + ['PURCHASE']
+
+            rows = []
+            for uid in range(1, n_users + 1):
+                favorites = rng.sample(range(n_categories), rng.choice([1, 2]))
+                for _ in range(max(1, int(np_rng.poisson(interactions_per_user)))):
+                    c = rng.choice(favorites) if rng.random() < 0.85 else rng.randrange(n_categories)
+                    if not len(by_category[c]):
+                        continue
+                    pid = int(np_rng.choice(by_category[c], p=weights[c]))
+                    when = start + datetime.timedelta(seconds=rng.uniform(0, N_DAYS * 86400))
+                    rows.append((uid, pid, rng.choice(types), when.isoformat(' ')))
+            cursor.executemany("INSERT INTO interaction (user_id, product_id, type, timestamp) VALUES (?, ?, ?, ?)", rows)
+            conn.commit()
+        finally:
+            conn.close()
+    return len(rows)
+
+
+def _percentiles(latencies):
+    return float(np.percentile(latencies, 50)), float(np.percentile(latencies, 99))
+
+
+def _ranking_metrics(recommendations, relevant, k, n_items):
+    precisions, recalls, recommended = [], [], set()
+    for user_id, items in relevant.items():
+        recs = recommendations.get(user_id, [])[:k]
+        hits = len(set(recs) & items)
+        precisions.append(hits / k)
+        recalls.append(hits / len(items))
+        recommended.update(recs)
+    return {
+        'precision': float(np.mean(precisions)) if precisions else 0.0,
+        'recall': float(np.mean(recalls)) if recalls else 0.0,
+        'coverage': len(recommended) / n_items if n_items else 0.0,
+    }
+
+
+def _artifact_mb(registry):
+    _, _, manifest = registry.current()
+    return sum(f['size'] for f in manifest['files'].values()) / 2**20
+
+
+def _evaluate(db_path, cutoff, k, n_eval_users, n_latency_requests, results):
+    from sqlalchemy import func
+    from app import create_app, db
+    from app.models.ecommerce_models import Interaction, InteractionType
+    import app.services.recommendation_service as rs
+
+    app = create_app(_make_config(db_path, cutoff))
+    with app.app_context(), open(os.devnull, 'w') as devnull:
+        quiet = lambda: contextlib.redirect_stdout(devnull)
+
+        with quiet():
+            started = time.perf_counter()
+            rs.build_similarity_matrix()
+            similarity_seconds = time.perf_counter() - started
+            started = time.perf_counter()
+            rs.build_collaborative_model()
+            cf_seconds = time.perf_counter() - started
+            train_df = rs._get_interaction_data()
+
+        n_items = db.session.query(func.count()).select_from(rs.Product).scalar()
+        seen = train_df.groupby('user_id')['product_id'].agg(set).to_dict()
+
+        # Ground truth: sản phẩm mới (chưa tương tác trong train) mà user tương tác sau cutoff
+        test_rows = db.session.query(Interaction.user_id, Interaction.product_id).filter(
+            Interaction.timestamp >= cutoff, Interaction.type.in_(list(rs.INTERACTION_WEIGHTS))
+        ).distinct().all()
+        relevant = {}
+        for user_id, product_id in test_rows:
+            if user_id in seen and product_id not in seen[user_id]:
+                relevant.setdefault(user_id, set()).add(product_id)
+        eval_users = sorted(relevant)
+        random.Random(0).shuffle(eval_users)
+        relevant = {user_id: relevant[user_id] for user_id in eval_users[:n_eval_users]}
+
+        # Popularity: số lượt mua trước cutoff (không dùng Redis để tránh lộ dữ liệu test)
+        popular = [pid for (pid,) in db.session.query(Interaction.product_id).filter(
+            Interaction.type == InteractionType.PURCHASE, Interaction.timestamp < cutoff
+        ).group_by(Interaction.product_id).order_by(func.count(Interaction.id).desc()).limit(k + 200)]
+
+        n_recent = int(app.config.get('RECOMMEND_HYBRID_RECENT_ITEMS', rs.DEFAULT_HYBRID_RECENT_ITEMS))
+        recommendations = {'cf': {}, 'content': {}, 'popular': {}}
+        with quiet():
+            for user_id in relevant:
+                user_seen = seen[user_id]
+                product_ids, _ = rs.get_collaborative_recommendations(user_id, top_n=k)
+                recommendations['cf'][user_id] = product_ids
+
+                recent = db.session.query(Interaction.product_id).filter(
+                    Interaction.user_id == user_id, Interaction.timestamp < cutoff,
+                    Interaction.type.in_([InteractionType.VIEW, InteractionType.ADD_TO_CART])
+                ).order_by(Interaction.timestamp.desc()).limit(n_recent * 4).all()
+                seeds = list(dict.fromkeys(pid for (pid,) in recent))[:n_recent]
+                candidates = rs.content_candidates_from_seeds(seeds, k + len(user_seen))
+                recommendations['content'][user_id] = [pid for pid in candidates if pid not in user_seen][:k]
+
+                recommendations['popular'][user_id] = [pid for pid in popular if pid not in user_seen][:k]
+
+        # Latency mỗi request (model đã nằm trong holder, giống worker đã "nóng")
+        rng = random.Random(1)
+        product_ids = [int(pid) for pid in rs.similarity_model_holder.get()['product_ids']]
+        user_ids = list(seen)
+        similar_latencies, cf_latencies = [], []
+        with quiet():
+            for _ in range(n_latency_requests):
+                started = time.perf_counter()
+                rs.get_similar_products(rng.choice(product_ids), top_n=5)
+                similar_latencies.append((time.perf_counter() - started) * 1000)
+                started = time.perf_counter()
+                rs.get_collaborative_recommendations(rng.choice(user_ids), top_n=10)
+                cf_latencies.append((time.perf_counter() - started) * 1000)
+
+        results.put({
+            'train_ratings': len(train_df),
+            'eval_users': len(relevant),
+            'metrics': {name: _ranking_metrics(recs, relevant, k, n_items) for name, recs in recommendations.items()},
+            'similarity_seconds': similarity_seconds,
+            'cf_seconds': cf_seconds,
+            'similarity_mb': _artifact_mb(rs.similarity_registry),
+            'cf_mb': _artifact_mb(rs.cf_registry),
+            'similar_latency': _percentiles(similar_latencies),
+            'cf_latency': _percentiles(cf_latencies),
+        })
+
+
+def run_benchmark(sizes, users_per_product, interactions_per_user, k, n_eval_users, n_latency_requests):
+    ctx = mp.get_context('spawn')
+    cutoff = datetime.datetime(2025, 1, 1) + datetime.timedelta(days=N_DAYS * 3 // 4)
+    for n_products in sizes:
+        n_users = max(100, int(n_products * users_per_product))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'benchmark.db')
+            print(f"[INFO] Generating {n_products} products, {n_users} users...")
+            n_interactions = _generate(db_path, cutoff, n_products, n_users, interactions_per_user)
+
+            # Process con đọc RECOMMEND_MODEL_DIR lúc import artifact_registry
+            os.environ['RECOMMEND_MODEL_DIR'] = os.path.join(tmp_dir, 'models')
+            results = ctx.Queue()
+            proc = ctx.Process(target=_evaluate, args=(db_path, cutoff, k, n_eval_users, n_latency_requests, results))
+            proc.start()
+            row = results.get()
+            proc.join()
+
+        print(f"\n=== {n_products} products, {n_users} users, {n_interactions} interactions "
+              f"({row['train_ratings']} train ratings, {row['eval_users']} eval users) ===")
+        print(f"{'model':>8} {'P@' + str(k):>8} {'R@' + str(k):>8} {'coverage':>9} {'train s':>8} "
+              f"{'artifact MB':>12} {'p50 ms':>8} {'p99 ms':>8}")
+        for name, metrics in row['metrics'].items():
+            if name == 'cf':
+                extra = (row['cf_seconds'], row['cf_mb']) + row['cf_latency']
+            elif name == 'content':
+                extra = (row['similarity_seconds'], row['similarity_mb']) + row['similar_latency']
+            else:
+                extra = None
+            extra = (f"{extra[0]:>8.2f} {extra[1]:>12.2f} {extra[2]:>8.2f} {extra[3]:>8.2f}" if extra
+                     else f"{'-':>8} {'-':>12} {'-':>8} {'-':>8}")
+            print(f"{name:>8} {metrics['precision']:>8.4f} {metrics['recall']:>8.4f} {metrics['coverage']:>9.3f} {extra}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', default='1000,10000', help='Danh sách kích thước catalog, cách nhau bởi dấu phẩy')
+    parser.add_argument('--users-per-product', type=float, default=2.0)
+    parser.add_argument('--interactions-per-user', type=float, default=20)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--eval-users', type=int, default=1000, help='Số user tối đa dùng để tính metric')
+    parser.add_argument('--latency-requests', type=int, default=500)
+    args = parser.parse_args()
+
+    run_benchmark([int(x) for x in args.products.split(',')], args.users_per_product,
+                  args.interactions_per_user, args.k, args.eval_users, args.latency_requests)
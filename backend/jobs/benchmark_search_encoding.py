@@ -0,0 +1,64 @@
+"""
+Benchmark throughput encode khi build index tìm kiếm theo số process (SEARCH_ENCODE_WORKERS).
+Tên sản phẩm được sinh ngẫu nhiên (không cần database), encode theo chunk giống job run_search_indexing.
+
+Báo cáo cho từng số worker: thời gian khởi động pool (load model trong mỗi process), products/s,
+tốc độ so với 1 process và sai khác lớn nhất của vector so với encode 1 process (phải ~0: thứ tự được giữ nguyên).
+
+Có thể gọi trực tiếp: python -m jobs.benchmark_search_encoding --products 20000 --workers 1,2,4,8
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.search_service import MODEL_NAME, product_search_text
+from jobs.run_search_indexing import ProductEncoder
+
+WORDS = ("whey protein isolate hydrolyzed creatine monohydrate pre workout bcaa eaa amino mass gainer vitamin "
+         "fish oil omega caffeine energy recovery casein vegan chocolate vanilla strawberry cookies cream "
+         "unflavored 1kg 2lb 5lb 30 servings 60 capsules tablets gummies").split()
+
+
+def _generate_names(n_products, seed=42):
+    rng = random.Random(seed)
+    return [" ".join(rng.choices(WORDS, k=rng.randint(3, 8))) for _ in range(n_products)]
+
+
+def run_benchmark(n_products, worker_counts, chunk_size, batch_size):
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(MODEL_NAME)
+    texts = [product_search_text(name) for name in _generate_names(n_products)]
+    print(f"{n_products} products, chunk {chunk_size}, batch {batch_size}, {os.cpu_count()} CPUs")
+    print(f"{'workers':>7} {'pool s':>7} {'products/s':>11} {'speedup':>8} {'max diff':>9}")
+
+    baseline, baseline_rate = None, None
+    for workers in worker_counts:
+        started = time.perf_counter()
+        with ProductEncoder(model, workers, batch_size) as encoder:
+            pool_seconds = time.perf_counter() - started
+            encode_started = time.perf_counter()
+            vectors = np.concatenate([encoder.encode(texts[i:i + chunk_size])
+                                      for i in range(0, n_products, chunk_size)])
+            rate = n_products / (time.perf_counter() - encode_started)
+        if baseline is None:
+            baseline, baseline_rate = vectors, rate
+        print(f"{workers:>7} {pool_seconds:>7.1f} {rate:>11.0f} {rate / baseline_rate:>7.2f}x "
+              f"{float(np.abs(vectors - baseline).max()):>9.1e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=20000)
+    parser.add_argument('--workers', default=','.join(str(w) for w in sorted({1, 2, 4, os.cpu_count() or 1})),
+                        help='Danh sách số process, cách nhau bởi dấu phẩy (giá trị đầu tiên làm mốc so sánh)')
+    parser.add_argument('--chunk-size', type=int, default=5000, help='Như SEARCH_INDEX_CHUNK_SIZE')
+    parser.add_argument('--batch-size', type=int, default=64, help='Như SEARCH_ENCODE_BATCH_SIZE')
+    args = parser.parse_args()
+
+    run_benchmark(args.products, [int(x) for x in args.workers.split(',')], args.chunk_size, args.batch_size)
@@ -0,0 +1,104 @@
+"""
+Benchmark loại FAISS index cho tìm kiếm sản phẩm (SEARCH_INDEX_TYPE): flat / ivf / ivfpq / hnsw,
+build đúng như job run_search_indexing (IndexIDMap theo product id, khoảng cách L2) trên embedding
+sinh ngẫu nhiên cùng số chiều với model tìm kiếm (384).
+
+Báo cáo cho từng kích thước catalog: thời gian build (gồm train quantizer IVF / PQ), bộ nhớ index,
+QPS khi truy vấn từng câu một (1 thread, như 1 request), latency p99 và recall@K so với index flat (chính xác).
+
+Có thể gọi trực tiếp: python -m jobs.benchmark_search_index --products 10000,100000,1000000 --types flat,ivf,ivfpq,hnsw
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import faiss
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.ann_index import configure_search
+from app.services.search_index_store import build_search_index_from_vectors
+
+
+def _generate_embeddings(n_products, dim, noise, seed=42):
+    """ Embedding có cấu trúc cụm (~50 sản phẩm cùng loại mỗi cụm) cộng nhiễu, độ lớn ~ embedding câu ngắn. """
+    rng = np.random.default_rng(seed)
+    n_clusters = max(1, n_products // 50)
+    centers = rng.standard_normal((n_clusters, dim), dtype=np.float32)
+    vectors = centers[rng.integers(0, n_clusters, n_products)]
+    vectors += noise * rng.standard_normal((n_products, dim), dtype=np.float32)
+    vectors /= np.sqrt(dim)
+    return vectors
+
+
+def _recall_at_k(approx, exact):
+    hits = [len(set(a[a >= 0]) & set(e)) for a, e in zip(approx, exact)]
+    return float(np.mean(hits)) / exact.shape[1]
+
+
+def run_benchmark(sizes, index_types, dim, top_k, n_queries, params, nprobe, ef_search, noise, build_threads):
+    print(f"{'products':>9} {'index':>6} {'build s':>8} {'memory MB':>10} {'QPS':>8} {'p99 ms':>8} {'recall@' + str(top_k):>10}")
+    for n_products in sizes:
+        vectors = _generate_embeddings(n_products, dim, noise)
+        product_ids = np.arange(1, n_products + 1, dtype=np.int64)
+        # Truy vấn = embedding sản phẩm có nhiễu (câu truy vấn gần nhưng không trùng tên sản phẩm)
+        rng = np.random.default_rng(0)
+        queries = vectors[rng.choice(n_products, size=min(n_queries, n_products), replace=False)]
+        queries = queries + 0.1 * rng.standard_normal(queries.shape, dtype=np.float32) / np.sqrt(dim)
+
+        exact = None
+        for index_type in index_types:
+            faiss.omp_set_num_threads(build_threads)
+            started = time.perf_counter()
+            index, built = build_search_index_from_vectors(vectors, product_ids, {**params, "index_type": index_type})
+            build_seconds = time.perf_counter() - started
+            configure_search(index, nprobe=nprobe, ef_search=ef_search)
+            memory_mb = faiss.serialize_index(index).nbytes / 2**20
+
+            faiss.omp_set_num_threads(1)  # đo 1 request, không tính song song nội bộ FAISS
+            latencies, approx = [], []
+            for query in queries:
+                t0 = time.perf_counter()
+                _, labels = index.search(query[None, :], top_k)
+                latencies.append(time.perf_counter() - t0)
+                approx.append(labels[0])
+            approx = np.array(approx)
+            if exact is None:
+                # Ground truth: IndexFlatL2 (không phụ thuộc vào --types có 'flat' hay không)
+                exact_index = faiss.IndexFlatL2(dim)
+                exact_index.add(vectors)
+                exact = product_ids[exact_index.search(queries, top_k)[1]]
+                del exact_index
+
+            label = built["index_type"] if built["index_type"] == index_type else f"{index_type}*"
+            print(f"{n_products:>9} {label:>6} {build_seconds:>8.2f} {memory_mb:>10.1f} "
+                  f"{len(latencies) / sum(latencies):>8.0f} {np.percentile(latencies, 99) * 1000:>8.3f} "
+                  f"{_recall_at_k(approx, exact):>10.3f}")
+            del index
+    print("* catalog quá nhỏ để train loại index này, job lùi về loại đơn giản hơn (xem resolve_index_type)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', default='10000,100000,1000000', help='Danh sách kích thước catalog, cách nhau bởi dấu phẩy')
+    parser.add_argument('--types', default='flat,ivf,ivfpq,hnsw')
+    parser.add_argument('--dim', type=int, default=384, help='Số chiều embedding (paraphrase-multilingual-MiniLM-L12-v2 = 384)')
+    parser.add_argument('--top-k', type=int, default=20, help='Bằng k mặc định của SearchService.search_products')
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--nlist', type=int, default=0, help='0 = tự chọn theo số sản phẩm')
+    parser.add_argument('--nprobe', type=int, default=16)
+    parser.add_argument('--pq-m', type=int, default=0, help='0 = dim / 8')
+    parser.add_argument('--hnsw-m', type=int, default=32)
+    parser.add_argument('--ef-construction', type=int, default=80)
+    parser.add_argument('--ef-search', type=int, default=64)
+    parser.add_argument('--noise', type=float, default=1.0, help='Độ nhiễu quanh tâm cụm (so với độ lớn tâm cụm = 1)')
+    parser.add_argument('--build-threads', type=int, default=0, help='Số thread FAISS khi build (0 = mặc định OpenMP)')
+    args = parser.parse_args()
+
+    index_params = {'nlist': args.nlist or None, 'pq_m': args.pq_m or None,
+                    'hnsw_m': args.hnsw_m, 'ef_construction': args.ef_construction}
+    run_benchmark([int(x) for x in args.products.split(',')], args.types.split(','), args.dim, args.top_k,
+                  args.queries, index_params, args.nprobe, args.ef_search, args.noise,
+                  args.build_threads or faiss.omp_get_max_threads())
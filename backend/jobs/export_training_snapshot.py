@@ -0,0 +1,35 @@
+"""
+Export snapshot dữ liệu training (Arrow IPC) từ DB: quét DB 1 lần, các job training đọc lại bằng memory map.
+
+Có thể gọi trực tiếp: python -m jobs.export_training_snapshot --fetch-size 50000
+Sau đó chạy lại training / benchmark offline trên cùng snapshot, vd.: python -m jobs.run_training --snapshot current
+"""
+import os
+import sys
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config import DevelopmentConfig
+
+from app import create_app
+from app.services.training_snapshot import export_snapshot, DEFAULT_EXPORT_FETCH_SIZE
+
+
+def run_job(fetch_size=DEFAULT_EXPORT_FETCH_SIZE):
+    app = create_app(DevelopmentConfig)
+    with app.app_context():
+        try:
+            manifest = export_snapshot(fetch_size=fetch_size)
+        except Exception as e:
+            print(f"An error occurred while exporting the training snapshot: {e}")
+            sys.exit(1)
+    for name, info in manifest['tables'].items():
+        print(f"{name:>20} {info['rows']:>10} rows {manifest['files'][name + '.arrow']['size'] / 2**20:>8.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fetch-size', type=int, default=DEFAULT_EXPORT_FETCH_SIZE,
+                        help='Số dòng mỗi chunk (record batch) khi stream từ DB')
+    run_job(parser.parse_args().fetch_size)
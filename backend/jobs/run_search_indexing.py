@@ -3,56 +3,272 @@ Manual FAISS indexing builder.
 Có thể gọi trực tiếp: python -m jobs.run_search_indexing
 """
 import os
+import json
+import time
+import fcntl
+import shutil
+import inspect
+import argparse
+import itertools
 import faiss
-import pickle
 import numpy as np
-from sentence_transformers import SentenceTransformer
+import pyarrow.compute as pc
+from flask import current_app
+from sqlalchemy import func
 from app import create_app, db
 from app.models.product_models import Product
+from app.services.search_index_store import (
+    INDEX_FILE, search_registry, search_index_params, StreamingIndexBuilder, change_log_position, publish_search_index
+)
+from app.services.search_service import MODEL_NAME, product_search_text
+from app.services.training_snapshot import read_table, resolve_snapshot
 from config import DevelopmentConfig
 
-MODEL_NAME = "paraphrase-multilingual-MiniLM-L12-v2"
-SAVE_PATH = "instance/search"
-INDEX_FILE = os.path.join(SAVE_PATH, "search_index.faiss")
-MAP_FILE = os.path.join(SAVE_PATH, "product_id_map.pkl")
+DEFAULT_CHUNK_SIZE = 5000
+DEFAULT_ENCODE_BATCH_SIZE = 64
+DEFAULT_TRAIN_SIZE = 100000
+DEFAULT_ENCODE_WORKERS = 1
+CHECKPOINT_DIR = "build-checkpoint"
 
 
-def build_search_index():
-    """Build FAISS index từ dữ liệu sản phẩm."""
+def _count_products(snapshot=None):
+    """ (số sản phẩm active, watermark updated_at) từ DB hoặc từ snapshot training. """
+    if snapshot:
+        table = read_table("product", ["is_active", "updated_at"], snapshot)
+        return pc.sum(table["is_active"]).as_py() or 0, pc.max(table["updated_at"]).as_py()
+
+    count = db.session.query(func.count(Product.id)).filter(Product.is_active == True).scalar() or 0
+    return count, db.session.query(func.max(Product.updated_at)).scalar()
+
+
+def _iter_product_chunks(chunk_size, after_id=0, snapshot=None):
+    """
+    Sản phẩm active có id > after_id theo thứ tự id, từng chunk (product ids, names).
+    DB: server-side cursor (yield_per) chỉ lấy 2 cột; snapshot: mỗi chunk chỉ đọc phần cột cần trong memory map.
+    """
+    if snapshot:
+        table = read_table("product", ["id", "name", "is_active"], snapshot)
+        table = table.filter(pc.and_(table["is_active"], pc.greater(table["id"], after_id)))
+        order = pc.sort_indices(table, sort_keys=[("id", "ascending")])
+        for start in range(0, len(order), chunk_size):
+            chunk = table.take(order[start:start + chunk_size])
+            yield chunk["id"].to_numpy(), chunk["name"].to_pylist()
+        return
+
+    rows = iter(db.session.query(Product.id, Product.name)
+            .filter(Product.is_active == True, Product.id > after_id)
+            .order_by(Product.id)
+            .yield_per(chunk_size))
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield np.array([row.id for row in chunk], dtype=np.int64), [row.name for row in chunk]
+
+
+class ProductEncoder:
+    """
+    Encode văn bản sản phẩm, giữ đúng thứ tự đầu vào.
+    workers > 1: pool nhiều process của SentenceTransformer (mỗi process 1 bản model, chạy trên CPU); mỗi chunk
+    được chia thành các phần nhỏ cho các process rồi ghép lại theo thứ tự, nên vector vẫn khớp product id.
+    Mỗi process dùng cpu_count / workers thread để các process không tranh nhau core.
+    """
+
+    def __init__(self, model, workers=DEFAULT_ENCODE_WORKERS, batch_size=DEFAULT_ENCODE_BATCH_SIZE):
+        self.model = model
+        self.workers = max(1, int(workers))
+        self.batch_size = batch_size
+        self.pool = None
+
+    def __enter__(self):
+        if self.workers > 1:
+            threads = str(max(1, (os.cpu_count() or 1) // self.workers))
+            saved = {name: os.environ.get(name) for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS")}
+            # Process con (spawn) đọc biến môi trường khi import torch; process hiện tại không bị ảnh hưởng
+            os.environ.update({name: value or threads for name, value in saved.items()})
+            try:
+                self.pool = self.model.start_multi_process_pool(target_devices=["cpu"] * self.workers)
+            finally:
+                for name, value in saved.items():
+                    if value is None:
+                        os.environ.pop(name, None)
+            print(f"[INFO] Started {self.workers} encoder processes ({threads} threads each).")
+        return self
+
+    def __exit__(self, *exc):
+        if self.pool is not None:
+            self.model.stop_multi_process_pool(self.pool)
+            self.pool = None
+
+    def encode(self, texts):
+        if self.pool is None:
+            vectors = self.model.encode(texts, batch_size=self.batch_size, convert_to_tensor=False)
+        elif "pool" in inspect.signature(self.model.encode).parameters:
+            vectors = self.model.encode(texts, pool=self.pool, batch_size=self.batch_size)
+        else:
+            # sentence-transformers < 5
+            vectors = self.model.encode_multi_process(texts, self.pool, batch_size=self.batch_size)
+        return np.asarray(vectors, dtype=np.float32)
+
+
+class BuildCheckpoint:
+    """
+    Tiến độ build lưu trong <registry dir>/build-checkpoint: state.json + 1 file .npz (ids, vectors) cho mỗi chunk đã encode.
+    Build bị dừng giữa chừng chạy lại sẽ add lại các chunk đã lưu (không encode lại) rồi đọc tiếp từ id cuối cùng.
+    fingerprint (model, snapshot, tham số index) khác -> checkpoint cũ bị bỏ.
+    """
+
+    def __init__(self, fingerprint):
+        self.dir = os.path.join(search_registry.dir, CHECKPOINT_DIR)
+        self.fingerprint = fingerprint
+        self.state = None
+        self._lock_file = None
+
+    def __enter__(self):
+        os.makedirs(search_registry.dir, exist_ok=True)
+        self._lock_file = open(os.path.join(search_registry.dir, f"{CHECKPOINT_DIR}.lock"), "a")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            raise RuntimeError("Another search index build is running.")
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        self._lock_file.close()
+
+    def _state_path(self):
+        return os.path.join(self.dir, "state.json")
+
+    def _write_state(self):
+        tmp_path = f"{self._state_path()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._state_path())
+
+    def load(self):
+        """ State đã lưu nếu còn dùng được, None nếu phải build lại từ đầu. """
+        try:
+            with open(self._state_path()) as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if state.get("fingerprint") != self.fingerprint:
+            print("[INFO] Search index checkpoint was made with different settings, starting over.")
+            return None
+        self.state = state
+        return state
+
+    def start(self, **state):
+        self.clear()
+        os.makedirs(self.dir)
+        self.state = {**state, "fingerprint": self.fingerprint, "chunks": 0, "rows": 0, "last_id": 0}
+        self._write_state()
+        return self.state
+
+    def iter_chunks(self):
+        for seq in range(self.state["chunks"]):
+            with np.load(os.path.join(self.dir, f"chunk-{seq:06d}.npz")) as data:
+                yield data["ids"], data["vectors"]
+
+    def save_chunk(self, product_ids, vectors):
+        """ Ghi chunk rồi mới cập nhật state: crash giữa chừng chỉ mất chunk đang ghi. """
+        path = os.path.join(self.dir, f"chunk-{self.state['chunks']:06d}.npz")
+        with open(f"{path}.tmp", "wb") as f:
+            np.savez(f, ids=product_ids, vectors=vectors)
+        os.replace(f"{path}.tmp", path)
+        self.state.update(chunks=self.state["chunks"] + 1, rows=self.state["rows"] + len(product_ids),
+                          last_id=int(product_ids[-1]))
+        self._write_state()
+
+    def clear(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+        self.state = None
+
+
+def build_search_index(snapshot=None, resume=True, workers=None):
+    """
+    Build FAISS index từ dữ liệu sản phẩm, ghi vào version mới của registry rồi publish.
+    snapshot: đọc sản phẩm từ snapshot training ('current' hoặc version) thay vì query DB.
+    Sản phẩm được stream theo id từng chunk (SEARCH_INDEX_CHUNK_SIZE), encode theo batch (SEARCH_ENCODE_BATCH_SIZE)
+    trên SEARCH_ENCODE_WORKERS process và add vào index ngay -> RAM không phụ thuộc số sản phẩm (ngoài chính index). Mỗi chunk được checkpoint,
+    resume=True: tiếp tục build bị dừng giữa chừng thay vì encode lại từ đầu.
+    Thay đổi admin ghi vào change log trong lúc build được giữ lại và replay trên version mới.
+    """
     print("[INFO] Building FAISS search index...")
+    started = time.perf_counter()
 
     app = create_app(DevelopmentConfig)
     with app.app_context():
-        os.makedirs(SAVE_PATH, exist_ok=True)
+        config = current_app.config
+        snapshot = resolve_snapshot(snapshot) if snapshot else None
+        chunk_size = int(config.get("SEARCH_INDEX_CHUNK_SIZE", DEFAULT_CHUNK_SIZE))
+        batch_size = int(config.get("SEARCH_ENCODE_BATCH_SIZE", DEFAULT_ENCODE_BATCH_SIZE))
+        workers = int(workers or config.get("SEARCH_ENCODE_WORKERS", DEFAULT_ENCODE_WORKERS))
+        params = search_index_params(config)
 
-        products = Product.query.filter_by(is_active=True).all()
-        if not products:
-            print("[WARN] No products found for indexing.")
-            return
+        with BuildCheckpoint({"model_name": MODEL_NAME, "snapshot": snapshot, "index": params}) as checkpoint:
+            state = checkpoint.load() if resume else None
+            if state is None:
+                # Ghi nhận vị trí change log trước khi đọc sản phẩm: mọi thay đổi sau mốc này được carry sang version mới
+                log_position = change_log_position()
+                n_total, watermark = _count_products(snapshot)
+                if not n_total:
+                    print("[WARN] No products found for indexing.")
+                    return
+                state = checkpoint.start(n_total=n_total, log_position=list(log_position),
+                                         watermark=watermark.isoformat() if watermark is not None else None)
+
+            builder = StreamingIndexBuilder(state["n_total"], params,
+                                            int(config.get("SEARCH_INDEX_TRAIN_SIZE", DEFAULT_TRAIN_SIZE)))
+            for product_ids, vectors in checkpoint.iter_chunks():
+                builder.add(product_ids, vectors)
+            if state["rows"]:
+                print(f"[INFO] Resumed search index build: {state['rows']} products restored from checkpoint "
+                      f"(last id {state['last_id']}).")
 
-        model = SentenceTransformer(MODEL_NAME)
-        texts = []
-        for p in products:
-            name_part = p.name or ""
-            desc_part = getattr(p, "description", "") or ""  # không lỗi nếu không có cột
-            texts.append(f"{name_part} {desc_part}")
-        vectors = model.encode(texts, convert_to_tensor=False)
-        vectors = np.array(vectors, dtype="float32")
+            from sentence_transformers import SentenceTransformer  # import torch chỉ khi thật sự build
+            encode_started, encoded = time.perf_counter(), 0
+            with ProductEncoder(SentenceTransformer(MODEL_NAME), workers, batch_size) as encoder:
+                for product_ids, names in _iter_product_chunks(chunk_size, state["last_id"], snapshot):
+                    # Product không có cột "description" nên phần mô tả luôn rỗng (giữ nguyên văn bản đã index trước đây)
+                    vectors = encoder.encode([product_search_text(name) for name in names])
+                    checkpoint.save_chunk(product_ids, vectors)
+                    builder.add(product_ids, vectors)
+                    encoded += len(product_ids)
+                    print(f"[INFO] Encoded {state['rows']}/{state['n_total']} products "
+                          f"({encoded / (time.perf_counter() - encode_started):.0f} products/s, {workers} workers)")
 
-        index = faiss.IndexFlatL2(vectors.shape[1])
-        index.add(vectors)
-        faiss.write_index(index, INDEX_FILE)
+            index, params = builder.finish()
+            if index is None:
+                print("[WARN] No products found for indexing.")
+                checkpoint.clear()
+                return
 
-        id_map = {i: p.id for i, p in enumerate(products)}
-        with open(MAP_FILE, "wb") as f:
-            pickle.dump(id_map, f)
+            with search_registry.begin(started=started) as build:
+                # Label = product id: upsert / remove từng sản phẩm không cần build lại.
+                # Loại index theo SEARCH_INDEX_TYPE; quantizer IVF / PQ được train trên các chunk đầu tiên
+                faiss.write_index(index, build.path(INDEX_FILE))
 
-        # Lưu meta thông tin để auto rebuild có thể check thay đổi
-        with open(os.path.join(SAVE_PATH, "meta.txt"), "w") as f:
-            f.write(str(len(products)))
+                # rows + watermark trong manifest để auto rebuild có thể check thay đổi
+                manifest = build.commit(rows=int(index.ntotal), watermark=state["watermark"],
+                                        meta={"model_name": MODEL_NAME, "dim": int(index.d), "snapshot": snapshot,
+                                              "index": params, "chunk_size": chunk_size, "encode_workers": workers})
+            publish_search_index(manifest["version"], since=tuple(state["log_position"]))
+            checkpoint.clear()
 
-        print(f"[OK] Search index built with {len(products)} products.")
+        print(f"[OK] Search index built with {index.ntotal} products.")
 
 
 if __name__ == "__main__":
-    build_search_index()
+    parser = argparse.ArgumentParser(description="Build the FAISS product search index.")
+    parser.add_argument('--snapshot', default=None,
+                        help="Đọc sản phẩm từ snapshot training ('current' hoặc version) thay vì query DB")
+    parser.add_argument('--no-resume', action='store_true', help="Bỏ checkpoint của lần build dở trước, build từ đầu")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Số process encode (mặc định SEARCH_ENCODE_WORKERS), xem jobs.benchmark_search_encoding")
+    args = parser.parse_args()
+    build_search_index(args.snapshot, resume=not args.no_resume, workers=args.workers)
@@ -1,7 +1,9 @@
 # NỘI DUNG SỬA CHO: backend/jobs/run_sentiment_training.py
 
 import os
+import time
 import pickle
+import argparse
 from collections import Counter
 import pandas as pd
 from sklearn.model_selection import train_test_split
@@ -15,30 +17,44 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from app import create_app, db
 from app.models.ecommerce_models import Feedback
+from app.services.artifact_registry import get_registry
+from app.services.training_snapshot import read_table, resolve_snapshot
+from sqlalchemy import func
 from config import DevelopmentConfig 
 
 # ---------------------------------------------------------
 # 1️⃣ Tạo app context để truy cập database
 # ---------------------------------------------------------
+parser = argparse.ArgumentParser(description="Train the feedback sentiment model.")
+parser.add_argument('--snapshot', default=None,
+                    help="Đọc feedback từ snapshot training ('current' hoặc version) thay vì query DB")
+args = parser.parse_args()
+
 app = create_app(DevelopmentConfig) 
 app.app_context().push()
 
 print("🔹 Starting Sentiment Model Training...")
+started = time.perf_counter()
 
 # ---------------------------------------------------------
 # 2️⃣ Tải dữ liệu feedback từ database
 # ---------------------------------------------------------
 # (Code của bạn ở đây rất tốt, giữ nguyên)
-feedbacks = Feedback.query.all()
-if not feedbacks:
+snapshot = resolve_snapshot(args.snapshot) if args.snapshot else None
+if snapshot:
+    feedback_table = read_table("feedback", ["id", "product_id", "comment", "rating", "created_at"], snapshot)
+    data = feedback_table.select(["id", "product_id", "comment", "rating"]).to_pandas()
+else:
+    feedbacks = Feedback.query.all()
+    data = pd.DataFrame(
+        [(f.id, f.product_id, f.comment, f.rating) for f in feedbacks],
+        columns=["id", "product_id", "comment", "rating"]
+    )
+if data.empty:
     print("⚠️ No feedback found in the database.")
     exit()
 
-data = pd.DataFrame(
-    [(f.id, f.product_id, f.comment, f.rating) for f in feedbacks],
-    columns=["id", "product_id", "comment", "rating"]
-)
-print(f"📦 Loaded {len(data)} feedback entries from database.")
+print(f"📦 Loaded {len(data)} feedback entries from {'snapshot ' + snapshot if snapshot else 'database'}.")
 
 # ---------------------------------------------------------
 # 3️⃣ Tiền xử lý và gán nhãn cảm xúc (positive / neutral / negative)
@@ -97,16 +113,19 @@ print("\n--- Model Evaluation ---")
 print(classification_report(y_test, y_pred, zero_division=0))
 
 # ---------------------------------------------------------
-# 7️⃣ Lưu mô hình vào instance/sentiment/
+# 7️⃣ Lưu mô hình thành version mới trong registry instance/sentiment/ rồi publish
 # ---------------------------------------------------------
-base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-model_dir = os.path.join(base_dir, "instance", "sentiment")
-model_path = os.path.join(model_dir, "sentiment_model.pkl")
-
-os.makedirs(model_dir, exist_ok=True)
-
-with open(model_path, "wb") as f:
-    pickle.dump(model, f)
-
-print(f"\n✅ Model saved successfully to: {model_path}")
-print("🎉 Sentiment Analysis training job completed successfully.\n")
\ No newline at end of file
+sentiment_registry = get_registry("sentiment")
+if snapshot:
+    watermark = feedback_table.column("created_at").to_pandas().max()
+else:
+    watermark = db.session.query(func.max(Feedback.created_at)).scalar()
+
+with sentiment_registry.begin(started=started) as build:
+    with open(build.path("sentiment_model.pkl"), "wb") as f:
+        pickle.dump(model, f)
+    manifest = build.commit(rows=len(data), watermark=watermark, meta={"test_samples": len(X_test), "snapshot": snapshot})
+sentiment_registry.publish(manifest["version"])
+
+print(f"\n✅ Model saved successfully to: {sentiment_registry.version_dir(manifest['version'])}")
+print("🎉 Sentiment Analysis training job completed successfully.\n")
@@ -1,5 +1,9 @@
 import sys
 import os
+import time
+import argparse
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
 
 # Thêm thư mục /app vào Python path để có thể import
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -9,25 +13,105 @@ from config import DevelopmentConfig
 from app import create_app, db
 from app.services.recommendation_service import build_similarity_matrix
 from app.services.recommendation_service import build_collaborative_model
+from app.services.recommendation_service import build_bought_together_model
+from app.services.recommendation_service import precompute_user_recommendations
+from app.services.recommendation_service import publish_staged_artifact, discard_staged_artifact
+from app.services.training_snapshot import export_snapshot, resolve_snapshot
 
+# Các model không phụ thuộc nhau -> build song song, mỗi stage 1 process
+TRAINING_STAGES = {
+    'content-based': build_similarity_matrix,
+    'collaborative-filtering': build_collaborative_model,
+    'bought-together': build_bought_together_model,
+}
 
-def run_job():
+
+def _run_stage(stage_name, snapshot):
+    """
+    Chạy trong process con: tạo app riêng (connection DB riêng) và build model ở chế độ staged,
+    chưa thay model đang được serve. Dữ liệu training đọc từ snapshot, không query DB.
+    """
+    app = create_app(DevelopmentConfig)
+    with app.app_context():
+        started = time.perf_counter()
+        try:
+            staged = TRAINING_STAGES[stage_name](publish=False, snapshot=snapshot)
+        finally:
+            db.session.remove()
+            db.engine.dispose()
+    return staged, time.perf_counter() - started
+
+
+def _prepare_snapshot(snapshot):
+    """ Quét DB 1 lần cho cả chu kỳ training (snapshot=None), hoặc dùng lại snapshot đã export. """
+    if snapshot:
+        snapshot = resolve_snapshot(snapshot)
+        print(f"[INFO] Reusing training snapshot {snapshot}")
+        return snapshot
+    app = create_app(DevelopmentConfig)
+    with app.app_context():
+        started = time.perf_counter()
+        manifest = export_snapshot()
+        print(f"[INFO] Stage 'snapshot' finished in {time.perf_counter() - started:.2f}s")
+        db.session.remove()
+        db.engine.dispose()
+    return manifest['version']
+
+
+def run_job(snapshot=None):
     print("Starting recommendation model training job...")
-    
-    # Tạo app context để có thể truy cập database
+    job_started = time.perf_counter()
+    try:
+        snapshot = _prepare_snapshot(snapshot)
+    except Exception as e:
+        print(f"An error occurred while preparing the training snapshot: {e}")
+        sys.exit(1)
+
+    # spawn: process con không kế thừa connection DB / thread của process cha
+    results, errors = {}, {}
+    with ProcessPoolExecutor(max_workers=len(TRAINING_STAGES), mp_context=mp.get_context('spawn')) as pool:
+        futures = {name: pool.submit(_run_stage, name, snapshot) for name in TRAINING_STAGES}
+        for name, future in futures.items():
+            try:
+                staged, seconds = future.result()
+            except Exception as e:
+                errors[name] = str(e)
+                continue
+            if staged is None:
+                errors[name] = "stage did not produce a model (see log above)"
+                continue
+            results[name] = staged
+            print(f"[INFO] Stage '{name}' finished in {seconds:.2f}s")
+
+    # Atomic: chỉ publish khi mọi stage thành công, nếu không thì bỏ hết kết quả staged
+    if errors:
+        for staged in results.values():
+            discard_staged_artifact(staged)
+        for name, error in errors.items():
+            print(f"An error occurred during stage '{name}': {error}")
+        print("Training job failed, keeping the currently deployed models.")
+        sys.exit(1)
+
+    for staged in results.values():
+        publish_staged_artifact(staged)
+    print(f"[INFO] Published {len(results)} models after {time.perf_counter() - job_started:.2f}s")
+
+    # Precompute dùng model CF vừa publish nên chạy sau. Model mới đã live nên lỗi ở đây không làm job thất bại:
+    # user chưa có danh sách precompute (key gắn version mới) được tính trực tiếp khi request
     app = create_app(DevelopmentConfig)
     with app.app_context():
         try:
-            print("\n--- Building Content-Based Model ---")
-            build_similarity_matrix()
-            
-            print("\n--- Building Collaborative-Filtering Model ---")
-            build_collaborative_model()
-            
-            print("Training jobs completed successfully.")  
+            print("\n--- Precomputing For-You Recommendations ---")
+            started = time.perf_counter()
+            precompute_user_recommendations()
+            print(f"[INFO] Stage 'precompute' finished in {time.perf_counter() - started:.2f}s")
         except Exception as e:
-            print(f"An error occurred during the training job: {e}")
-            sys.exit(1)
+            print(f"[WARN] Stage 'precompute' failed, recommendations will be computed on request: {e}")
+
+    print(f"Training jobs completed successfully in {time.perf_counter() - job_started:.2f}s.")
 
 if __name__ == "__main__":
-    run_job()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Train recommendation models from a training snapshot.")
+    parser.add_argument('--snapshot', default=None,
+                        help="Dùng lại snapshot đã export ('current' hoặc version) thay vì export snapshot mới")
+    run_job(parser.parse_args().snapshot)
@@ -0,0 +1,58 @@
+import os
+import sys
+import datetime
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config import Config
+from app import create_app, db
+from app.models import Role, User, Category, Brand, Product, Interaction, InteractionType
+
+
+class TestConfig(Config):
+    TESTING = True
+    SECRET_KEY = JWT_SECRET_KEY = 'test-secret-key-for-jwt-signing-0123456789'
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    # Không có Redis khi chạy test: các service phải tự fallback sang SQL
+    REDIS_URL = 'redis://127.0.0.1:1/0'
+    RECOMMEND_HYBRID_BUDGETS_MS = {'cf': 50, 'session': 50, 'content': 50, 'popular': 50}
+
+
+@pytest.fixture
+def app():
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.session.add(Role(id=1, name='user'))
+        category, brand = Category(name='Whey'), Brand(name='Brand')
+        db.session.add_all([category, brand])
+        db.session.flush()
+        for i in range(10):
+            db.session.add(Product(name=f'product {i}', desc='', package_quantity=1, package_unit='kg',
+                                   serving_quantity=1, serving_unit='g', price=10,
+                                   category_id=category.id, brand_id=brand.id))
+        db.session.add(User(id=1, role_id=1, email='buyer@example.com', password_hash='x'))
+        db.session.add(User(id=2, role_id=1, email='new@example.com', password_hash='x'))
+        db.session.flush()
+        # Sản phẩm 3 bán chạy nhất, rồi đến 7
+        for product_id in (3, 3, 3, 7, 7):
+            db.session.add(Interaction(user_id=1, product_id=product_id, type=InteractionType.PURCHASE,
+                                       timestamp=datetime.datetime.now()))
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def auth_headers(app):
+    def make(user_id):
+        return {'Authorization': f'Bearer {create_access_token(identity=str(user_id))}'}
+    return make
@@ -0,0 +1,28 @@
+import time
+
+from app.services import recommendation_service
+
+
+def test_for_you_falls_back_to_top_products_when_every_source_is_empty(client, auth_headers, monkeypatch):
+    def slow_source(user_id, n_candidates):
+        time.sleep(0.2)
+        return [1, 2]
+
+    monkeypatch.setitem(recommendation_service.HYBRID_SOURCES, 'cf', slow_source)
+    monkeypatch.setitem(recommendation_service.HYBRID_SOURCES, 'popular', slow_source)
+    monkeypatch.setitem(recommendation_service.HYBRID_SOURCES, 'session', lambda user_id, n: [])
+    monkeypatch.setitem(recommendation_service.HYBRID_SOURCES, 'content', lambda user_id, n: [])
+
+    response = client.get('/api/recommend/for-you', headers=auth_headers(2))
+
+    assert response.status_code == 200
+    assert [product['id'] for product in response.get_json()][:2] == ['3', '7']
+
+
+def test_top_products_rejects_non_positive_days(client):
+    for days in (0, -3):
+        assert client.get(f'/api/recommend/top-products?days={days}').status_code == 400
+
+    response = client.get('/api/recommend/top-products?days=7')
+    assert response.status_code == 200
+    assert [product['id'] for product in response.get_json()][:2] == ['3', '7']